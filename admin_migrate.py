@@ -345,3 +345,530 @@ def migrate_ops_final_resources(
         message="Migración ops_final_resources aplicada.",
         created=applied,
     )
+
+
+# =========================================================
+# MIGRACIÓN: documents.source_hash (caché PDF autorización)
+# =========================================================
+
+@router.post("/documents_source_hash", response_model=MigrateResponse)
+def migrate_documents_source_hash(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "documents_source_hash",
+            "ALTER TABLE documents ADD COLUMN IF NOT EXISTS source_hash TEXT;",
+        ),
+        (
+            "idx_documents_case_kind_created",
+            """
+            CREATE INDEX IF NOT EXISTS idx_documents_case_kind_created
+            ON documents(case_id, kind, created_at DESC);
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(
+        ok=True,
+        message="Migración documents_source_hash aplicada.",
+        created=applied,
+    )
+
+
+# =========================================================
+# MIGRACIÓN: estado consolidado "Eliminar coche"
+# =========================================================
+
+@router.post("/vehicle_removal_requests", response_model=MigrateResponse)
+def migrate_vehicle_removal_requests(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    from vehicle_removal_state import backfill_vehicle_removal_state
+    engine = get_engine()
+
+    ddl = [
+        (
+            "vehicle_removal_requests_table",
+            """
+            CREATE TABLE IF NOT EXISTS vehicle_removal_requests (
+              case_id UUID PRIMARY KEY REFERENCES cases(id) ON DELETE CASCADE,
+              status TEXT,
+              payment_status TEXT,
+              contact_email TEXT,
+              data JSONB NOT NULL DEFAULT '{}'::jsonb,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+        ),
+        (
+            "idx_vehicle_removal_requests_updated",
+            """
+            CREATE INDEX IF NOT EXISTS idx_vehicle_removal_requests_updated
+            ON vehicle_removal_requests(updated_at DESC, case_id DESC);
+            """,
+        ),
+        (
+            "idx_vehicle_removal_requests_status_updated",
+            """
+            CREATE INDEX IF NOT EXISTS idx_vehicle_removal_requests_status_updated
+            ON vehicle_removal_requests(status, updated_at DESC, case_id DESC);
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+
+    with engine.begin() as conn:
+        backfilled = backfill_vehicle_removal_state(conn)
+    applied.append(f"vehicle_removal_requests_backfill:{backfilled}")
+
+    return MigrateResponse(
+        ok=True,
+        message="Migración vehicle_removal_requests aplicada.",
+        created=applied,
+    )
+
+
+# =========================================================
+# MIGRACIÓN: cola de emails salientes
+# =========================================================
+
+@router.post("/email_outbox", response_model=MigrateResponse)
+def migrate_email_outbox(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "email_outbox_table",
+            """
+            CREATE TABLE IF NOT EXISTS email_outbox (
+              id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+              case_id UUID REFERENCES cases(id) ON DELETE SET NULL,
+              kind TEXT,
+              to_email TEXT NOT NULL,
+              reply_to TEXT,
+              subject TEXT NOT NULL,
+              body TEXT NOT NULL,
+              status TEXT NOT NULL DEFAULT 'pending',
+              attempts INT NOT NULL DEFAULT 0,
+              last_error TEXT,
+              next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              locked_at TIMESTAMPTZ,
+              sent_at TIMESTAMPTZ,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+        ),
+        (
+            "idx_email_outbox_due",
+            """
+            CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+            ON email_outbox(next_attempt_at)
+            WHERE status IN ('pending', 'retry', 'sending');
+            """,
+        ),
+        ("idx_email_outbox_case", "CREATE INDEX IF NOT EXISTS idx_email_outbox_case ON email_outbox(case_id);"),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración email_outbox aplicada.", created=applied)
+
+
+@router.post("/work_queue", response_model=MigrateResponse)
+def migrate_work_queue(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "work_queue_table",
+            """
+            CREATE TABLE IF NOT EXISTS work_queue (
+              id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+              case_id UUID NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
+              kind TEXT NOT NULL,
+              payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+              base_class TEXT NOT NULL DEFAULT 'standard',
+              base_score INT NOT NULL DEFAULT 0,
+              deadline DATE,
+              status TEXT NOT NULL DEFAULT 'queued',
+              claimed_class TEXT,
+              attempts INT NOT NULL DEFAULT 0,
+              last_error TEXT,
+              not_before TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              enqueued_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              started_at TIMESTAMPTZ,
+              finished_at TIMESTAMPTZ
+            );
+            """,
+        ),
+        (
+            "uq_work_queue_active",
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_work_queue_active
+            ON work_queue(case_id, kind)
+            WHERE status IN ('queued', 'running');
+            """,
+        ),
+        (
+            "idx_work_queue_due",
+            """
+            CREATE INDEX IF NOT EXISTS idx_work_queue_due
+            ON work_queue(kind, not_before)
+            WHERE status IN ('queued', 'running');
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración work_queue aplicada.", created=applied)
+
+
+@router.post("/ai_runs", response_model=MigrateResponse)
+def migrate_ai_runs(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "ai_runs_table",
+            """
+            CREATE TABLE IF NOT EXISTS ai_runs (
+              id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+              case_id UUID NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
+              sha256 TEXT NOT NULL,
+              result JSONB NOT NULL,
+              prompt_versions JSONB NOT NULL DEFAULT '{}'::jsonb,
+              size_bytes INT NOT NULL DEFAULT 0,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+        ),
+        ("uq_ai_runs_sha256", "CREATE UNIQUE INDEX IF NOT EXISTS uq_ai_runs_sha256 ON ai_runs(sha256);"),
+        ("idx_ai_runs_case", "CREATE INDEX IF NOT EXISTS idx_ai_runs_case ON ai_runs(case_id, created_at DESC);"),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración ai_runs aplicada.", created=applied)
+
+
+@router.post("/events_partitioned", response_model=MigrateResponse)
+def migrate_events_partitioned(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """
+    Convierte events en tabla particionada por mes (created_at) y copia los datos.
+    Idempotente: si ya está particionada solo crea las particiones que falten.
+    """
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    from event_partitions import convert_events_table, ensure_partitions
+    engine = get_engine()
+
+    with engine.begin() as conn:
+        applied = convert_events_table(conn)
+    applied += ensure_partitions()
+    return MigrateResponse(ok=True, message="Migración events particionada aplicada.", created=applied)
+
+
+@router.post("/partner_cases_listing", response_model=MigrateResponse)
+def migrate_partner_cases_listing(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """Índices del listado de asesorías: keyset (partner_id, updated_at, id) y búsqueda trigram."""
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    from partner import partner_case_search_sql
+    engine = get_engine()
+
+    ddl = [
+        ("pg_trgm", "CREATE EXTENSION IF NOT EXISTS pg_trgm;"),
+        (
+            "idx_cases_partner_updated",
+            """
+            CREATE INDEX IF NOT EXISTS idx_cases_partner_updated
+            ON cases(partner_id, updated_at DESC, id DESC)
+            WHERE partner_id IS NOT NULL;
+            """,
+        ),
+        (
+            "idx_cases_partner_search_trgm",
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_cases_partner_search_trgm
+            ON cases USING gin (({partner_case_search_sql(prefix="")}) gin_trgm_ops)
+            WHERE partner_id IS NOT NULL;
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración partner_cases_listing aplicada.", created=applied)
+
+
+@router.post("/openai_rate_usage", response_model=MigrateResponse)
+def migrate_openai_rate_usage(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "openai_rate_usage_table",
+            """
+            CREATE TABLE IF NOT EXISTS openai_rate_usage (
+              model TEXT NOT NULL,
+              minute TIMESTAMPTZ NOT NULL,
+              tokens BIGINT NOT NULL DEFAULT 0,
+              PRIMARY KEY (model, minute)
+            );
+            """,
+        ),
+        (
+            "openai_rate_usage_cleanup",
+            "DELETE FROM openai_rate_usage WHERE minute < NOW() - INTERVAL '1 day';",
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración openai_rate_usage aplicada.", created=applied)
+
+
+@router.post("/partner_batches", response_model=MigrateResponse)
+def migrate_partner_batches(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """Lotes de alta masiva de asesorías + índice sha256 de documents (deduplicación)."""
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "partner_batches_table",
+            """
+            CREATE TABLE IF NOT EXISTS partner_batches (
+              id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+              partner_id UUID NOT NULL REFERENCES partners(id),
+              status TEXT NOT NULL DEFAULT 'processing',
+              total INT NOT NULL DEFAULT 0,
+              created INT NOT NULL DEFAULT 0,
+              duplicates INT NOT NULL DEFAULT 0,
+              failed INT NOT NULL DEFAULT 0,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              finished_at TIMESTAMPTZ
+            );
+            """,
+        ),
+        (
+            "idx_partner_batches_partner",
+            "CREATE INDEX IF NOT EXISTS idx_partner_batches_partner ON partner_batches(partner_id, created_at DESC);",
+        ),
+        (
+            "partner_batch_items_table",
+            """
+            CREATE TABLE IF NOT EXISTS partner_batch_items (
+              batch_id UUID NOT NULL REFERENCES partner_batches(id) ON DELETE CASCADE,
+              idx INT NOT NULL,
+              ref TEXT,
+              status TEXT NOT NULL DEFAULT 'pending',
+              case_id UUID REFERENCES cases(id) ON DELETE SET NULL,
+              duplicate_of_case_id UUID,
+              error TEXT,
+              documents JSONB NOT NULL DEFAULT '[]'::jsonb,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              PRIMARY KEY (batch_id, idx)
+            );
+            """,
+        ),
+        (
+            "idx_documents_sha256",
+            """
+            CREATE INDEX IF NOT EXISTS idx_documents_sha256
+            ON documents(sha256)
+            WHERE sha256 IS NOT NULL;
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración partner_batches aplicada.", created=applied)
+
+
+@router.post("/partners_api_token_index", response_model=MigrateResponse)
+def migrate_partners_api_token_index(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """Índice de partners.api_token (tablas creadas antes de la columna UNIQUE)."""
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "idx_partners_api_token",
+            """
+            CREATE INDEX IF NOT EXISTS idx_partners_api_token
+            ON partners(api_token)
+            WHERE api_token IS NOT NULL;
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración partners_api_token_index aplicada.", created=applied)
+
+
+@router.post("/restaurant_reservations_day_index", response_model=MigrateResponse)
+def migrate_restaurant_reservations_day_index(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """Índice del listado por día/turno de las tablets (y de su versión para ETag/feed)."""
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "idx_restaurant_reservations_day",
+            """
+            CREATE INDEX IF NOT EXISTS idx_restaurant_reservations_day
+            ON restaurant_reservations(restaurant_id, reservation_date, shift, reservation_time, created_at)
+            INCLUDE (updated_at);
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración restaurant_reservations_day_index aplicada.", created=applied)
+
+
+@router.post("/extractions_case_latest", response_model=MigrateResponse)
+def migrate_extractions_case_latest(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """Última extracción por caso (versión/ETag de public-status y detalle de operador)."""
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "idx_extractions_case_created",
+            """
+            CREATE INDEX IF NOT EXISTS idx_extractions_case_created
+            ON extractions(case_id, created_at DESC)
+            INCLUDE (id);
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración extractions_case_latest aplicada.", created=applied)
+
+
+@router.post("/case_notify", response_model=MigrateResponse)
+def migrate_case_notify(
+    x_admin_token: str | None = Header(default=None, alias="x-admin-token")
+):
+    """Triggers NOTIFY case_changes en cases y events (ver case_bus.py). Tras /events_partitioned."""
+    _require_admin_token(x_admin_token)
+
+    from database import get_engine
+    engine = get_engine()
+
+    ddl = [
+        (
+            "fn_notify_case_change",
+            """
+            CREATE OR REPLACE FUNCTION notify_case_change() RETURNS trigger AS $$
+            BEGIN
+              IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+                RETURN NULL;
+              END IF;
+              PERFORM pg_notify('case_changes', CAST(json_build_object(
+                'table', 'cases',
+                'op', lower(TG_OP),
+                'case_id', CAST(NEW.id AS TEXT),
+                'partner_id', CAST(NEW.partner_id AS TEXT),
+                'status', NEW.status,
+                'payment_status', NEW.payment_status
+              ) AS TEXT));
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+        ),
+        ("drop_trg_cases_notify", "DROP TRIGGER IF EXISTS trg_cases_notify ON cases;"),
+        (
+            "trg_cases_notify",
+            """
+            CREATE TRIGGER trg_cases_notify
+            AFTER INSERT OR UPDATE ON cases
+            FOR EACH ROW EXECUTE FUNCTION notify_case_change();
+            """,
+        ),
+        (
+            "fn_notify_case_event",
+            """
+            CREATE OR REPLACE FUNCTION notify_case_event() RETURNS trigger AS $$
+            BEGIN
+              PERFORM pg_notify('case_changes', CAST(json_build_object(
+                'table', 'events',
+                'op', 'insert',
+                'case_id', CAST(NEW.case_id AS TEXT),
+                'partner_id', (SELECT CAST(c.partner_id AS TEXT) FROM cases c WHERE c.id = NEW.case_id),
+                'type', NEW.type
+              ) AS TEXT));
+              RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+        ),
+        # events particionada (PG >= 11): el trigger del padre se aplica a todas las particiones
+        ("drop_trg_events_notify", "DROP TRIGGER IF EXISTS trg_events_notify ON events;"),
+        (
+            "trg_events_notify",
+            """
+            CREATE TRIGGER trg_events_notify
+            AFTER INSERT ON events
+            FOR EACH ROW EXECUTE FUNCTION notify_case_event();
+            """,
+        ),
+    ]
+
+    applied = _run(engine, ddl)
+    return MigrateResponse(ok=True, message="Migración case_notify aplicada.", created=applied)
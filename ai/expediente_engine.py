@@ -4,7 +4,6 @@ from typing import Any, Dict, List, Optional
 
 from sqlalchemy import text
 from database import get_engine
-from openai import OpenAI
 
 from ai.text_loader import load_text_from_b2
 from ai.prompts.classify_documents import PROMPT as PROMPT_CLASSIFY
@@ -13,21 +12,34 @@ from ai.prompts.procedure_phase import PROMPT as PROMPT_PHASE
 from ai.prompts.admissibility_guard import PROMPT as PROMPT_GUARD
 from ai.prompts.draft_recurso_v2 import PROMPT as PROMPT_DRAFT
 
+from ai.prompts.assembly import register_prompt
+from ai_runs import store_ai_run, summarize_result
+from event_log import append_event, emit_async
+from llm_client import chat_json
+from telemetry import set_trace_case, span
+
 MAX_EXCERPT_CHARS = 12000
 
+# Prompts estáticos por stage (system, byte a byte idénticos → prefix caching)
+STAGE_CLASSIFY = "classify_documents"
+STAGE_TIMELINE = "timeline_builder"
+STAGE_PHASE = "procedure_phase"
+STAGE_GUARD = "admissibility_guard"
+STAGE_DRAFT = "draft_recurso_v2"
+
+register_prompt(STAGE_CLASSIFY, PROMPT_CLASSIFY)
+register_prompt(STAGE_TIMELINE, PROMPT_TIMELINE)
+register_prompt(STAGE_PHASE, PROMPT_PHASE)
+register_prompt(STAGE_GUARD, PROMPT_GUARD)
+register_prompt(STAGE_DRAFT, PROMPT_DRAFT)
 
-def _llm_json(prompt: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    resp = client.chat.completions.create(
-        model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
-        ],
-        temperature=0.0,
-        response_format={"type": "json_object"},
-    )
-    return json.loads(resp.choices[0].message.content)
+
+def _llm_json(stage: str, payload: Dict[str, Any], usage: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    stage_usage: Dict[str, Any] = {}
+    out = chat_json(stage, payload, usage_out=stage_usage)
+    if usage is not None:
+        usage[stage] = stage_usage
+    return out
 
 
 def _save_event(case_id: str, event_type: str, payload: Dict[str, Any]) -> None:
@@ -405,7 +417,10 @@ def _build_panel_fields(extraction_core: Dict[str, Any], classify: Dict[str, Any
 
 
 def run_expediente_ai(case_id: str) -> Dict[str, Any]:
-    docs = _load_case_documents(case_id)
+    set_trace_case(case_id)
+    with span("stage", "expediente.load_documents") as sp:
+        docs = _load_case_documents(case_id)
+        sp.bytes = sum(len(d.get("text_excerpt") or "") for d in docs if isinstance(d, dict))
     if not docs:
         raise RuntimeError("No hay documentos asociados al expediente.")
 
@@ -413,24 +428,28 @@ def run_expediente_ai(case_id: str) -> Dict[str, Any]:
     extraction_core = (extraction_wrapper.get("extracted") or {}) if isinstance(extraction_wrapper, dict) else {}
 
     capture_mode = _detect_capture_mode(docs, extraction_core)
+    llm_usage: Dict[str, Any] = {}
 
     classify = _llm_json(
-        PROMPT_CLASSIFY,
+        STAGE_CLASSIFY,
         {"case_id": case_id, "documents": docs, "latest_extraction": extraction_wrapper},
+        llm_usage,
     )
 
     timeline = _llm_json(
-        PROMPT_TIMELINE,
+        STAGE_TIMELINE,
         {"case_id": case_id, "classification": classify, "documents": docs, "latest_extraction": extraction_wrapper},
+        llm_usage,
     )
 
     phase = _llm_json(
-        PROMPT_PHASE,
+        STAGE_PHASE,
         {"case_id": case_id, "classification": classify, "timeline": timeline, "latest_extraction": extraction_wrapper},
+        llm_usage,
     )
 
     admissibility = _llm_json(
-        PROMPT_GUARD,
+        STAGE_GUARD,
         {
             "case_id": case_id,
             "recommended_action": phase,
@@ -438,6 +457,7 @@ def run_expediente_ai(case_id: str) -> Dict[str, Any]:
             "classification": classify,
             "latest_extraction": extraction_wrapper,
         },
+        llm_usage,
     )
 
     flags = _load_case_flags(case_id)
@@ -479,7 +499,7 @@ def run_expediente_ai(case_id: str) -> Dict[str, Any]:
     if bool(admissibility.get("can_generate_draft")) or (admissibility.get("admissibility") or "").upper() == "ADMISSIBLE":
         interested_data = _load_interested_data(case_id)
         draft = _llm_json(
-            PROMPT_DRAFT,
+            STAGE_DRAFT,
             {
                 "case_id": case_id,
                 "interested_data": interested_data,
@@ -498,6 +518,7 @@ def run_expediente_ai(case_id: str) -> Dict[str, Any]:
                     "override_mode": admissibility.get("override_mode"),
                 },
             },
+            llm_usage,
         )
 
     panel_fields = _build_panel_fields(extraction_core, classify, phase, admissibility)
@@ -530,5 +551,23 @@ def run_expediente_ai(case_id: str) -> Dict[str, Any]:
         },
     }
 
-    _save_event(case_id, "ai_expediente_result", result)
+    result["prompt_versions"] = {stage: u.get("prompt_version") for stage, u in llm_usage.items()}
+
+    # Telemetría no crítica: tokens y tokens cacheados por stage
+    emit_async(
+        case_id,
+        "ai_llm_usage",
+        {
+            "stages": llm_usage,
+            "prompt_tokens": sum(int(u.get("prompt_tokens") or 0) for u in llm_usage.values()),
+            "cached_tokens": sum(int(u.get("cached_tokens") or 0) for u in llm_usage.values()),
+            "cost_usd": round(sum(float(u.get("cost_usd") or 0) for u in llm_usage.values()), 6),
+        },
+    )
+
+    # Resultado completo una sola vez en ai_runs; el evento lleva la proyección compacta
+    engine = get_engine()
+    with engine.begin() as conn:
+        result.update(store_ai_run(conn, case_id, result))
+        append_event(conn, case_id, "ai_expediente_result", summarize_result(result))
     return result
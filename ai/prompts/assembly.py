@@ -0,0 +1,111 @@
+# ai/prompts/assembly.py
+# Ensamblado de prompts para aprovechar el prompt-prefix caching del proveedor.
+#
+# Regla: lo estático va primero y siempre byte a byte idéntico (system = instrucciones
+# del stage); lo volátil del caso va al final (user = datos del expediente, con case_id
+# en última posición). Cada prompt tiene una versión (hash del texto) que se guarda en
+# los eventos, y se acumulan métricas de tokens cacheados por stage.
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+# Claves del payload que cambian en cada caso y deben ir al final del mensaje
+_VOLATILE_KEYS = ("case_id",)
+
+_registry: Dict[str, Dict[str, str]] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def register_prompt(stage: str, prompt: str) -> str:
+    """Registra el texto estático de un stage y devuelve su versión."""
+    version = prompt_version(prompt)
+    _registry[stage] = {"prompt": prompt, "version": version}
+    return version
+
+
+def get_prompt(stage: str) -> Dict[str, str]:
+    return _registry[stage]
+
+
+def prompt_versions() -> Dict[str, str]:
+    return {stage: p["version"] for stage, p in _registry.items()}
+
+
+def dynamic_json(payload: Dict[str, Any]) -> str:
+    """
+    Serializa los datos del caso de forma determinista: claves estables primero
+    (en el orden del llamador) y las volátiles (case_id) al final.
+    """
+    ordered = {k: v for k, v in (payload or {}).items() if k not in _VOLATILE_KEYS}
+    for k in _VOLATILE_KEYS:
+        if k in (payload or {}):
+            ordered[k] = payload[k]
+    return json.dumps(ordered, ensure_ascii=False, default=str)
+
+
+def build_messages(stage: str, dynamic: Any) -> List[Dict[str, str]]:
+    """
+    Mensajes chat: system = prompt estático registrado; user = datos del caso.
+    dynamic puede ser un dict (se serializa con dynamic_json) o texto ya preparado.
+    """
+    static = get_prompt(stage)["prompt"]
+    user = dynamic if isinstance(dynamic, str) else dynamic_json(dynamic)
+    return [
+        {"role": "system", "content": static},
+        {"role": "user", "content": user},
+    ]
+
+
+def record_usage(stage: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int = 0) -> None:
+    with _stats_lock:
+        st = _stats.setdefault(
+            stage,
+            {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cache_hits": 0},
+        )
+        st["calls"] += 1
+        st["prompt_tokens"] += int(prompt_tokens or 0)
+        st["cached_tokens"] += int(cached_tokens or 0)
+        st["completion_tokens"] += int(completion_tokens or 0)
+        if cached_tokens:
+            st["cache_hits"] += 1
+
+
+def usage_from_response(usage: Any) -> Dict[str, int]:
+    """
+    Normaliza el uso de tokens de Chat Completions (objeto o dict) y de la
+    Responses API (input_tokens / input_tokens_details.cached_tokens).
+    """
+    if usage is None:
+        return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+    def _get(obj: Any, name: str) -> Any:
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    prompt_tokens = _get(usage, "prompt_tokens") or _get(usage, "input_tokens") or 0
+    completion_tokens = _get(usage, "completion_tokens") or _get(usage, "output_tokens") or 0
+    details = _get(usage, "prompt_tokens_details") or _get(usage, "input_tokens_details")
+    cached_tokens = (_get(details, "cached_tokens") if details is not None else 0) or 0
+    return {
+        "prompt_tokens": int(prompt_tokens),
+        "cached_tokens": int(cached_tokens),
+        "completion_tokens": int(completion_tokens),
+    }
+
+
+def cache_stats(stage: Optional[str] = None) -> Dict[str, Any]:
+    """Métricas acumuladas en el proceso: ratio de tokens cacheados por stage."""
+    with _stats_lock:
+        items = {k: dict(v) for k, v in _stats.items() if stage is None or k == stage}
+    for st in items.values():
+        pt = st["prompt_tokens"]
+        st["cached_ratio"] = round(st["cached_tokens"] / pt, 4) if pt else 0.0
+    return {"versions": prompt_versions(), "stages": items}
@@ -6,6 +6,8 @@ from sqlalchemy import text
 
 from database import get_engine
 from ai.expediente_engine import run_expediente_ai
+from ai.prompts.assembly import cache_stats
+from openai_limiter import PRIORITY_OPERATOR, OpenAIBusy, openai_priority
 from generate import generate_dgt_for_case
 
 router = APIRouter(prefix="/ai", tags=["ai"])
@@ -139,7 +141,7 @@ def _normalize_ai_payload(result):
     hecho_str = _as_string(hecho)
     admisibilidad_str = _as_string(admisibilidad)
 
-    return {
+    payload = {
         "familia": familia_str,
         "confianza": confianza_num,
         "hecho": hecho_str,
@@ -153,14 +155,21 @@ def _normalize_ai_payload(result):
         "tipo_infraccion": familia_str,
         "tipo_infraccion_confidence": confianza_num,
         "hecho_imputado": hecho_str,
-        "raw_result": result,
     }
+    # El resultado completo ya está en ai_runs: el evento solo guarda la referencia
+    if result.get("ai_run_id"):
+        payload["ai_run_id"] = result["ai_run_id"]
+        payload["ai_run_sha256"] = result.get("ai_run_sha256")
+    else:
+        payload["raw_result"] = result
+    return payload
 
 
 @router.post("/expediente/run")
 def run_ai(req: RunExpedienteAI):
     try:
-        result = run_expediente_ai(req.case_id)
+        with openai_priority(PRIORITY_OPERATOR):
+            result = run_expediente_ai(req.case_id)
         if not isinstance(result, dict):
             result = {"raw_result": result}
 
@@ -266,5 +275,13 @@ def run_ai(req: RunExpedienteAI):
             "result": result,
         }
 
+    except OpenAIBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error IA: {e}")
+
+
+@router.get("/prompt-cache/stats")
+def prompt_cache_stats():
+    # Métricas del proceso: versión de cada prompt y ratio de tokens cacheados por stage
+    return {"ok": True, **cache_stats()}
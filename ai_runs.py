@@ -0,0 +1,109 @@
+# ai_runs.py — resultado completo de run_expediente_ai guardado una sola vez (tabla ai_runs)
+#
+# El evento ai_expediente_result solo lleva una proyección compacta (campos del panel,
+# plazos, acción) y la referencia ai_run_id / ai_run_sha256. Las partes pesadas
+# (classify, timeline, phase, admissibility, attack_plan, draft) viven en ai_runs y se
+# leen bajo demanda con load_ai_run() o GET /ops/cases/{case_id}/ai-run.
+#
+# Eventos antiguos con raw_result embebido siguen funcionando: expand_raw_result()
+# devuelve raw_result si existe y si no carga la ejecución referenciada.
+import hashlib
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from event_log import dumps_payload
+
+HEAVY_KEYS = (
+    "classify",
+    "timeline",
+    "phase",
+    "admissibility",
+    "attack_plan",
+    "draft",
+    "facts_summary",
+    "extraction_debug",
+)
+
+# Trozos pequeños de las partes pesadas que los listados sí usan
+_SUMMARY_MAX_STR = 600
+
+
+def _short(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > _SUMMARY_MAX_STR:
+        return value[:_SUMMARY_MAX_STR]
+    return value
+
+
+def summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Proyección compacta para el evento: todo menos HEAVY_KEYS, más 3 campos derivados."""
+    summary = {k: _short(v) for k, v in result.items() if k not in HEAVY_KEYS}
+
+    admissibility = result.get("admissibility") if isinstance(result.get("admissibility"), dict) else {}
+    phase = result.get("phase") if isinstance(result.get("phase"), dict) else {}
+    summary["admissibility_summary"] = {
+        "admissibility": admissibility.get("admissibility"),
+        "can_generate_draft": admissibility.get("can_generate_draft"),
+        "override_applied": admissibility.get("override_applied"),
+    }
+    recommended = phase.get("recommended_action")
+    summary["recommended_action"] = recommended.get("action") if isinstance(recommended, dict) else _short(recommended)
+    summary["has_draft"] = bool(result.get("draft"))
+    return summary
+
+
+def store_ai_run(conn, case_id: str, result: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Guarda el resultado completo (deduplicado por sha256 del JSON) y devuelve la
+    referencia {ai_run_id, ai_run_sha256} para los eventos.
+    """
+    payload_json = dumps_payload(result)
+    sha256 = hashlib.sha256(payload_json.encode("utf-8")).hexdigest()
+    row = conn.execute(
+        text(
+            """
+            WITH ins AS (
+                INSERT INTO ai_runs (case_id, sha256, result, prompt_versions, size_bytes)
+                VALUES (:case_id, :sha256, CAST(:result AS JSONB), CAST(:pv AS JSONB), :size)
+                ON CONFLICT (sha256) DO NOTHING
+                RETURNING id
+            )
+            SELECT id FROM ins
+            UNION ALL
+            SELECT id FROM ai_runs WHERE sha256 = :sha256
+            LIMIT 1
+            """
+        ),
+        {
+            "case_id": case_id,
+            "sha256": sha256,
+            "result": payload_json,
+            "pv": dumps_payload(result.get("prompt_versions") or {}),
+            "size": len(payload_json),
+        },
+    ).fetchone()
+    return {"ai_run_id": str(row[0]), "ai_run_sha256": sha256}
+
+
+def load_ai_run(conn, run_id: str, part: Optional[str] = None) -> Optional[Any]:
+    """Resultado completo o solo una parte (part='draft', 'attack_plan', ...)."""
+    if part:
+        row = conn.execute(
+            text("SELECT result -> :part FROM ai_runs WHERE id = :id"),
+            {"id": run_id, "part": part},
+        ).fetchone()
+    else:
+        row = conn.execute(text("SELECT result FROM ai_runs WHERE id = :id"), {"id": run_id}).fetchone()
+    return row[0] if row else None
+
+
+def expand_raw_result(conn, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """raw_result del evento (formato antiguo) o el de la ejecución referenciada."""
+    raw = payload.get("raw_result")
+    if isinstance(raw, dict):
+        return raw
+    run_id = payload.get("ai_run_id")
+    if not run_id:
+        return {}
+    full = load_ai_run(conn, str(run_id))
+    return full if isinstance(full, dict) else {}
@@ -8,6 +8,7 @@ from fastapi import APIRouter, File, HTTPException, UploadFile
 from sqlalchemy import text
 
 from database import get_engine
+from event_log import EventBatch
 from b2_storage import upload_original
 from openai_vision import extract_from_image_bytes
 from text_extractors import (
@@ -17,6 +18,11 @@ from text_extractors import (
 )
 from openai_text import extract_from_text
 from hecho_imputado_engine import extract_hecho_imputado
+from deterministic_extract import extract_deterministic
+from llm_breaker import TEXT_BREAKER, VISION_BREAKER, LLMUnavailable
+from telemetry import set_trace_case, span
+from profiling import profiled
+from cpu_pool import run_cpu
 
 router = APIRouter(tags=["analyze"])
 
@@ -2463,6 +2469,7 @@ def _is_strong_semaforo_case(text_blob: str, core: Optional[Dict[str, Any]] = No
     return any(s in blob for s in signals)
 
 
+@profiled("analyze.triage")
 def _enrich_with_triage(extracted_core: Dict[str, Any], text_blob: str) -> Dict[str, Any]:
     out = dict(extracted_core or {})
 
@@ -2752,10 +2759,129 @@ def _ensure_raw_fields(core: Dict[str, Any], text_content: str = "") -> Dict[str
     return out
 
 
+def _llm_text(text_content: str, degraded: List[str]) -> Optional[Dict[str, Any]]:
+    try:
+        return TEXT_BREAKER.call(extract_from_text, text_content, timeout=TEXT_BREAKER.budget_seconds) or {}
+    except LLMUnavailable as e:
+        degraded.append(f"text:{e.reason}")
+        return None
+
+
+def _llm_vision(content: bytes, mime: str, filename: Optional[str], degraded: List[str]) -> Optional[Dict[str, Any]]:
+    try:
+        return VISION_BREAKER.call(
+            extract_from_image_bytes, content, mime, filename, timeout=VISION_BREAKER.budget_seconds
+        ) or {}
+    except LLMUnavailable as e:
+        degraded.append(f"vision:{e.reason}")
+        return None
+
+
+@profiled("analyze.extract_document")
+def _extract_document(content: bytes, mime: str, filename: Optional[str]) -> Tuple[Dict[str, Any], str, str, float]:
+    """
+    Extracción + triage de un documento. Devuelve (extracted_core, text_content, model, confidence).
+
+    Si el LLM no responde en su presupuesto o el breaker está abierto, el texto se extrae
+    en modo determinista y el resultado queda marcado con llm_enrichment_pending.
+    """
+    model_used = "mock"
+    confidence = 0.1
+    extracted_core: Dict[str, Any] = {}
+    text_content = ""
+    degraded: List[str] = []
+
+    if mime.startswith("image/"):
+        extracted_vision = _llm_vision(content, mime, filename, degraded)
+        if extracted_vision is None:
+            extracted_core = {"observaciones": "Extracción IA de imagen no disponible; pendiente de enriquecimiento IA."}
+            model_used = "deterministic"
+        else:
+            extracted_core = _ensure_raw_fields(extracted_vision, text_content="")
+            model_used = "openai_vision"
+            confidence = 0.7
+
+    elif mime == "application/pdf":
+        with span("stage", "analyze.pdf_text"):
+            text_content = run_cpu(extract_text_from_pdf_bytes, content)
+        _raise_if_generated_resource_text(text_content)
+
+        extracted_text: Dict[str, Any] = {}
+
+        if has_enough_text(text_content):
+            llm_text = _llm_text(text_content, degraded)
+            extracted_text = llm_text if llm_text is not None else extract_deterministic(text_content)
+            extracted_text = _ensure_raw_fields(extracted_text, text_content=text_content)
+
+        extracted_vision = _llm_vision(content, mime, filename, degraded)
+        if extracted_vision is None and not extracted_text and text_content:
+            extracted_text = _ensure_raw_fields(extract_deterministic(text_content), text_content=text_content)
+
+        blob_text = _flatten_text(extracted_text, text_content=text_content) if extracted_text else (text_content or "")
+        triaged_text = run_cpu(_enrich_with_triage, extracted_text or {}, blob_text)
+
+        if extracted_vision:
+            extracted_vision = _ensure_raw_fields(extracted_vision, text_content="")
+            blob_vision = _flatten_text(extracted_vision, text_content="")
+            triaged_vision = run_cpu(_enrich_with_triage, extracted_vision, blob_vision)
+            extracted_core = _merge_extracted(triaged_text, triaged_vision)
+        else:
+            extracted_core = triaged_text
+        extracted_core = _ensure_raw_fields(extracted_core, text_content=text_content)
+
+        if degraded:
+            model_used = "deterministic+openai_vision" if extracted_vision else "deterministic"
+            confidence = 0.6 if extracted_vision else 0.5
+        elif extracted_text and not _needs_speed_retry(extracted_core):
+            model_used = "openai_text"
+            confidence = 0.8
+        else:
+            model_used = "openai_vision+text"
+            confidence = 0.75
+
+    elif mime in DOCX_MIMES:
+        with span("stage", "analyze.docx_text"):
+            text_content = run_cpu(extract_text_from_docx_bytes, content)
+        _raise_if_generated_resource_text(text_content)
+        if has_enough_text(text_content):
+            llm_text = _llm_text(text_content, degraded)
+            if llm_text is None:
+                extracted_core = extract_deterministic(text_content)
+                model_used = "deterministic"
+                confidence = 0.5
+            else:
+                extracted_core = llm_text
+                model_used = "openai_text"
+                confidence = 0.8
+            extracted_core = _ensure_raw_fields(extracted_core, text_content=text_content)
+        else:
+            extracted_core = {
+                "observaciones": "DOCX sin texto suficiente.",
+                "raw_text_pdf": text_content or "",
+            }
+
+    else:
+        extracted_core = {"observaciones": "Tipo de archivo no soportado."}
+
+    with span("stage", "analyze.triage"):
+        blob = _flatten_text(extracted_core, text_content=text_content)
+        extracted_core = run_cpu(_enrich_with_triage, extracted_core, blob)
+        extracted_core = _ensure_raw_fields(extracted_core, text_content=text_content)
+
+    extracted_core["extraction_mode"] = "deterministic" if degraded else "llm"
+    extracted_core["llm_enrichment_pending"] = bool(degraded)
+    if degraded:
+        extracted_core["llm_degraded_reasons"] = degraded
+
+    return extracted_core, text_content, model_used, confidence
+
+
 @router.post("/analyze")
-async def analyze(file: UploadFile = File(...)) -> Dict[str, Any]:
+def analyze(file: UploadFile = File(...)) -> Dict[str, Any]:
+    # Handler síncrono: FastAPI lo ejecuta en el threadpool, así la BD, B2 y OpenAI
+    # (todo bloqueante) no paran el event loop; la CPU pura va al pool de procesos.
     try:
-        content = await file.read()
+        content = file.file.read()
         if not content:
             raise HTTPException(status_code=400, detail="Archivo vacío.")
         if len(content) > 12 * 1024 * 1024:
@@ -2771,6 +2897,7 @@ async def analyze(file: UploadFile = File(...)) -> Dict[str, Any]:
             case_id = conn.execute(
                 text("INSERT INTO cases(status, created_at, updated_at) VALUES ('uploaded', NOW(), NOW()) RETURNING id")
             ).scalar()
+            set_trace_case(case_id)
 
             b2_bucket, b2_key = upload_original(str(case_id), content, file.filename, mime)
 
@@ -2789,72 +2916,8 @@ async def analyze(file: UploadFile = File(...)) -> Dict[str, Any]:
                 },
             )
 
-            model_used = "mock"
-            confidence = 0.1
-            extracted_core: Dict[str, Any] = {}
-            text_content = ""
-
-            if mime.startswith("image/"):
-                extracted_core = extract_from_image_bytes(content, mime, file.filename)
-                extracted_core = _ensure_raw_fields(extracted_core, text_content="")
-                model_used = "openai_vision"
-                confidence = 0.7
-
-            elif mime == "application/pdf":
-                text_content = extract_text_from_pdf_bytes(content)
-                _raise_if_generated_resource_text(text_content)
-
-                extracted_text: Dict[str, Any] = {}
-                extracted_vision: Dict[str, Any] = {}
-
-                if has_enough_text(text_content):
-                    extracted_text = extract_from_text(text_content) or {}
-                    extracted_text = _ensure_raw_fields(extracted_text, text_content=text_content)
-                    model_used = "openai_text"
-                    confidence = 0.8
-                else:
-                    model_used = "openai_vision"
-                    confidence = 0.6
-
-                extracted_vision = extract_from_image_bytes(content, mime, file.filename) or {}
-                extracted_vision = _ensure_raw_fields(extracted_vision, text_content="")
-
-                blob_text = _flatten_text(extracted_text, text_content=text_content) if extracted_text else (text_content or "")
-                triaged_text = _enrich_with_triage(extracted_text or {}, blob_text)
-
-                blob_vision = _flatten_text(extracted_vision, text_content="")
-                triaged_vision = _enrich_with_triage(extracted_vision or {}, blob_vision)
-
-                extracted_core = _merge_extracted(triaged_text, triaged_vision)
-                extracted_core = _ensure_raw_fields(extracted_core, text_content=text_content)
-
-                if extracted_text and not _needs_speed_retry(extracted_core):
-                    model_used = "openai_text"
-                    confidence = 0.8
-                else:
-                    model_used = "openai_vision+text"
-                    confidence = 0.75
-
-            elif mime in DOCX_MIMES:
-                text_content = extract_text_from_docx_bytes(content)
-                _raise_if_generated_resource_text(text_content)
-                if has_enough_text(text_content):
-                    extracted_core = extract_from_text(text_content) or {}
-                    extracted_core = _ensure_raw_fields(extracted_core, text_content=text_content)
-                    model_used = "openai_text"
-                    confidence = 0.8
-                else:
-                    extracted_core = {
-                        "observaciones": "DOCX sin texto suficiente.",
-                        "raw_text_pdf": text_content or "",
-                    }
-
-            else:
-                extracted_core = {"observaciones": "Tipo de archivo no soportado."}
-
-            blob = _flatten_text(extracted_core, text_content=text_content)
-            extracted_core = _enrich_with_triage(extracted_core, blob)
-            extracted_core = _ensure_raw_fields(extracted_core, text_content=text_content)
+            with span("stage", "analyze.extract_document"):
+                extracted_core, text_content, model_used, confidence = _extract_document(content, mime, file.filename)
 
             wrapper = {
                 "filename": file.filename,
@@ -2878,23 +2941,25 @@ async def analyze(file: UploadFile = File(...)) -> Dict[str, Any]:
                 },
             )
 
-            conn.execute(
-                text(
-                    "INSERT INTO events(case_id, type, payload, created_at) "
-                    "VALUES (:case_id, 'analyze_ok', CAST(:payload AS JSONB), NOW())"
-                ),
+            # Eventos del análisis: se vuelcan juntos en un único INSERT al final
+            events = EventBatch()
+            events.add(
+                str(case_id),
+                "analyze_ok",
                 {
-                    "case_id": case_id,
-                    "payload": json.dumps(
-                        {
-                            "model": model_used,
-                            "confidence": confidence,
-                            "tipo_infraccion": extracted_core.get("tipo_infraccion"),
-                            "jurisdiccion": extracted_core.get("jurisdiccion"),
-                        }
-                    ),
+                    "model": model_used,
+                    "confidence": confidence,
+                    "tipo_infraccion": extracted_core.get("tipo_infraccion"),
+                    "jurisdiccion": extracted_core.get("jurisdiccion"),
                 },
             )
+            if extracted_core.get("llm_enrichment_pending"):
+                # El cron de enriquecimiento (/ops/automation/llm-enrichment/tick) lo reprocesa con LLM
+                events.add(
+                    str(case_id),
+                    "llm_enrichment_pending",
+                    {"reasons": extracted_core.get("llm_degraded_reasons") or []},
+                )
 
 
             # 🔒 SINCRONIZAR DATOS DETECTADOS CON CASES
@@ -3008,22 +3073,14 @@ async def analyze(file: UploadFile = File(...)) -> Dict[str, Any]:
                 },
             )
 
-            conn.execute(
-                text("""
-                    INSERT INTO events(case_id, type, payload, created_at)
-                    VALUES (:case_id, 'case_extracted_fields_synced', CAST(:payload AS JSONB), NOW())
-                """),
-                {
-                    "case_id": case_id,
-                    "payload": json.dumps(interested_patch, ensure_ascii=False),
-                },
-            )
+            events.add(str(case_id), "case_extracted_fields_synced", interested_patch)
 
 
             conn.execute(
                 text("UPDATE cases SET status='analyzed', updated_at=NOW() WHERE id=:case_id"),
                 {"case_id": case_id},
             )
+            events.flush(conn)
 
         return {
             "ok": True,
@@ -1,5 +1,6 @@
 # analyze_expediente.py — subida múltiple (hasta 5) + creación de expediente
 # VERSIÓN COMPLETA CORREGIDA
+import asyncio
 import json
 from typing import Any, Dict, List
 
@@ -7,17 +8,13 @@ from fastapi import APIRouter, HTTPException, UploadFile, File
 from sqlalchemy import text
 
 from database import get_engine
-from b2_storage import upload_bytes
+from document_ingest import ingest_uploads, insert_documents
 
 router = APIRouter(tags=["analyze"])
 
 MAX_FILES = 5
 
 
-def _safe_filename(name: str) -> str:
-    return (name or "documento").replace("\\", "_").replace("/", "_")[:120]
-
-
 @router.post("/analyze/expediente")
 async def analyze_expediente(files: List[UploadFile] = File(...)) -> Dict[str, Any]:
     """
@@ -35,59 +32,18 @@ async def analyze_expediente(files: List[UploadFile] = File(...)) -> Dict[str, A
 
     engine = get_engine()
 
-    # 1) Crear caso
-    with engine.begin() as conn:
-        row = conn.execute(
-            text("INSERT INTO cases(status, updated_at) VALUES ('uploaded', NOW()) RETURNING id")
-        ).fetchone()
-        case_id = str(row[0])
-
-    uploaded_docs = []
-
-    # 2) Subir y registrar documents
-    for idx, uf in enumerate(files, start=1):
-        filename = _safe_filename(uf.filename or f"documento_{idx}")
-        data = await uf.read()
-        if not data:
-            continue
-
-        ext = ".bin"
-        if "." in filename:
-            ext = "." + filename.split(".")[-1].lower()
-            if len(ext) > 8:
-                ext = ".bin"
-
-        b2_bucket, b2_key = upload_bytes(
-            case_id,
-            "original",
-            data,
-            ext,
-            (uf.content_type or "application/octet-stream"),
-        )
-
-        uploaded_docs.append({
-            "idx": idx,
-            "filename": filename,
-            "bucket": b2_bucket,
-            "key": b2_key,
-            "mime": uf.content_type or "application/octet-stream",
-            "size_bytes": len(data),
-        })
-
+    # 1) Crear caso (BD síncrona en un hilo: no bloquear el event loop)
+    def _create_case() -> str:
         with engine.begin() as conn:
-            conn.execute(
-                text(
-                    """INSERT INTO documents(case_id, kind, b2_bucket, b2_key, mime, size_bytes, created_at)
-                       VALUES (:case_id, 'original', :b2_bucket, :b2_key, :mime, :size_bytes, NOW())"""
-                ),
-                {
-                    "case_id": case_id,
-                    "b2_bucket": b2_bucket,
-                    "b2_key": b2_key,
-                    "mime": uf.content_type or "application/octet-stream",
-                    "size_bytes": len(data),
-                },
-            )
+            row = conn.execute(
+                text("INSERT INTO cases(status, updated_at) VALUES ('uploaded', NOW()) RETURNING id")
+            ).fetchone()
+            return str(row[0])
+
+    case_id = await asyncio.to_thread(_create_case)
+
+    # 2) Subir en paralelo (streaming + sha256) y registrar documents en bloque
+    uploaded_docs = await ingest_uploads(case_id, files, kind_folder="original", default_name="documento")
 
     # 3) Evento + update case + payload IA visible para el panel
     # Esta parte debe ir DENTRO de la función, no fuera, para evitar NameError.
@@ -99,27 +55,32 @@ async def analyze_expediente(files: List[UploadFile] = File(...)) -> Dict[str, A
         "accion": "",
     }
 
-    with engine.begin() as conn:
-        conn.execute(
-            text(
-                """INSERT INTO events(case_id, type, payload, created_at)
-                   VALUES (:case_id, 'expediente_uploaded', CAST(:payload AS JSONB), NOW())"""
-            ),
-            {"case_id": case_id, "payload": json.dumps({"documents": uploaded_docs})},
-        )
-
-        conn.execute(
-            text(
-                """INSERT INTO events(case_id, type, payload, created_at)
-                   VALUES (:case_id, 'ai_expediente_result', CAST(:payload AS JSONB), NOW())"""
-            ),
-            {"case_id": case_id, "payload": json.dumps(ai_payload)},
-        )
-
-        conn.execute(
-            text("UPDATE cases SET status='uploaded', updated_at=NOW() WHERE id=:case_id"),
-            {"case_id": case_id},
-        )
+    def _register() -> None:
+        with engine.begin() as conn:
+            insert_documents(conn, case_id, "original", uploaded_docs)
+
+            conn.execute(
+                text(
+                    """INSERT INTO events(case_id, type, payload, created_at)
+                       VALUES (:case_id, 'expediente_uploaded', CAST(:payload AS JSONB), NOW())"""
+                ),
+                {"case_id": case_id, "payload": json.dumps({"documents": uploaded_docs})},
+            )
+
+            conn.execute(
+                text(
+                    """INSERT INTO events(case_id, type, payload, created_at)
+                       VALUES (:case_id, 'ai_expediente_result', CAST(:payload AS JSONB), NOW())"""
+                ),
+                {"case_id": case_id, "payload": json.dumps(ai_payload)},
+            )
+
+            conn.execute(
+                text("UPDATE cases SET status='uploaded', updated_at=NOW() WHERE id=:case_id"),
+                {"case_id": case_id},
+            )
+
+    await asyncio.to_thread(_register)
 
     return {
         "ok": True,
@@ -1,36 +1,53 @@
 import os
-from fastapi import FastAPI
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from schemas import HealthResponse
 from database import get_engine, ping_db
+from email_outbox import start_outbox_worker
+from work_scheduler import start_scheduler_worker
+from telemetry import TelemetryMiddleware, metrics_authorized, prometheus_text
+from profiling import ProfilingMiddleware, router as profiling_router
+from startup import import_router, mark_ready, report as startup_report, start_warmup
+from cpu_pool import shutdown_cpu_pool
+from case_bus import stop_case_bus
 
 
-from admin_migrate import router as admin_migrate_router
-from analyze import router as analyze_router
-from analyze_expediente import router as analyze_expediente_router
-from generate import router as generate_router
-from debug_generate_preview import router as debug_generate_preview_router
-from debug_test_classifier import router as debug_test_classifier_router
-from files import router as files_router
-from billing import router as billing_router
-from admin_migrate_payments import router as admin_payments_router
-from ai_router import router as ai_router
-from partner_cases import router as partner_cases_router
-from ops_automation_router import router as ops_automation_router
-from ops_operator_router import router as ops_operator_router
-from ops_queue_smart import router as ops_queue_smart_router
-from ops_vehicle_removal_router import router as ops_vehicle_removal_router
-from contact_backend_fastapi import router as contact_router
-from vehicle_removal_router import router as vehicle_removal_router
-
-
-# ✅ AÑADIDO: OPS (operador)
-from ops import router as ops_router
-from ops_restaurant_reservations import router as ops_restaurant_router
-from cases import router as cases_router
-from partner import router as partner_router
-from ops_override import router as ops_override_router
+# Routers en orden de registro: (módulo, grupo). Los grupos "debug" y "lab" se pueden
+# desactivar con ENABLE_DEBUG_ROUTERS / ENABLE_LAB_ROUTERS=false (ni se importan).
+# "lab" es para experimentos sin usuarios reales; ahora mismo no hay ninguno.
+ROUTERS = [
+    ("admin_migrate", "core"),
+    ("analyze", "core"),
+    ("analyze_expediente", "core"),
+    ("generate", "core"),
+    ("debug_generate_preview", "debug"),
+    ("debug_test_classifier", "debug"),
+    ("files", "core"),
+    ("billing", "core"),
+    ("admin_migrate_payments", "core"),
+    ("ai_router", "core"),
+    ("partner_cases", "core"),
+    ("ops_automation_router", "core"),
+    ("ops_operator_router", "core"),
+    ("ops_queue_smart", "core"),
+    ("ops_vehicle_removal_router", "core"),
+    ("contact_backend_fastapi", "core"),
+    ("vehicle_removal_router", "core"),
+    # ✅ OPS (operador)
+    ("ops", "core"),
+    # Tablet de sala del restaurante: en producción (sesiones, feed SSE), no experimento
+    ("ops_restaurant_reservations", "core"),
+    ("cases", "core"),
+    ("partner", "core"),
+    ("partner_batch", "core"),
+    ("ops_override", "core"),
+    ("event_partitions", "core"),
+    ("case_bus", "core"),
+]
 
 
 app = FastAPI(title="RecurreTuMulta Backend", version="0.1.0")
@@ -46,32 +63,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Routers existentes
-app.include_router(admin_migrate_router)
-app.include_router(analyze_router)
-app.include_router(analyze_expediente_router)
-app.include_router(generate_router)
-app.include_router(debug_generate_preview_router)
-app.include_router(debug_test_classifier_router)
-app.include_router(files_router)
-app.include_router(billing_router)
-app.include_router(admin_payments_router)
-app.include_router(ai_router)
-app.include_router(partner_cases_router)
-app.include_router(ops_automation_router)
-app.include_router(ops_operator_router)
-app.include_router(ops_queue_smart_router)
-app.include_router(ops_vehicle_removal_router)
-app.include_router(contact_router)
-app.include_router(vehicle_removal_router)
-
-
-# ✅ NUEVO: router de operador (/ops/*)
-app.include_router(ops_router)
-app.include_router(ops_restaurant_router)
-app.include_router(cases_router)
-app.include_router(partner_router)
-app.include_router(ops_override_router)
+# Traza por petición: duración, LLM, B2 y SQL (ver telemetry.py)
+app.add_middleware(TelemetryMiddleware)
+# Perfilado opt-in (X-Profile: 1 o PROFILE_SAMPLE_RATE); ver profiling.py
+app.add_middleware(ProfilingMiddleware)
+
+# Routers (import medido en startup.report(), ver GET /health/startup)
+for _module, _group in ROUTERS:
+    _router = import_router(_module, _group)
+    if _router is not None:
+        app.include_router(_router)
+app.include_router(profiling_router)
+
+
+@app.on_event("startup")
+def _start_background_workers():
+    # Envío de email_outbox en segundo plano (por defecto; EMAIL_OUTBOX_WORKER=false lo apaga)
+    start_outbox_worker()
+    # Planificador de trabajo por prioridad de plazo (SCHEDULER_WORKER=true)
+    start_scheduler_worker()
+    # Pool de BD, clientes S3/OpenAI y librerías pesadas, ya con el puerto abierto
+    start_warmup()
+    mark_ready()
+
+
+@app.on_event("startup")
+async def _configure_threadpool():
+    # Hilos para handlers síncronos (BD, B2, SMTP, OpenAI bloqueantes); Starlette usa 40
+    import anyio.to_thread
+
+    size = int((os.getenv("THREADPOOL_SIZE") or "40").strip() or 40)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = max(size, 1)
+
+
+@app.on_event("shutdown")
+def _stop_cpu_pool():
+    shutdown_cpu_pool()
+
+
+@app.on_event("shutdown")
+def _stop_case_bus():
+    # El listener LISTEN/NOTIFY arranca con el primer suscriptor SSE
+    stop_case_bus()
+
 
 @app.get("/health", response_model=HealthResponse)
 def health():
@@ -80,4 +114,17 @@ def health():
         ping_db(engine)
         return HealthResponse(ok=True)
     except Exception:
-        return HealthResponse(ok=False)
\ No newline at end of file
+        return HealthResponse(ok=False)
+
+@app.get("/health/startup")
+def health_startup():
+    # Tiempos de import por router, routers desactivados y pasos del warm-up
+    return startup_report()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(x_metrics_token: Optional[str] = Header(default=None, alias="X-Metrics-Token")):
+    # Formato Prometheus; cabecera con METRICS_TOKEN (u OPERATOR_TOKEN si no está configurado)
+    if not metrics_authorized(x_metrics_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return prometheus_text()
@@ -0,0 +1,158 @@
+# auth_cache.py — autenticación barata por petición
+#
+# - Caché en proceso de búsquedas positivas (token partner -> partner, PIN restaurante
+#   verificado) con TTL (AUTH_CACHE_TTL_SECONDS) y tamaño máximo. Los fallos no se
+#   cachean: un token/PIN malo siempre va a BD.
+# - Revocación: forget(kind, subject) borra al momento en este proceso; en el resto de
+#   procesos la entrada caduca como mucho en AUTH_CACHE_TTL_SECONDS.
+# - Sesiones firmadas (HMAC-SHA256, AUTH_SESSION_SECRET): se verifica la credencial una
+#   vez y el cliente envía un token corto que se valida sin BD ni bcrypt. El token lleva
+#   la versión de la credencial (ver); al cambiarla, las sesiones anteriores dejan de valer.
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = 5000
+
+_cache: "OrderedDict[Tuple[str, str], Tuple[float, str, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+_secret: Optional[bytes] = None
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def cache_ttl_seconds() -> float:
+    try:
+        return max(0.0, float(_env("AUTH_CACHE_TTL_SECONDS", "60")))
+    except ValueError:
+        return 60.0
+
+
+def key_of(secret_value: str) -> str:
+    """Las credenciales no se guardan en claro ni como clave del diccionario."""
+    return hashlib.sha256(secret_value.encode("utf-8")).hexdigest()
+
+
+# =========================================================
+# CACHÉ TTL
+# =========================================================
+def cache_get(kind: str, key: str) -> Optional[Any]:
+    with _cache_lock:
+        entry = _cache.get((kind, key))
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del _cache[(kind, key)]
+            return None
+        _cache.move_to_end((kind, key))
+        return entry[2]
+
+
+def cache_put(kind: str, key: str, subject: str, value: Any) -> None:
+    ttl = cache_ttl_seconds()
+    if ttl <= 0:
+        return
+    with _cache_lock:
+        _cache[(kind, key)] = (time.monotonic() + ttl, subject, value)
+        _cache.move_to_end((kind, key))
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def forget(kind: str, subject: str) -> int:
+    """Revoca en este proceso todas las entradas de un sujeto (partner, restaurante)."""
+    with _cache_lock:
+        dead = [k for k, v in _cache.items() if k[0] == kind and v[1] == subject]
+        for k in dead:
+            del _cache[k]
+    return len(dead)
+
+
+# =========================================================
+# SESIONES FIRMADAS
+# =========================================================
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unb64(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _session_secret() -> bytes:
+    global _secret
+    if _secret is None:
+        configured = _env("AUTH_SESSION_SECRET")
+        if configured:
+            _secret = configured.encode("utf-8")
+        else:
+            # Sin secreto compartido las sesiones solo valen en este proceso
+            logger.warning("AUTH_SESSION_SECRET no configurado: sesiones firmadas con secreto efímero")
+            _secret = secrets.token_bytes(32)
+    return _secret
+
+
+def credential_version(stored_hash: str) -> str:
+    """Versión de la credencial: cambia cuando cambia el hash guardado (PIN, password)."""
+    return hashlib.sha256((stored_hash or "").encode("utf-8")).hexdigest()[:16]
+
+
+def issue_session(kind: str, subject: str, ver: str, ttl_seconds: int) -> Dict[str, Any]:
+    exp = int(time.time()) + int(ttl_seconds)
+    body = _b64(json.dumps({"k": kind, "sub": subject, "ver": ver, "exp": exp}, separators=(",", ":")).encode("utf-8"))
+    sig = _b64(hmac.new(_session_secret(), body.encode("ascii"), hashlib.sha256).digest())
+    return {"token": f"{body}.{sig}", "expires_at": exp}
+
+
+def verify_session(token: str, kind: str) -> Optional[Dict[str, Any]]:
+    """Claims {sub, ver, exp} si la firma es buena, es del tipo pedido y no ha caducado."""
+    try:
+        body, sig = (token or "").strip().split(".", 1)
+        expected = _b64(hmac.new(_session_secret(), body.encode("ascii"), hashlib.sha256).digest())
+        if not hmac.compare_digest(sig, expected):
+            return None
+        claims = json.loads(_unb64(body))
+    except Exception:
+        return None
+    if claims.get("k") != kind or int(claims.get("exp") or 0) < time.time():
+        return None
+    return claims
+
+
+# =========================================================
+# PARTNERS (Bearer api_token)
+# =========================================================
+def partner_by_token(conn, token: str) -> Dict[str, Any]:
+    """partners por api_token con caché positiva; 401/403 como antes."""
+    key = key_of(token)
+    cached = cache_get("partner", key)
+    if cached is not None:
+        return dict(cached)
+
+    row = conn.execute(
+        text("SELECT id, name, email, active FROM partners WHERE api_token=:t"),
+        {"t": token},
+    ).fetchone()
+    if not row:
+        raise HTTPException(status_code=401, detail="Token partner inválido")
+    if not bool(row[3]):
+        raise HTTPException(status_code=403, detail="Partner desactivado")
+
+    partner = {"id": str(row[0]), "name": row[1], "email": row[2]}
+    cache_put("partner", key, partner["id"], partner)
+    return dict(partner)
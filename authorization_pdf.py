@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 import io
 import json
 import os
@@ -7,15 +8,24 @@ import re
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional
 
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.lib.units import cm
-from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Image
 from sqlalchemy import text
 
 from b2_storage import upload_bytes
 
 
+# Datos del representante que figuran en la autorización. Forman parte de la
+# huella del PDF: si cambian, el PDF almacenado deja de ser válido.
+REPRESENTANTE = {
+    "representante_nombre": "LA TALAMANQUINA, S.L.",
+    "representante_nif": "B75440115",
+    "representante_domicilio": "Calle Velázquez, 15 – 28001 Madrid (España)",
+}
+
+# Campos del payload que NO cambian el contenido relevante del PDF
+# (varían en cada petición y no deben forzar regeneración).
+_VOLATILE_PAYLOAD_FIELDS = ("ip", "authorized_at")
+
+
 def _utcnow_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
@@ -141,9 +151,20 @@ def _authorization_payload_from_case(case_meta: Dict[str, Any], ip: str, version
         "ip": _safe_str(ip),
         "version": _safe_str(version or "v1"),
         "authorized_at": _utcnow_iso(),
+        **REPRESENTANTE,
     }
 
 
+def authorization_payload_hash(payload: Dict[str, Any]) -> str:
+    """
+    Huella estable del payload de autorización (datos del interesado, versión
+    y representante). Ignora IP y fecha, que cambian en cada descarga.
+    """
+    stable = {k: v for k, v in (payload or {}).items() if k not in _VOLATILE_PAYLOAD_FIELDS}
+    raw = json.dumps(stable, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
 def _find_signature_path() -> str:
     candidates = [
         os.getenv("SIGNATURE_PATH", "").strip(),
@@ -158,6 +179,12 @@ def _find_signature_path() -> str:
 
 
 def generate_authorization_pdf(data: Dict[str, str]) -> bytes:
+    # reportlab se importa al generar (no al arrancar): acelera el cold start
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Image
+
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -278,7 +305,7 @@ def _existing_authorization_doc(conn, case_id: str) -> Optional[Dict[str, Any]]:
     row = conn.execute(
         text(
             """
-            SELECT id, b2_bucket, b2_key, mime, created_at
+            SELECT id, b2_bucket, b2_key, mime, created_at, source_hash, size_bytes
             FROM documents
             WHERE case_id = :id
               AND kind = 'authorization_pdf'
@@ -298,17 +325,29 @@ def _existing_authorization_doc(conn, case_id: str) -> Optional[Dict[str, Any]]:
         "key": row[2],
         "mime": row[3],
         "created_at": str(row[4]),
+        "source_hash": row[5] or "",
+        "size_bytes": int(row[6] or 0),
     }
 
 
 def ensure_authorization_pdf(conn, case_id: str, request, version: str = "v1") -> Dict[str, Any]:
-    existing = _existing_authorization_doc(conn, case_id)
-    if existing:
-        return {"ok": True, "existing": True, "document": existing}
-
+    """
+    Devuelve el PDF de autorización almacenado en B2 para el caso.
+
+    Solo se regenera (y se sube de nuevo) cuando cambia la huella del payload
+    (interested_data, versión o representante). Los PDFs anteriores a la
+    columna source_hash (huella vacía) no se sabe con qué datos se hicieron:
+    se regeneran una vez y a partir de ahí quedan con su huella.
+    """
     ip = get_request_ip(request)
     case_meta = _get_case_snapshot(conn, case_id)
     payload = _authorization_payload_from_case(case_meta, ip=ip, version=version)
+    payload_hash = authorization_payload_hash(payload)
+
+    existing = _existing_authorization_doc(conn, case_id)
+    if existing and existing.get("source_hash") == payload_hash:
+        return {"ok": True, "existing": True, "document": existing}
+
     pdf_bytes = generate_authorization_pdf(payload)
 
     bucket, key = upload_bytes(
@@ -322,11 +361,18 @@ def ensure_authorization_pdf(conn, case_id: str, request, version: str = "v1") -
     conn.execute(
         text(
             """
-            INSERT INTO documents(case_id, kind, b2_bucket, b2_key, mime, size_bytes, created_at)
-            VALUES (:id, 'authorization_pdf', :b, :k, 'application/pdf', :s, NOW())
+            INSERT INTO documents(case_id, kind, b2_bucket, b2_key, sha256, source_hash, mime, size_bytes, created_at)
+            VALUES (:id, 'authorization_pdf', :b, :k, :sha, :h, 'application/pdf', :s, NOW())
             """
         ),
-        {"id": case_id, "b": bucket, "k": key, "s": len(pdf_bytes)},
+        {
+            "id": case_id,
+            "b": bucket,
+            "k": key,
+            "sha": hashlib.sha256(pdf_bytes).hexdigest(),
+            "h": payload_hash,
+            "s": len(pdf_bytes),
+        },
     )
 
     conn.execute(
@@ -346,6 +392,8 @@ def ensure_authorization_pdf(conn, case_id: str, request, version: str = "v1") -
                     "version": version,
                     "generated_at": payload["authorized_at"],
                     "signature_path_found": _find_signature_path(),
+                    "source_hash": payload_hash,
+                    "replaces": (existing or {}).get("id"),
                 }
             ),
         },
@@ -358,5 +406,7 @@ def ensure_authorization_pdf(conn, case_id: str, request, version: str = "v1") -
             "bucket": bucket,
             "key": key,
             "mime": "application/pdf",
+            "source_hash": payload_hash,
+            "size_bytes": len(pdf_bytes),
         },
     }
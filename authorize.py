@@ -10,6 +10,7 @@ from sqlalchemy import text
 from database import get_engine
 from pdf_builder import build_pdf
 from b2_storage import upload_bytes, presign_get_url
+from request_ip import client_ip
 
 router = APIRouter(prefix="/cases", tags=["cases"])
 
@@ -18,18 +19,6 @@ def _utcnow():
     return datetime.now(timezone.utc)
 
 
-def _get_ip(request: Request) -> str:
-    xff = (request.headers.get("x-forwarded-for") or "").strip()
-    if xff:
-        return xff.split(",")[0].strip()
-    xri = (request.headers.get("x-real-ip") or "").strip()
-    if xri:
-        return xri
-    if request.client and request.client.host:
-        return request.client.host
-    return ""
-
-
 class CaseDetailsBody(BaseModel):
     full_name: str = Field(..., min_length=3)
     dni_nie: str = Field(..., min_length=3)
@@ -135,7 +124,7 @@ async def authorize_case(case_id: str, request: Request, body: AuthorizeBody):
                 detail={"message": "Faltan datos del interesado", "missing_fields": missing},
             )
 
-        ip = _get_ip(request)
+        ip = client_ip(request)
         user_agent = (request.headers.get("user-agent") or "").strip()
         now = _utcnow().isoformat()
 
@@ -1,9 +1,10 @@
+import hashlib
 import os
+import threading
 import uuid
-from typing import Optional, Tuple
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
 
-import boto3
-from botocore.config import Config
+from telemetry import instrument_s3_client
 
 
 def _env(name: str) -> str:
@@ -17,20 +18,69 @@ def get_b2_bucket() -> str:
     return _env("B2_BUCKET")
 
 
-def get_s3_client():
+_S3_CLIENT = None
+_S3_CLIENT_LOCK = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _build_s3_client():
+    # boto3 se importa al crear el cliente (primer uso o warm-up), no al arrancar
+    import boto3
+    from botocore.config import Config
+
     endpoint = _env("B2_ENDPOINT")
     key_id = _env("B2_KEY_ID")
     app_key = _env("B2_APPLICATION_KEY")
 
-    cfg = Config(signature_version="s3v4", s3={"addressing_style": "path"})
+    cfg = Config(
+        signature_version="s3v4",
+        s3={"addressing_style": "path"},
+        max_pool_connections=_env_int("B2_MAX_POOL_CONNECTIONS", 32),
+        connect_timeout=_env_int("B2_CONNECT_TIMEOUT", 5),
+        read_timeout=_env_int("B2_READ_TIMEOUT", 60),
+        retries={"max_attempts": _env_int("B2_MAX_ATTEMPTS", 4), "mode": "adaptive"},
+    )
 
-    return boto3.client(
+    client = boto3.client(
         "s3",
         endpoint_url=endpoint,
         aws_access_key_id=key_id,
         aws_secret_access_key=app_key,
         config=cfg,
     )
+    instrument_s3_client(client)
+    return client
+
+
+def get_s3_client():
+    """
+    Cliente S3 compartido por todo el proceso (boto3 clients son thread-safe).
+    Se crea una sola vez y reutiliza su pool de conexiones; así firmar URLs
+    es una operación local y barata.
+    Pool/timeouts/reintentos: B2_MAX_POOL_CONNECTIONS, B2_CONNECT_TIMEOUT,
+    B2_READ_TIMEOUT, B2_MAX_ATTEMPTS.
+    """
+    global _S3_CLIENT
+    client = _S3_CLIENT
+    if client is not None:
+        return client
+    with _S3_CLIENT_LOCK:
+        if _S3_CLIENT is None:
+            _S3_CLIENT = _build_s3_client()
+        return _S3_CLIENT
+
+
+def reset_s3_client() -> None:
+    """Descarta el cliente compartido (p.ej. tras rotar credenciales)."""
+    global _S3_CLIENT
+    with _S3_CLIENT_LOCK:
+        _S3_CLIENT = None
 
 
 def guess_ext(filename: Optional[str], mime: Optional[str]) -> str:
@@ -72,6 +122,66 @@ def upload_bytes(case_id: str, kind_folder: str, content: bytes, ext: str, mime:
     return bucket, key
 
 
+# Multipart a partir de 8 MB, en partes de 8 MB (mínimo S3/B2: 5 MB)
+_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+class _HashingReader:
+    """
+    Envuelve un fichero y calcula sha256 y tamaño según se va leyendo.
+    Solo expone read(): boto3 lo trata como stream no seekable y no relee.
+    """
+
+    def __init__(self, fileobj: BinaryIO):
+        self._f = fileobj
+        self._h = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self._f.read(n)
+        if chunk:
+            self._h.update(chunk)
+            self.size += len(chunk)
+        return chunk
+
+    @property
+    def sha256(self) -> str:
+        return self._h.hexdigest()
+
+
+def upload_fileobj(
+    case_id: str,
+    kind_folder: str,
+    fileobj: BinaryIO,
+    ext: str,
+    mime: str,
+) -> Dict[str, Any]:
+    """
+    Sube un fichero a B2 en streaming (multipart si es grande) sin cargarlo
+    entero en memoria. Devuelve bucket, key, size_bytes y sha256.
+    """
+    bucket = get_b2_bucket()
+    s3 = get_s3_client()
+    key = f"cases/{case_id}/{kind_folder}/{uuid.uuid4().hex}{ext}"
+
+    from boto3.s3.transfer import TransferConfig
+
+    reader = _HashingReader(fileobj)
+    s3.upload_fileobj(
+        reader,
+        bucket,
+        key,
+        ExtraArgs={"ContentType": mime or "application/octet-stream"},
+        Config=TransferConfig(
+            multipart_threshold=_MULTIPART_THRESHOLD,
+            multipart_chunksize=_MULTIPART_CHUNKSIZE,
+            max_concurrency=4,
+        ),
+    )
+    return {"bucket": bucket, "key": key, "size_bytes": reader.size, "sha256": reader.sha256}
+
+
 def upload_original(case_id: str, content: bytes, filename: Optional[str], mime: str) -> Tuple[str, str]:
     ext = guess_ext(filename, mime)
     return upload_bytes(case_id, "original", content, ext or "", mime)
@@ -86,6 +196,49 @@ def download_bytes(bucket: str, key: str) -> bytes:
     body = obj.get("Body")
     return body.read() if body else b""
 
+def head_object(bucket: str, key: str) -> Dict[str, Any]:
+    """
+    Metadatos del objeto sin descargarlo (tamaño, ETag, content-type).
+    """
+    s3 = get_s3_client()
+    obj = s3.head_object(Bucket=bucket, Key=key)
+    return {
+        "size": int(obj.get("ContentLength") or 0),
+        "etag": obj.get("ETag") or "",
+        "content_type": obj.get("ContentType") or "",
+        "last_modified": obj.get("LastModified"),
+    }
+
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def iter_object(
+    bucket: str,
+    key: str,
+    byte_range: Optional[str] = None,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Itera el objeto de B2 en trozos sin cargarlo entero en memoria.
+    byte_range acepta la sintaxis HTTP ("bytes=0-1023").
+    """
+    s3 = get_s3_client()
+    params = {"Bucket": bucket, "Key": key}
+    if byte_range:
+        params["Range"] = byte_range
+    obj = s3.get_object(**params)
+    body = obj.get("Body")
+    if not body:
+        return
+    try:
+        for chunk in body.iter_chunks(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        body.close()
+
+
 def presign_get_url(bucket: str, key: str, expires_seconds: int = 300, filename: Optional[str] = None) -> str:
     """
     Genera una URL temporal (presigned) para descargar desde B2.
@@ -0,0 +1,118 @@
+# b2_streaming.py — respuestas HTTP de descarga desde B2 (redirect firmado / stream con Range + ETag)
+import re
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+
+from b2_storage import head_object, iter_object, presign_get_url
+from http_cache import etag_matches
+
+DOWNLOAD_MODES = ("redirect", "stream")
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpreta un único rango HTTP. Devuelve (start, end) inclusivos,
+    None si no hay rango utilizable (se sirve el objeto completo).
+    Lanza 416 si el rango no es satisfacible.
+    """
+    raw = (range_header or "").strip().replace(" ", "")
+    if not raw or "," in raw:
+        return None
+    m = _RANGE_RE.match(raw)
+    if not m:
+        return None
+
+    start_s, end_s = m.group(1), m.group(2)
+    if not start_s and not end_s:
+        return None
+
+    if not start_s:
+        # sufijo: últimos N bytes
+        length = int(end_s)
+        if length <= 0:
+            raise HTTPException(status_code=416, detail="Rango no satisfacible", headers={"Content-Range": f"bytes */{size}"})
+        start = max(size - length, 0)
+        end = size - 1
+    else:
+        start = int(start_s)
+        if end_s and int(end_s) < start:
+            # Sintácticamente inválido (RFC 9110 §14.1.1): se ignora y se sirve entero
+            return None
+        end = int(end_s) if end_s else size - 1
+        end = min(end, size - 1)
+
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Rango no satisfacible", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def b2_download_response(
+    request: Request,
+    bucket: str,
+    key: str,
+    filename: str,
+    mime: Optional[str] = None,
+    mode: str = "redirect",
+    expires_seconds: int = 300,
+) -> Response:
+    """
+    Devuelve el objeto de B2 al cliente sin pasar los bytes por memoria.
+
+    - mode=redirect (por defecto): 307 a URL firmada; el dyno no hace de proxy.
+    - mode=stream: stream por trozos con soporte de Range (206) y
+      If-None-Match (304) usando el ETag de B2.
+    Si no se puede firmar la URL, cae a stream.
+    """
+    disposition = f'attachment; filename="{filename}"'
+
+    if mode == "redirect":
+        try:
+            url = presign_get_url(bucket, key, expires_seconds=expires_seconds, filename=filename)
+            return RedirectResponse(url=url, status_code=307)
+        except Exception:
+            pass
+
+    try:
+        meta = head_object(bucket, key)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Objeto no disponible en B2: {type(e).__name__}")
+
+    size = meta["size"]
+    etag = meta["etag"]
+    media_type = mime or meta["content_type"] or "application/octet-stream"
+    headers = {
+        "Content-Disposition": disposition,
+        "Accept-Ranges": "bytes",
+    }
+    if etag:
+        headers["ETag"] = etag
+
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Disposition"})
+
+    byte_range = None
+    if_range = (request.headers.get("if-range") or "").strip()
+    if not if_range or if_range == etag:
+        byte_range = _parse_range(request.headers.get("range", ""), size)
+
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_object(bucket, key, byte_range=f"bytes={start}-{end}"),
+            status_code=206,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        iter_object(bucket, key),
+        media_type=media_type,
+        headers=headers,
+    )
@@ -1,15 +1,24 @@
 # billing_auto_modo_dios.py — checkout bloqueado por autorización + Modo Dios automático tras pago
+import asyncio
 import json
+import logging
 import os
-import stripe
+from typing import Any, Dict
+
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, EmailStr
 from sqlalchemy import text
 
 from database import get_engine
+from event_log import append_event
+from vehicle_removal_state import sync_vehicle_removal_payment
 from ai.expediente_engine import run_expediente_ai
+from openai_limiter import PRIORITY_PAID, openai_priority
 from generate import generate_dgt_for_case
 from email_utils import send_email, build_vehicle_removal_paid_email
+from work_scheduler import enqueue_work, run_job, wake_scheduler, worker_enabled
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["billing"])
 
@@ -28,6 +37,14 @@ class CheckoutRequest(BaseModel):
     locale: str | None = "es"
 
 
+def _stripe():
+    # stripe se importa en el primer pago (no al arrancar): acelera el cold start
+    import stripe
+
+    stripe.api_key = _env("STRIPE_SECRET_KEY")
+    return stripe
+
+
 def _pick(mapping, *paths):
     for path in paths:
         current = mapping
@@ -155,7 +172,7 @@ def _normalize_ai_payload(result):
     hecho_str = _as_string(hecho)
     admisibilidad_str = _as_string(admisibilidad)
 
-    return {
+    payload = {
         "familia": familia_str,
         "confianza": confianza_num,
         "hecho": hecho_str,
@@ -168,20 +185,18 @@ def _normalize_ai_payload(result):
         "tipo_infraccion": familia_str,
         "tipo_infraccion_confidence": confianza_num,
         "hecho_imputado": hecho_str,
-        "raw_result": result,
     }
+    # El resultado completo ya está en ai_runs: el evento solo guarda la referencia
+    if result.get("ai_run_id"):
+        payload["ai_run_id"] = result["ai_run_id"]
+        payload["ai_run_sha256"] = result.get("ai_run_sha256")
+    else:
+        payload["raw_result"] = result
+    return payload
 
 
 def _append_event(conn, case_id: str, event_type: str, payload: dict):
-    conn.execute(
-        text(
-            """
-            INSERT INTO events(case_id, type, payload, created_at)
-            VALUES (:id, :type, CAST(:payload AS JSONB), NOW())
-            """
-        ),
-        {"id": case_id, "type": event_type, "payload": json.dumps(payload, ensure_ascii=False)},
-    )
+    append_event(conn, case_id, event_type, payload)
 
 
 def _require_case_authorized_before_payment(conn, case_id: str):
@@ -238,7 +253,9 @@ def _require_case_authorized_before_payment(conn, case_id: str):
 
 
 def _run_post_payment_modo_dios(conn, case_id: str):
-    result = run_expediente_ai(case_id)
+    # Trabajo ya pagado: pasa por delante del análisis anónimo en la cola de OpenAI
+    with openai_priority(PRIORITY_PAID):
+        result = run_expediente_ai(case_id)
     if not isinstance(result, dict):
         result = {"raw_result": result}
 
@@ -322,10 +339,17 @@ def _run_post_payment_modo_dios(conn, case_id: str):
     }
 
 
+def run_post_payment(case_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler del planificador (work_scheduler, kind='post_payment')."""
+    engine = get_engine()
+    with engine.begin() as conn:
+        return _run_post_payment_modo_dios(conn, case_id)
+
+
 @router.post("/billing/checkout")
 @router.post("/checkout")
 def create_checkout(req: CheckoutRequest):
-    stripe.api_key = _env("STRIPE_SECRET_KEY")
+    stripe = _stripe()
     frontend_url = _env("FRONTEND_URL").rstrip("/")
 
     engine = get_engine()
@@ -388,7 +412,7 @@ async def stripe_webhook(request: Request):
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
     try:
-        stripe.api_key = _env("STRIPE_SECRET_KEY")
+        stripe = _stripe()
         event = stripe.Webhook.construct_event(
             payload, sig_header, _env("STRIPE_WEBHOOK_SECRET")
         )
@@ -415,7 +439,31 @@ async def stripe_webhook(request: Request):
                 {"id": case_id, "sid": session["id"], "pi": session.get("payment_intent")},
             )
             _append_event(conn, case_id, "paid_ok", {"session": session["id"]})
-            _run_post_payment_modo_dios(conn, case_id)
+
+        # El pago queda confirmado aunque falle lo accesorio (p. ej. tablas aún sin migrar)
+        try:
+            with engine.begin() as conn:
+                sync_vehicle_removal_payment(conn, case_id, "paid")
+        except Exception as e:
+            logger.warning("webhook: no se pudo sincronizar vehicle_removal de %s: %s", case_id, e)
+
+        # IA + generación por el planificador: por prioridad de plazo, no por orden de llegada
+        try:
+            with engine.begin() as conn:
+                queued = enqueue_work(conn, case_id, "post_payment")
+        except Exception as e:
+            logger.warning("webhook: no se pudo encolar post_payment de %s: %s", case_id, e)
+            queued = False
+
+        if not queued:
+            # Sin work_queue (p. ej. sin migrar) se hace como antes, en la propia petición
+            await asyncio.to_thread(run_post_payment, case_id, {})
+        elif worker_enabled():
+            wake_scheduler()
+        else:
+            # Este trabajo y no otro, aunque la clase "paid" esté llena; si falla, lo
+            # reintenta el cron (/ops/automation/tick) con backoff
+            await asyncio.to_thread(run_job, case_id, "post_payment")
 
     return {"ok": True}
 
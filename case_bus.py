@@ -0,0 +1,295 @@
+# case_bus.py — avisos de cambios de expedientes (Postgres LISTEN/NOTIFY -> SSE)
+#
+# Los triggers de /admin/migrate/case_notify emiten NOTIFY case_changes en cada
+# INSERT/UPDATE de cases y cada INSERT de events, con un JSON pequeño:
+#   {"table": "cases"|"events", "op", "case_id", "partner_id", "status",
+#    "payment_status", "type"}
+# Un solo hilo por proceso escucha (conexión psycopg dedicada, fuera del pool) y reparte
+# a los suscriptores en memoria, filtrados por operador (todo), partner o caso.
+#
+# Endpoints SSE (EventSource no manda cabeceras: el token puede ir en ?token=):
+#   GET /notify/ops/stream                 operador (X-Operator-Token / ?token=)
+#   GET /notify/partner/stream             asesoría (Bearer api_token / ?token=)
+#   GET /notify/cases/{case_id}/stream     cliente (el case_id ya es el secreto, como public-status)
+#
+# El aviso solo dice "ha cambiado X": el cliente vuelve a pedir el recurso (con
+# If-None-Match, ver http_cache.py). Tras una reconexión del listener o si un
+# suscriptor se queda atrás se envía "resync" para que recargue todo.
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from auth_cache import partner_by_token
+from database import get_engine
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/notify", tags=["notify"])
+
+CHANNEL = "case_changes"
+QUEUE_MAX = 200
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(_env(name) or default)
+    except ValueError:
+        return default
+
+
+# =========================================================
+# SUSCRIPTORES
+# =========================================================
+class _Subscriber:
+    """Cola asyncio de un cliente SSE; el hilo listener publica con call_soon_threadsafe."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, scope: str, value: Optional[str]):
+        self.loop = loop
+        self.scope = scope  # "ops" | "partner" | "case"
+        self.value = value
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=QUEUE_MAX)
+
+    def wants(self, msg: Dict[str, Any]) -> bool:
+        if msg.get("type") == "resync" or self.scope == "ops":
+            return True
+        if self.scope == "partner":
+            return msg.get("partner_id") == self.value
+        return msg.get("case_id") == self.value
+
+    def _put(self, msg: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            # Cliente lento: se vacía y se le pide recargar en vez de perder avisos sin más
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "reason": "overflow"})
+
+    def publish(self, msg: Dict[str, Any]) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self._put, msg)
+        except RuntimeError:
+            # Bucle cerrado (apagado): el suscriptor se va a dar de baja
+            pass
+
+
+_subscribers: List[_Subscriber] = []
+_subs_lock = threading.Lock()
+
+
+def _dispatch(msg: Dict[str, Any]) -> None:
+    with _subs_lock:
+        targets = [s for s in _subscribers if s.wants(msg)]
+    for s in targets:
+        s.publish(msg)
+
+
+def subscribe(scope: str, value: Optional[str] = None) -> _Subscriber:
+    sub = _Subscriber(asyncio.get_running_loop(), scope, value)
+    with _subs_lock:
+        _subscribers.append(sub)
+    _ensure_listener()
+    return sub
+
+
+def unsubscribe(sub: _Subscriber) -> None:
+    with _subs_lock:
+        if sub in _subscribers:
+            _subscribers.remove(sub)
+
+
+def stats() -> Dict[str, Any]:
+    with _subs_lock:
+        by_scope: Dict[str, int] = {}
+        for s in _subscribers:
+            by_scope[s.scope] = by_scope.get(s.scope, 0) + 1
+    return {"listener": _listener_alive(), "subscribers": by_scope}
+
+
+# =========================================================
+# LISTENER (un hilo, una conexión por proceso)
+# =========================================================
+_listener: Optional[threading.Thread] = None
+_listener_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def _listener_alive() -> bool:
+    return _listener is not None and _listener.is_alive()
+
+
+def _dsn() -> str:
+    # Misma BD que el engine, sin el sufijo de driver de SQLAlchemy (postgresql+psycopg)
+    url = get_engine().url.set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+def _release_if_idle() -> bool:
+    # Bajo _listener_lock: un subscribe() concurrente o ve el hilo vivo o arranca otro
+    global _listener
+    with _listener_lock:
+        with _subs_lock:
+            if _subscribers:
+                return False
+        _listener = None
+        return True
+
+
+def _listen_loop() -> None:
+    backoff = 1.0
+    while not _stop.is_set():
+        try:
+            import psycopg
+
+            with psycopg.connect(_dsn(), autocommit=True) as conn:
+                conn.execute(f"LISTEN {CHANNEL}")
+                logger.info("case_bus escuchando %s", CHANNEL)
+                # Lo que pasara mientras no escuchábamos se ha perdido: que recarguen
+                _dispatch({"type": "resync", "reason": "listener_connected"})
+                backoff = 1.0
+                while not _stop.is_set():
+                    for n in conn.notifies(timeout=5.0):
+                        try:
+                            msg = json.loads(n.payload)
+                        except ValueError:
+                            continue
+                        _dispatch(msg)
+                    if _release_if_idle():
+                        # Sin nadie escuchando no se retiene la conexión
+                        return
+        except Exception as e:
+            if _stop.is_set():
+                return
+            logger.warning("case_bus: listener caído (%s); reintento en %.0fs", type(e).__name__, backoff)
+            _stop.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+def _ensure_listener() -> None:
+    global _listener
+    if _env("CASE_BUS_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _stop.clear()
+        _listener = threading.Thread(target=_listen_loop, name="case-bus-listener", daemon=True)
+        _listener.start()
+
+
+def stop_case_bus() -> None:
+    _stop.set()
+
+
+# =========================================================
+# SSE
+# =========================================================
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _public(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """Lo que ve el cliente final: sin partner ni datos internos."""
+    return {k: msg.get(k) for k in ("table", "case_id", "status", "payment_status") if msg.get(k) is not None}
+
+
+def _stream(request: Request, sub: _Subscriber, public: bool = False) -> StreamingResponse:
+    heartbeat = _env_float("NOTIFY_HEARTBEAT_SECONDS", 15.0)
+    max_seconds = _env_float("NOTIFY_STREAM_MAX_SECONDS", 600.0)
+
+    async def _events():
+        started = time.monotonic()
+        try:
+            yield "retry: 3000\n\n"
+            yield _sse("ready", {"scope": sub.scope})
+            while time.monotonic() - started < max_seconds:
+                try:
+                    msg = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if msg.get("type") == "resync":
+                    yield _sse("resync", {"reason": msg.get("reason")})
+                else:
+                    yield _sse("change", _public(msg) if public else msg)
+        finally:
+            unsubscribe(sub)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _require_operator(token: Optional[str]) -> None:
+    expected = _env("OPERATOR_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=500, detail="OPERATOR_TOKEN no configurado")
+    if not token or token.strip() != expected:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@router.get("/ops/stream")
+async def ops_stream(
+    request: Request,
+    token: Optional[str] = None,
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+):
+    _require_operator(x_operator_token or token)
+    return _stream(request, subscribe("ops"))
+
+
+@router.get("/partner/stream")
+async def partner_stream(
+    request: Request,
+    token: Optional[str] = None,
+    authorization: Optional[str] = Header(default=None),
+):
+    bearer = token
+    if authorization and authorization.strip().lower().startswith("bearer "):
+        bearer = authorization.strip()[7:].strip()
+    if not bearer:
+        raise HTTPException(status_code=401, detail="Falta Authorization")
+
+    def _partner() -> Dict[str, Any]:
+        with get_engine().begin() as conn:
+            return partner_by_token(conn, bearer)
+
+    partner = await asyncio.to_thread(_partner)
+    return _stream(request, subscribe("partner", partner["id"]))
+
+
+@router.get("/cases/{case_id}/stream")
+async def case_stream(case_id: str, request: Request):
+    def _exists() -> bool:
+        with get_engine().begin() as conn:
+            return conn.execute(text("SELECT 1 FROM cases WHERE id = CAST(:id AS uuid)"), {"id": case_id}).fetchone() is not None
+
+    try:
+        found = await asyncio.to_thread(_exists)
+    except Exception:
+        found = False
+    if not found:
+        raise HTTPException(status_code=404, detail="case_id no existe")
+    return _stream(request, subscribe("case", case_id), public=True)
+
+
+@router.get("/stats")
+def notify_stats(x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token")):
+    _require_operator(x_operator_token)
+    return {"ok": True, **stats()}
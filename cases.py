@@ -1,26 +1,30 @@
+import asyncio
 import json
 import os
-import smtplib
-from email.message import EmailMessage
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, Request, Response
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Query, Response
 from pydantic import BaseModel, EmailStr, Field
 from sqlalchemy import text
 
 from database import get_engine
 from b2_storage import upload_bytes
+from b2_streaming import b2_download_response
+from http_cache import case_version, make_etag, not_modified, set_etag
+from document_ingest import ingest_uploads, insert_documents
+from event_log import append_event
+from email_outbox import enqueue_email
 
 # Import interno del engine (Modo Dios)
 from ai.expediente_engine import run_expediente_ai
-from authorization_pdf import ensure_authorization_pdf, get_request_ip, _get_case_snapshot, _authorization_payload_from_case, generate_authorization_pdf
+from authorization_pdf import ensure_authorization_pdf, get_request_ip
 
 router = APIRouter(prefix="/cases", tags=["cases"])
 
 MAX_APPEND_FILES = 5
 
 # =========================
-# EMAILS AUTOMÁTICOS (SILENCIOSO)
+# EMAILS AUTOMÁTICOS (SILENCIOSO, VÍA email_outbox)
 # =========================
 def _env(name: str, default: str = "") -> str:
     return (os.getenv(name) or default).strip()
@@ -29,45 +33,17 @@ def _case_link(case_id: str) -> str:
     base = _env("FRONTEND_BASE_URL", "https://www.recurretumulta.eu").rstrip("/")
     return f"{base}/#/resumen?case={case_id}"
 
-def _smtp_ok() -> bool:
-    return bool(_env("SMTP_HOST") and _env("SMTP_FROM"))
-
-def _send_email(to_email: str, subject: str, body: str) -> None:
-    if not to_email or not _smtp_ok():
+def _send_email(conn, case_id: str, kind: str, to_email: str, subject: str, body: str) -> None:
+    # Se encola en email_outbox dentro de la transacción; el worker lo envía
+    if not to_email:
         return
+    enqueue_email(conn, to_email=to_email, subject=subject, body=body, case_id=case_id, kind=kind)
 
-    host = _env("SMTP_HOST")
-    port = int(_env("SMTP_PORT", "587") or "587")
-    user = _env("SMTP_USER")
-    pwd = _env("SMTP_PASS")
-    from_addr = _env("SMTP_FROM")
-
-    msg = EmailMessage()
-    msg["From"] = from_addr
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content(body)
-
-    try:
-        if port == 465:
-            with smtplib.SMTP_SSL(host, port, timeout=20) as s:
-                if user and pwd:
-                    s.login(user, pwd)
-                s.send_message(msg)
-        else:
-            with smtplib.SMTP(host, port, timeout=20) as s:
-                try:
-                    s.starttls()
-                except Exception:
-                    pass
-                if user and pwd:
-                    s.login(user, pwd)
-                s.send_message(msg)
-    except Exception:
-        pass
-
-def _email_contact_saved(case_id: str, name: str, email: str) -> None:
+def _email_contact_saved(conn, case_id: str, name: str, email: str) -> None:
     _send_email(
+        conn,
+        case_id,
+        "contact_saved",
         email,
         "Tu expediente está guardado · RecurreTuMulta",
         f"Hola {name},\n\n"
@@ -77,8 +53,11 @@ def _email_contact_saved(case_id: str, name: str, email: str) -> None:
         f"— RecurreTuMulta",
     )
 
-def _email_pending(case_id: str, name: str, email: str) -> None:
+def _email_pending(conn, case_id: str, name: str, email: str) -> None:
     _send_email(
+        conn,
+        case_id,
+        "pending_documents",
         email,
         "Tu expediente está pendiente de documentación · RecurreTuMulta",
         f"Hola {name},\n\n"
@@ -89,8 +68,11 @@ def _email_pending(case_id: str, name: str, email: str) -> None:
         f"— RecurreTuMulta",
     )
 
-def _email_ready(case_id: str, name: str, email: str) -> None:
+def _email_ready(conn, case_id: str, name: str, email: str) -> None:
     _send_email(
+        conn,
+        case_id,
+        "ready_to_pay",
         email,
         "Tu recurso puede presentarse ahora · RecurreTuMulta",
         f"Hola {name},\n\n"
@@ -147,22 +129,14 @@ def _case_exists(conn, case_id: str) -> Dict[str, Any]:
         "override_deadlines": bool(row[8]),
     }
 
-def _event(case_id: str, typ: str, payload: Dict[str, Any]) -> None:
-    engine = get_engine()
-    with engine.begin() as conn:
-        conn.execute(
-            text(
-                "INSERT INTO events(case_id, type, payload, created_at) "
-                "VALUES (:c,:t,CAST(:p AS JSONB),NOW())"
-            ),
-            {"c": case_id, "t": typ, "p": json.dumps(payload)},
-        )
+def _event(conn, case_id: str, typ: str, payload: Dict[str, Any]) -> None:
+    append_event(conn, case_id, typ, payload)
 
 # =========================
 # CONTACTO (PRE-PAGO)
 # =========================
 @router.post("/{case_id}/contact")
-def save_case_contact(case_id: str, data: CaseContactIn, background_tasks: BackgroundTasks):
+def save_case_contact(case_id: str, data: CaseContactIn):
     engine = get_engine()
     with engine.begin() as conn:
         _case_exists(conn, case_id)
@@ -172,11 +146,9 @@ def save_case_contact(case_id: str, data: CaseContactIn, background_tasks: Backg
             ),
             {"id": case_id, "n": data.name.strip(), "e": str(data.email).strip()},
         )
+        _event(conn, case_id, "contact_saved", {})
+        _email_contact_saved(conn, case_id, data.name.strip(), str(data.email))
 
-    background_tasks.add_task(
-        _email_contact_saved, case_id, data.name.strip(), str(data.email)
-    )
-    _event(case_id, "contact_saved", {})
     return {"ok": True}
 
 
@@ -268,48 +240,35 @@ async def append_documents(case_id: str, files: List[UploadFile] = File(...)):
         raise HTTPException(status_code=400, detail=f"Máximo {MAX_APPEND_FILES} documentos por subida.")
 
     engine = get_engine()
-    with engine.begin() as conn:
-        _case_exists(conn, case_id)
 
-    uploaded_docs = []
-    for uf in files:
-        data = await uf.read()
-        if not data:
-            continue
+    # Handler async: la BD (síncrona) va a un hilo para no bloquear el event loop
+    def _check_case() -> None:
+        with engine.begin() as conn:
+            _case_exists(conn, case_id)
 
-        b2_bucket, b2_key = upload_bytes(case_id, "original", data, ".bin", (uf.content_type or "application/octet-stream"))
+    await asyncio.to_thread(_check_case)
 
-        uploaded_docs.append({"bucket": b2_bucket, "key": b2_key})
+    ingested = await ingest_uploads(case_id, files, kind_folder="original", default_name="documento")
+    uploaded_docs = [{"bucket": d["bucket"], "key": d["key"]} for d in ingested]
 
+    def _register() -> None:
         with engine.begin() as conn:
+            insert_documents(conn, case_id, "original", ingested)
             conn.execute(
-                text(
-                    "INSERT INTO documents(case_id, kind, b2_bucket, b2_key, mime, size_bytes, created_at) "
-                    "VALUES (:id,'original',:b,:k,:m,:s,NOW())"
-                ),
-                {
-                    "id": case_id,
-                    "b": b2_bucket,
-                    "k": b2_key,
-                    "m": uf.content_type,
-                    "s": len(data),
-                },
+                text("UPDATE cases SET status='uploaded', updated_at=NOW() WHERE id=:id"),
+                {"id": case_id},
             )
+            _event(conn, case_id, "expediente_documents_appended", {"documents": uploaded_docs})
 
-    with engine.begin() as conn:
-        conn.execute(
-            text("UPDATE cases SET status='uploaded', updated_at=NOW() WHERE id=:id"),
-            {"id": case_id},
-        )
+    await asyncio.to_thread(_register)
 
-    _event(case_id, "expediente_documents_appended", {"documents": uploaded_docs})
     return {"ok": True}
 
 # =========================
 # REVIEW
 # =========================
 @router.post("/{case_id}/review")
-def review_case(case_id: str, background_tasks: BackgroundTasks):
+def review_case(case_id: str):
     engine = get_engine()
     with engine.begin() as conn:
         meta = _case_exists(conn, case_id)
@@ -333,27 +292,49 @@ def review_case(case_id: str, background_tasks: BackgroundTasks):
             text("UPDATE cases SET status=:s, updated_at=NOW() WHERE id=:id"),
             {"s": new_status, "id": case_id},
         )
+        _event(conn, case_id, "case_reviewed", {"status": new_status})
 
-    if meta["contact_email"] and new_status != old_status:
-        if new_status == "pending_documents":
-            background_tasks.add_task(
-                _email_pending, case_id, meta["contact_name"] or "Usuario", meta["contact_email"]
-            )
-        elif new_status == "ready_to_pay":
-            background_tasks.add_task(
-                _email_ready, case_id, meta["contact_name"] or "Usuario", meta["contact_email"]
-            )
+        if meta["contact_email"] and new_status != old_status:
+            if new_status == "pending_documents":
+                _email_pending(conn, case_id, meta["contact_name"] or "Usuario", meta["contact_email"])
+            elif new_status == "ready_to_pay":
+                _email_ready(conn, case_id, meta["contact_name"] or "Usuario", meta["contact_email"])
 
-    _event(case_id, "case_reviewed", {"status": new_status})
     return {"ok": True, "status": new_status}
 
 # =========================
 # ESTADO PÚBLICO
 # =========================
+# Textos en bruto de la extracción (OCR/visión/PDF): el frontend no los usa y son
+# la mayor parte del JSON. view=slim los quita de "extracted".
+RAW_TEXT_KEYS = ("raw_text_pdf", "raw_text_vision", "raw_text_blob", "vision_raw_text", "extraction_debug")
+
+
+def _slim_extracted(extracted: Dict[str, Any]) -> Dict[str, Any]:
+    core = extracted.get("extracted")
+    if not isinstance(core, dict):
+        return extracted
+    return {**extracted, "extracted": {k: v for k, v in core.items() if k not in RAW_TEXT_KEYS}}
+
+
 @router.get("/{case_id}/public-status")
-def public_status(case_id: str):
+def public_status(
+    case_id: str,
+    request: Request,
+    response: Response,
+    view: str = Query(default="full", pattern="^(full|slim)$"),
+):
     engine = get_engine()
     with engine.begin() as conn:
+        # Versión (updated_at + última extracción): si no ha cambiado, 304 sin más consultas
+        version = case_version(conn, case_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="case_id no existe")
+        etag = make_etag(version, view)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+
         row = conn.execute(
             text(
                 """
@@ -398,6 +379,8 @@ def public_status(case_id: str):
     organismo = row[6] or ""
     expediente_ref = row[7] or ""
     extracted = ex_row[0] if ex_row and isinstance(ex_row[0], dict) else {}
+    if view == "slim":
+        extracted = _slim_extracted(extracted)
 
     if contact_name and not interested_data.get("full_name"):
         interested_data["full_name"] = contact_name
@@ -415,6 +398,7 @@ def public_status(case_id: str):
     else:
         msg = "Hemos analizado tu multa. Para continuar, necesitamos tus datos y autorización."
 
+    set_etag(response, etag)
     return {
         "ok": True,
         "case_id": case_id,
@@ -527,27 +511,37 @@ async def authorize_case(case_id: str, request: Request):
     }
 
 @router.get("/{case_id}/authorization-pdf")
-def download_authorization_pdf(case_id: str, request: Request):
+def download_authorization_pdf(
+    case_id: str,
+    request: Request,
+    mode: str = Query("redirect", pattern="^(redirect|stream)$"),
+):
     """
     Devuelve el PDF de autorización ya relleno para descargar y firmar.
+
+    Sirve el PDF almacenado en B2 (redirect a URL firmada por defecto, o
+    stream con mode=stream). Solo se regenera si han cambiado los datos
+    del interesado, la versión o el representante.
     """
     engine = get_engine()
     with engine.begin() as conn:
         _case_exists(conn, case_id)
-        ip = get_request_ip(request)
-        case_meta = _get_case_snapshot(conn, case_id)
-        payload = _authorization_payload_from_case(case_meta, ip=ip, version="v1_dgt_homologado")
-
-        payload["representante_nombre"] = "LA TALAMANQUINA, S.L."
-        payload["representante_nif"] = "B75440115"
-        payload["representante_domicilio"] = "Calle Velázquez, 15 – 28001 Madrid (España)"
-
-        pdf_bytes = generate_authorization_pdf(payload)
+        auth_doc = ensure_authorization_pdf(
+            conn,
+            case_id=case_id,
+            request=request,
+            version="v1_dgt_homologado",
+        )
 
-    headers = {
-        "Content-Disposition": f'attachment; filename="autorizacion_{case_id}.pdf"'
-    }
-    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+    doc = auth_doc.get("document") or {}
+    return b2_download_response(
+        request,
+        doc["bucket"],
+        doc["key"],
+        filename=f"autorizacion_{case_id}.pdf",
+        mime="application/pdf",
+        mode=mode,
+    )
 
 
 
@@ -714,7 +708,7 @@ async def upload_receipt(case_id: str, file: UploadFile = File(...)):
             {"id": case_id},
         )
 
-        _event(case_id, "submission_receipt_uploaded", {
+        _event(conn, case_id, "submission_receipt_uploaded", {
             "file": b2_key
         })
 
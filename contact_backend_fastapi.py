@@ -1,19 +1,13 @@
 import os
-import smtplib
-from email.message import EmailMessage
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr, Field
 
+from email_outbox import enqueue_email_tx, smtp_configured
+
 router = APIRouter()
 
-SMTP_HOST = os.getenv("SMTP_HOST")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_USER = os.getenv("SMTP_USER", "info@recurretumulta.eu")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-SMTP_FROM = os.getenv("SMTP_FROM", "info@recurretumulta.eu")
 CONTACT_TO = os.getenv("CONTACT_TO", "info@recurretumulta.eu")
-SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
 
 
 class ContactRequest(BaseModel):
@@ -25,7 +19,7 @@ class ContactRequest(BaseModel):
 
 @router.post("/contact")
 def send_contact_email(payload: ContactRequest):
-    if not SMTP_HOST or not SMTP_PASSWORD:
+    if not smtp_configured():
         raise HTTPException(
             status_code=500,
             detail="Falta configuración SMTP en el servidor.",
@@ -42,19 +36,15 @@ def send_contact_email(payload: ContactRequest):
         f"{payload.mensaje}\n"
     )
 
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = SMTP_FROM
-    msg["To"] = CONTACT_TO
-    msg["Reply-To"] = payload.email
-    msg.set_content(body)
-
+    # Se encola y se responde al instante; el worker de email_outbox lo envía
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as server:
-            if SMTP_USE_TLS:
-                server.starttls()
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
+        enqueue_email_tx(
+            to_email=CONTACT_TO,
+            subject=subject,
+            body=body,
+            reply_to=str(payload.email),
+            kind="contact_form",
+        )
     except Exception:
         raise HTTPException(
             status_code=500,
@@ -0,0 +1,112 @@
+# cpu_pool.py
+# Pool de procesos para los pasos de CPU pura (texto de PDF/DOCX con pypdf, PDF/DOCX
+# con reportlab/python-docx, triage por regex). En un hilo del threadpool esos pasos
+# retienen el GIL y frenan al resto de peticiones del worker; en otro proceso no.
+#
+# - CPU_POOL_WORKERS: nº de procesos (por defecto nº de CPUs - 1, máx. 4; 0 = en línea).
+# - CPU_POOL_TIMEOUT_SECONDS: espera máxima por tarea; pasada, se matan los procesos del
+#   pool (se recrea en la siguiente tarea) y se responde 503.
+# - Si el pool se rompe (proceso hijo muerto por OOM, etc.) se recrea y la tarea se
+#   ejecuta en línea: nunca se pierde la petición por el pool.
+#
+# Las funciones y argumentos deben ser serializables con pickle (funciones de módulo,
+# dicts, str, bytes). El contexto de la petición (traza, perfil) no viaja al hijo: si la
+# petición se está perfilando (profiling.py) la tarea se ejecuta en línea para que
+# @profiled y los span de telemetría midan el trabajo real y no solo la espera.
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+from profiling import profile_active
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+WORKERS = max(0, _env_int("CPU_POOL_WORKERS", min(4, (os.cpu_count() or 1) - 1)))
+TIMEOUT_SECONDS = _env_int("CPU_POOL_TIMEOUT_SECONDS", 60)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if WORKERS <= 0:
+        return None
+    with _lock:
+        if _pool is None:
+            # forkserver: los hijos no heredan hilos ni conexiones abiertas del worker
+            ctx = multiprocessing.get_context("forkserver")
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=ctx)
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _lock:
+        broken, _pool = _pool, None
+    if broken is not None:
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _kill_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    # ProcessPoolExecutor no expone sus procesos: _processes es interno pero estable
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    """Ejecuta fn(*args) en el pool de procesos y espera el resultado (bloqueante)."""
+    pool = _get_pool()
+    if pool is None or profile_active():
+        return fn(*args)
+    future = pool.submit(fn, *args)
+    try:
+        return future.result(timeout=TIMEOUT_SECONDS)
+    except FutureTimeout:
+        # Si ya está corriendo, cancel() no lo para: se matan los hijos del pool para no
+        # dejar un proceso ocupado; las demás tareas en curso caen a BrokenProcessPool (en línea)
+        if not future.cancel():
+            _kill_pool(pool)
+        logger.warning("Tarea de CPU %s superó %ss", getattr(fn, "__name__", fn), TIMEOUT_SECONDS)
+        raise HTTPException(status_code=503, detail="Servidor ocupado, inténtalo de nuevo en unos segundos.")
+    except BrokenProcessPool:
+        logger.warning("Pool de CPU roto; se recrea y %s se ejecuta en línea", getattr(fn, "__name__", fn))
+        _reset_pool()
+        return fn(*args)
+
+
+async def run_cpu_async(fn: Callable[..., Any], *args: Any) -> Any:
+    """Variante para handlers async: no bloquea el event loop mientras espera."""
+    return await asyncio.to_thread(run_cpu, fn, *args)
+
+
+def shutdown_cpu_pool() -> None:
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
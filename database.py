@@ -1,7 +1,16 @@
 import os
+import threading
+from typing import Optional
+
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 
+from telemetry import instrument_engine
+
+_ENGINE: Optional[Engine] = None
+_ENGINE_LOCK = threading.Lock()
+
+
 def get_database_url() -> str:
     url = os.getenv("DATABASE_URL", "").strip()
     if not url:
@@ -9,8 +18,18 @@ def get_database_url() -> str:
     return url
 
 def get_engine() -> Engine:
+    # Un único engine (y pool) por proceso: crear uno por llamada abría
+    # un pool nuevo en cada helper/evento.
     # pool_pre_ping evita conexiones muertas en Render
-    return create_engine(get_database_url(), pool_pre_ping=True)
+    global _ENGINE
+    engine = _ENGINE
+    if engine is not None:
+        return engine
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = create_engine(get_database_url(), pool_pre_ping=True)
+            instrument_engine(_ENGINE)
+        return _ENGINE
 
 def ping_db(engine: Engine) -> bool:
     with engine.connect() as conn:
@@ -0,0 +1,106 @@
+# deterministic_extract.py
+# Extracción sin LLM a partir del texto del PDF/DOCX.
+#
+# Rellena el mismo esquema que openai_text.extract_from_text (organismo, expediente_ref,
+# importe, fechas, tipo_sancion, ...) con reglas y regex. El hecho, preceptos, velocidades
+# y jurisdicción los completa después analyze._enrich_with_triage como en el flujo normal.
+# Se usa cuando el breaker del LLM está abierto o la llamada agota su presupuesto.
+import re
+from typing import Any, Dict, List, Optional
+
+from openai_text import _postprocess_data
+
+_DATE = r"(\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4})"
+
+_ORGANISMO_PATTERNS: List[str] = [
+    r"(ajuntament\s+de\s+[a-zà-ÿ' \-]{2,40})",
+    r"(ayuntamiento\s+de\s+[a-zá-úñü' \-]{2,40})",
+    r"(jefatura\s+provincial\s+de\s+tr[aá]fico\s+de\s+[a-zá-úñü \-]{2,30})",
+    r"(direcci[oó]n\s+general\s+de\s+tr[aá]fico)",
+    r"(servei\s+catal[aà]\s+de\s+tr[aà]nsit)",
+    r"(tr[aà]fico\s+del\s+gobierno\s+vasco)",
+    r"(guardia\s+civil)",
+]
+
+_EXPEDIENTE_PATTERNS: List[str] = [
+    r"(?:n[º°o]\.?\s*|n[uú]m\.?\s*|n[uú]mero\s+)?(?:de\s+)?expediente\s*[:.\-]?\s*(?:n[º°o]\.?\s*)?([A-Z0-9][A-Z0-9/\-.]{4,30})",
+    r"\bexpedient\s*[:.\-]?\s*([A-Z0-9][A-Z0-9/\-.]{4,30})",
+    r"\bexpte\.?\s*[:.\-]?\s*([A-Z0-9][A-Z0-9/\-.]{4,30})",
+    r"\bbolet[ií]n\s*(?:n[º°o]\.?\s*)?[:.\-]?\s*([A-Z0-9][A-Z0-9/\-.]{4,30})",
+]
+
+_IMPORTE_PATTERNS: List[str] = [
+    r"importe[^0-9\n]{0,40}(\d{1,4}(?:[.,]\d{2})?)\s*(?:€|eur)",
+    r"sanci[oó]n\s+(?:de|pecuniaria)[^0-9\n]{0,20}(\d{1,4}(?:[.,]\d{2})?)\s*(?:€|eur)",
+    r"multa\s+de\s+(\d{1,4}(?:[.,]\d{2})?)\s*(?:€|eur)",
+    r"(\d{1,4}(?:[.,]\d{2})?)\s*(?:€|euros)",
+]
+
+
+def _first(patterns: List[str], text: str, flags: int = re.IGNORECASE) -> Optional[str]:
+    for pat in patterns:
+        m = re.search(pat, text, flags)
+        if m:
+            return m.group(1).strip()
+    return None
+
+
+def _labeled_date(text: str, labels: List[str]) -> Optional[str]:
+    for label in labels:
+        m = re.search(label + r"[^0-9\n]{0,30}" + _DATE, text, re.IGNORECASE)
+        if m:
+            return m.group(1)
+    return None
+
+
+def _tipo_sancion(low: str) -> Optional[str]:
+    m = re.search(r"(?:calificaci[oó]n|clasificaci[oó]n|infracci[oó]n|gravedad)\s*[:.\-]?\s*(muy\s+grave|grave|leve)\b", low)
+    if m:
+        return re.sub(r"\s+", " ", m.group(1)).upper()
+    if "muy grave" in low:
+        return "MUY GRAVE"
+    return None
+
+
+def _pone_fin_via(low: str) -> Optional[bool]:
+    if re.search(r"no\s+pone\s+fin\s+a\s+la\s+v[ií]a\s+administrativa", low):
+        return False
+    if re.search(r"pone\s+fin\s+a\s+la\s+v[ií]a\s+administrativa", low):
+        return True
+    return None
+
+
+def _plazo_recurso(low: str) -> Optional[str]:
+    m = re.search(
+        r"plazo\s+de\s+((?:\d{1,3}|un|una|diez|quince|veinte|treinta)\s+(?:d[ií]as?|mes(?:es)?)(?:\s+(?:naturales|h[aá]biles))?)",
+        low,
+    )
+    return m.group(1) if m else None
+
+
+def extract_deterministic(text: str) -> Dict[str, Any]:
+    """Campos de extract_from_text obtenidos solo con reglas sobre el texto."""
+    raw = text or ""
+    low = raw.lower()
+
+    organismo = _first(_ORGANISMO_PATTERNS, raw)
+    if organismo:
+        organismo = re.split(r"[\n\r]|\s{2,}", organismo)[0].strip(" ,.;:-").title()
+
+    data: Dict[str, Any] = {
+        "organismo": organismo,
+        "expediente_ref": _first(_EXPEDIENTE_PATTERNS, raw),
+        "importe": _first(_IMPORTE_PATTERNS, raw),
+        "fecha_notificacion": _labeled_date(raw, [r"fecha\s+(?:de\s+)?notificaci[oó]n", r"notificad[oa]\s+(?:el|en)"]),
+        "fecha_documento": _labeled_date(
+            raw,
+            [r"fecha\s+(?:de\s+(?:la\s+)?)?denuncia", r"fecha\s+(?:del\s+)?documento", r"fecha\s+(?:de\s+)?(?:la\s+)?infracci[oó]n", r"\bfecha"],
+        ),
+        "tipo_sancion": _tipo_sancion(low),
+        "pone_fin_via_administrativa": _pone_fin_via(low),
+        "plazo_recurso_sugerido": _plazo_recurso(low),
+        # El hecho lo aísla _enrich_with_triage (hecho_imputado_engine) sobre el texto completo
+        "hecho_denunciado_literal": None,
+        "observaciones": "Extracción determinista (LLM no disponible); pendiente de enriquecimiento IA.",
+    }
+    return _postprocess_data(data)
@@ -0,0 +1,106 @@
+# document_ingest.py — ingesta de subidas (UploadFile → B2 → documents) en bloque
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import text
+
+from b2_storage import upload_fileobj
+
+
+def _concurrency() -> int:
+    try:
+        return max(1, int((os.getenv("INGEST_CONCURRENCY") or "5").strip()))
+    except ValueError:
+        return 5
+
+
+def safe_filename(name: Optional[str], default: str = "documento") -> str:
+    return (name or default).replace("\\", "_").replace("/", "_")[:120]
+
+
+def ext_from_filename(filename: str) -> str:
+    ext = ".bin"
+    if "." in filename:
+        ext = "." + filename.split(".")[-1].lower()
+        if len(ext) > 8:
+            ext = ".bin"
+    return ext
+
+
+def _upload_size(uf: UploadFile) -> int:
+    f = uf.file
+    pos = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(pos)
+    return size
+
+
+def _upload_one(case_id: str, kind_folder: str, idx: int, uf: UploadFile, default_name: str) -> Optional[Dict[str, Any]]:
+    filename = safe_filename(uf.filename, f"{default_name}_{idx}")
+    mime = uf.content_type or "application/octet-stream"
+
+    uf.file.seek(0)
+    if _upload_size(uf) == 0:
+        return None
+
+    stored = upload_fileobj(case_id, kind_folder, uf.file, ext_from_filename(filename), mime)
+    return {
+        "idx": idx,
+        "filename": filename,
+        "bucket": stored["bucket"],
+        "key": stored["key"],
+        "mime": mime,
+        "size_bytes": stored["size_bytes"],
+        "sha256": stored["sha256"],
+    }
+
+
+async def ingest_uploads(
+    case_id: str,
+    files: List[UploadFile],
+    kind_folder: str = "original",
+    default_name: str = "documento",
+) -> List[Dict[str, Any]]:
+    """
+    Sube los ficheros a B2 en paralelo (acotado por INGEST_CONCURRENCY),
+    en streaming desde el fichero temporal de Starlette (multipart si son
+    grandes) y calculando sha256 sobre la marcha.
+    Ignora ficheros vacíos. Mantiene el orden de entrada.
+    """
+    sem = asyncio.Semaphore(_concurrency())
+
+    async def _run(idx: int, uf: UploadFile):
+        async with sem:
+            return await asyncio.to_thread(_upload_one, case_id, kind_folder, idx, uf, default_name)
+
+    results = await asyncio.gather(*[_run(idx, uf) for idx, uf in enumerate(files, start=1)])
+    return [r for r in results if r]
+
+
+def insert_documents(conn, case_id: str, kind: str, docs: List[Dict[str, Any]]) -> None:
+    """
+    Inserta todas las filas de documents en una sola sentencia INSERT multi-fila.
+    """
+    if not docs:
+        return
+
+    values = []
+    params: Dict[str, Any] = {"case_id": case_id, "kind": kind}
+    for i, d in enumerate(docs):
+        values.append(f"(:case_id, :kind, :b{i}, :k{i}, :sha{i}, :m{i}, :s{i}, NOW())")
+        params[f"b{i}"] = d["bucket"]
+        params[f"k{i}"] = d["key"]
+        params[f"sha{i}"] = d.get("sha256")
+        params[f"m{i}"] = d.get("mime") or "application/octet-stream"
+        params[f"s{i}"] = int(d.get("size_bytes") or 0)
+
+    conn.execute(
+        text(
+            "INSERT INTO documents(case_id, kind, b2_bucket, b2_key, sha256, mime, size_bytes, created_at) "
+            "VALUES " + ", ".join(values)
+        ),
+        params,
+    )
@@ -1,8 +1,5 @@
 import io
 import re
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 
 SECTION_TITLES = {
     "ANTECEDENTES",
@@ -30,6 +27,11 @@ def _write_markdown_bold(paragraph, text: str):
         run.bold = is_bold
 
 def build_docx(title: str, body: str) -> bytes:
+    # python-docx se importa al generar (no al arrancar): acelera el cold start
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
     doc = Document()
 
     style = doc.styles["Normal"]
@@ -0,0 +1,328 @@
+# email_outbox.py
+# Cola de emails salientes (tabla email_outbox) + envío por lotes con sesión SMTP persistente.
+#
+# - enqueue_email(conn, ...) guarda el email en la misma transacción que el cambio
+#   de negocio y vuelve al instante (no hay SMTP en el request).
+# - send_pending() reclama un lote (FOR UPDATE SKIP LOCKED), lo envía reutilizando
+#   una única conexión SMTP, reintenta con backoff exponencial y deja un evento
+#   email_sent / email_failed en el caso.
+# - El envío lo hace un hilo de fondo en cada proceso (EMAIL_OUTBOX_WORKER, activo por
+#   defecto; "false" para desactivarlo) y además el cron: POST /ops/automation/tick
+#   vacía un lote al final (y POST /ops/automation/email-outbox/tick a mano).
+import logging
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from database import get_engine
+from event_log import EventBatch
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 3600
+STALE_SENDING_MINUTES = 10
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(_env(name) or default)
+    except ValueError:
+        return default
+
+
+def smtp_configured() -> bool:
+    return bool(_env("SMTP_HOST") and (_env("SMTP_FROM") or _env("SMTP_USER")))
+
+
+# =========================================================
+# ENCOLAR
+# =========================================================
+def enqueue_email(
+    conn,
+    *,
+    to_email: str,
+    subject: str,
+    body: str,
+    reply_to: Optional[str] = None,
+    case_id: Optional[str] = None,
+    kind: str = "",
+) -> Optional[str]:
+    """Encola un email dentro de la transacción del llamador. Devuelve el id."""
+    if not to_email:
+        return None
+    row = conn.execute(
+        text(
+            """
+            INSERT INTO email_outbox(case_id, kind, to_email, reply_to, subject, body, status, next_attempt_at, created_at)
+            VALUES (:case_id, :kind, :to_email, :reply_to, :subject, :body, 'pending', NOW(), NOW())
+            RETURNING id
+            """
+        ),
+        {
+            "case_id": case_id,
+            "kind": kind or None,
+            "to_email": to_email.strip(),
+            "reply_to": reply_to,
+            "subject": subject,
+            "body": body,
+        },
+    ).fetchone()
+    wake_worker()
+    return str(row[0]) if row else None
+
+
+def enqueue_email_tx(**kwargs) -> Optional[str]:
+    """Igual que enqueue_email pero abriendo su propia transacción."""
+    with get_engine().begin() as conn:
+        return enqueue_email(conn, **kwargs)
+
+
+# =========================================================
+# SESIÓN SMTP PERSISTENTE
+# =========================================================
+class _SMTPSession:
+    """
+    Conexión SMTP reutilizable (STARTTLS + login una sola vez).
+    Se reconecta si el servidor la cierra. No es thread-safe: se usa bajo _send_lock.
+    """
+
+    def __init__(self) -> None:
+        self._smtp: Optional[smtplib.SMTP] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        host = _env("SMTP_HOST")
+        port = int(_env("SMTP_PORT", "587") or "587")
+        user = _env("SMTP_USER")
+        pwd = _env("SMTP_PASSWORD") or _env("SMTP_PASS")
+        use_tls = _env("SMTP_USE_TLS", "true").lower() in ("1", "true", "yes", "si", "sí")
+
+        if port == 465:
+            smtp: smtplib.SMTP = smtplib.SMTP_SSL(host, port, timeout=20)
+        else:
+            smtp = smtplib.SMTP(host, port, timeout=20)
+            if use_tls:
+                smtp.starttls()
+        if user and pwd:
+            smtp.login(user, pwd)
+        return smtp
+
+    def _alive(self) -> bool:
+        if self._smtp is None:
+            return False
+        try:
+            return self._smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def send(self, msg: EmailMessage) -> None:
+        if not self._alive():
+            self.close()
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._smtp = self._connect()
+            self._smtp.send_message(msg)
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+
+
+_session = _SMTPSession()
+_send_lock = threading.Lock()
+
+
+def _build_message(row: Dict[str, Any]) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = _env("SMTP_FROM") or _env("SMTP_USER")
+    msg["To"] = row["to_email"]
+    msg["Subject"] = row["subject"]
+    if row.get("reply_to"):
+        msg["Reply-To"] = row["reply_to"]
+    msg.set_content(row["body"] or "")
+    return msg
+
+
+def _backoff_seconds(attempts: int) -> int:
+    return min(BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), BACKOFF_MAX_SECONDS)
+
+
+# =========================================================
+# ENVÍO POR LOTES
+# =========================================================
+def _claim_batch(limit: int) -> List[Dict[str, Any]]:
+    with get_engine().begin() as conn:
+        rows = conn.execute(
+            text(
+                """
+                UPDATE email_outbox
+                SET status = 'sending', locked_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE (status IN ('pending', 'retry') AND next_attempt_at <= NOW())
+                       OR (status = 'sending' AND locked_at < NOW() - make_interval(mins => :stale))
+                    ORDER BY next_attempt_at ASC
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, case_id, kind, to_email, reply_to, subject, body, attempts
+                """
+            ),
+            {"limit": limit, "stale": STALE_SENDING_MINUTES},
+        ).fetchall()
+
+    return [
+        {
+            "id": str(r[0]),
+            "case_id": str(r[1]) if r[1] else None,
+            "kind": r[2] or "",
+            "to_email": r[3],
+            "reply_to": r[4],
+            "subject": r[5],
+            "body": r[6],
+            "attempts": int(r[7] or 0),
+        }
+        for r in rows
+    ]
+
+
+def send_pending(limit: int = 50) -> Dict[str, Any]:
+    """
+    Envía un lote de emails pendientes con una sola sesión SMTP.
+    Respeta EMAIL_SEND_RATE (emails/segundo, 0 = sin límite).
+    """
+    if not smtp_configured():
+        return {"ok": False, "reason": "smtp_not_configured", "sent": 0, "failed": 0}
+
+    batch = _claim_batch(limit)
+    if not batch:
+        return {"ok": True, "claimed": 0, "sent": 0, "failed": 0, "retry": 0}
+
+    rate = _env_float("EMAIL_SEND_RATE", 5.0)
+    min_interval = 1.0 / rate if rate > 0 else 0.0
+
+    results = []
+    with _send_lock:
+        for row in batch:
+            started = time.monotonic()
+            try:
+                _session.send(_build_message(row))
+                results.append((row, None))
+            except Exception as e:
+                _session.close()
+                results.append((row, f"{type(e).__name__}: {e}"))
+            elapsed = time.monotonic() - started
+            if min_interval and elapsed < min_interval:
+                time.sleep(min_interval - elapsed)
+
+    sent = failed = retry = 0
+    events = EventBatch()
+    with get_engine().begin() as conn:
+        for row, error in results:
+            if error is None:
+                sent += 1
+                conn.execute(
+                    text(
+                        "UPDATE email_outbox SET status='sent', sent_at=NOW(), last_error=NULL, "
+                        "attempts=attempts+1 WHERE id=:id"
+                    ),
+                    {"id": row["id"]},
+                )
+                if row["case_id"]:
+                    events.add(row["case_id"], "email_sent", {"outbox_id": row["id"], "kind": row["kind"]})
+                continue
+
+            attempts = row["attempts"] + 1
+            final = attempts >= MAX_ATTEMPTS
+            if final:
+                failed += 1
+            else:
+                retry += 1
+            conn.execute(
+                text(
+                    """
+                    UPDATE email_outbox
+                    SET status = :status,
+                        attempts = :attempts,
+                        last_error = :error,
+                        next_attempt_at = NOW() + make_interval(secs => :delay)
+                    WHERE id = :id
+                    """
+                ),
+                {
+                    "id": row["id"],
+                    "status": "failed" if final else "retry",
+                    "attempts": attempts,
+                    "error": error[:1000],
+                    "delay": _backoff_seconds(attempts),
+                },
+            )
+            if row["case_id"] and final:
+                events.add(
+                    row["case_id"],
+                    "email_failed",
+                    {"outbox_id": row["id"], "kind": row["kind"], "attempts": attempts, "error": error[:300]},
+                )
+        events.flush(conn)
+
+    return {"ok": True, "claimed": len(batch), "sent": sent, "failed": failed, "retry": retry}
+
+
+# =========================================================
+# WORKER EN SEGUNDO PLANO
+# =========================================================
+_wake = threading.Event()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def wake_worker() -> None:
+    _wake.set()
+
+
+def _worker_loop() -> None:
+    interval = _env_float("EMAIL_OUTBOX_POLL_SECONDS", 15.0)
+    while True:
+        if _wake.wait(timeout=interval):
+            # Deja que la transacción que encoló el email haga commit
+            time.sleep(0.5)
+        _wake.clear()
+        try:
+            # Vaciar la cola mientras lleguen lotes completos
+            while send_pending(limit=50).get("claimed", 0) >= 50:
+                pass
+        except Exception as e:
+            logger.warning("email_outbox: fallo en el worker: %s", e)
+        finally:
+            # Cerrar la sesión si no hay más trabajo inmediato
+            if not _wake.is_set():
+                with _send_lock:
+                    _session.close()
+
+
+def start_outbox_worker() -> bool:
+    """Arranca el hilo de envío salvo EMAIL_OUTBOX_WORKER=false. Idempotente."""
+    global _worker
+    if _env("EMAIL_OUTBOX_WORKER", "true").lower() not in ("1", "true", "yes"):
+        return False
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="email-outbox", daemon=True)
+            _worker.start()
+    return True
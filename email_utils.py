@@ -1,23 +1,10 @@
 # email_utils.py
 # Utilidades de email para RecurreTuMulta.
-# Usa las variables SMTP_* que ya tienes en Render.
+# El envío pasa por email_outbox (cola + worker con las variables SMTP_* de Render).
 
-import os
-import smtplib
-from email.message import EmailMessage
 from typing import Optional
 
-
-def _env(name: str, default: str = "") -> str:
-    return (os.getenv(name) or default).strip()
-
-
-def _smtp_port() -> int:
-    raw = _env("SMTP_PORT", "587")
-    try:
-        return int(raw)
-    except Exception:
-        return 587
+from email_outbox import enqueue_email_tx
 
 
 def send_email(
@@ -26,33 +13,25 @@ def send_email(
     subject: str,
     body: str,
     reply_to: Optional[str] = None,
+    case_id: Optional[str] = None,
+    kind: str = "",
 ) -> bool:
-    smtp_host = _env("SMTP_HOST")
-    smtp_user = _env("SMTP_USER")
-    smtp_password = _env("SMTP_PASSWORD")
-    smtp_from = _env("SMTP_FROM") or smtp_user
-    smtp_use_tls = _env("SMTP_USE_TLS", "true").lower() in ("1", "true", "yes", "si", "sí")
-
-    if not smtp_host or not smtp_user or not smtp_password or not smtp_from:
-        # No rompemos el flujo si falta SMTP; devolvemos False.
+    """
+    Encola el email en email_outbox (el envío real lo hace el worker).
+    Devuelve True si ha quedado encolado.
+    """
+    if not to_email:
         return False
-
-    msg = EmailMessage()
-    msg["From"] = smtp_from
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    if reply_to:
-        msg["Reply-To"] = reply_to
-
-    msg.set_content(body)
-
-    with smtplib.SMTP(smtp_host, _smtp_port(), timeout=20) as smtp:
-        if smtp_use_tls:
-            smtp.starttls()
-        smtp.login(smtp_user, smtp_password)
-        smtp.send_message(msg)
-
-    return True
+    return bool(
+        enqueue_email_tx(
+            to_email=to_email,
+            subject=subject,
+            body=body,
+            reply_to=reply_to,
+            case_id=case_id,
+            kind=kind,
+        )
+    )
 
 
 def build_vehicle_removal_paid_email(
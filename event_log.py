@@ -0,0 +1,161 @@
+# event_log.py — escritura de events centralizada (individual, por lotes y asíncrona)
+#
+# Sustituye a las copias locales de _event/_append_event:
+# - append_event(conn, ...)      → 1 fila dentro de la transacción del llamador
+# - EventBatch / event_batch(...) → acumula eventos de una unidad de trabajo y
+#                                   los vuelca con un único INSERT multi-fila
+# - emit_async(...)              → telemetría no crítica, fire-and-forget,
+#                                   agrupada por un hilo de fondo
+import atexit
+import json
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class RawJSON(str):
+    """Payload ya serializado: se envía tal cual, sin volver a serializar."""
+
+
+Payload = Union[Dict[str, Any], RawJSON, None]
+
+
+def dumps_payload(payload: Payload) -> str:
+    """Serializador único de payloads (UTF-8 legible, fechas/UUID como str)."""
+    if isinstance(payload, RawJSON):
+        return str(payload)
+    return json.dumps(payload or {}, ensure_ascii=False, default=str)
+
+
+_INSERT_PREFIX = "INSERT INTO events(case_id, type, payload, created_at) VALUES "
+
+
+def _insert_many(conn, rows: List[Tuple[Optional[str], str, str]]) -> None:
+    if not rows:
+        return
+    values = []
+    params: Dict[str, Any] = {}
+    for i, (case_id, typ, payload_json) in enumerate(rows):
+        values.append(f"(:c{i}, :t{i}, CAST(:p{i} AS JSONB), NOW())")
+        params[f"c{i}"] = case_id
+        params[f"t{i}"] = typ
+        params[f"p{i}"] = payload_json
+    conn.execute(text(_INSERT_PREFIX + ", ".join(values)), params)
+
+
+def append_event(conn, case_id: Optional[str], typ: str, payload: Payload = None) -> None:
+    """Inserta un evento usando la conexión/transacción del llamador."""
+    _insert_many(conn, [(case_id, typ, dumps_payload(payload))])
+
+
+class EventBatch:
+    """
+    Acumula eventos y los inserta de una vez con flush(conn).
+    El payload se serializa al añadirlo (una sola vez).
+    """
+
+    def __init__(self) -> None:
+        self._rows: List[Tuple[Optional[str], str, str]] = []
+
+    def add(self, case_id: Optional[str], typ: str, payload: Payload = None) -> None:
+        self._rows.append((case_id, typ, dumps_payload(payload)))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def flush(self, conn) -> int:
+        rows, self._rows = self._rows, []
+        _insert_many(conn, rows)
+        return len(rows)
+
+
+@contextmanager
+def event_batch(conn) -> Iterator[EventBatch]:
+    """
+    with event_batch(conn) as ev:
+        ev.add(case_id, "x", {...})
+        ev.add(case_id, "y", {...})
+    # al salir sin excepción → un único INSERT en la misma transacción
+    """
+    batch = EventBatch()
+    yield batch
+    batch.flush(conn)
+
+
+# =========================================================
+# Telemetría asíncrona (fire-and-forget)
+# =========================================================
+_ASYNC_MAX_BATCH = 200
+_ASYNC_FLUSH_SECONDS = 1.0
+_ASYNC_QUEUE_MAX = 10_000
+
+_async_queue: "queue.Queue[Tuple[Optional[str], str, str]]" = queue.Queue(maxsize=_ASYNC_QUEUE_MAX)
+_async_thread: Optional[threading.Thread] = None
+_async_lock = threading.Lock()
+
+
+def _drain(block_first: bool) -> List[Tuple[Optional[str], str, str]]:
+    rows: List[Tuple[Optional[str], str, str]] = []
+    try:
+        if block_first:
+            rows.append(_async_queue.get(timeout=_ASYNC_FLUSH_SECONDS))
+        while len(rows) < _ASYNC_MAX_BATCH:
+            rows.append(_async_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return rows
+
+
+def _write_rows(rows: List[Tuple[Optional[str], str, str]]) -> None:
+    if not rows:
+        return
+    try:
+        from database import get_engine
+
+        with get_engine().begin() as conn:
+            _insert_many(conn, rows)
+    except Exception as e:
+        # Telemetría: nunca rompe el flujo principal
+        logger.warning("event_log: descartados %d eventos async: %s", len(rows), e)
+
+
+def _async_worker() -> None:
+    while True:
+        _write_rows(_drain(block_first=True))
+
+
+def _ensure_async_worker() -> None:
+    global _async_thread
+    if _async_thread is not None and _async_thread.is_alive():
+        return
+    with _async_lock:
+        if _async_thread is None or not _async_thread.is_alive():
+            _async_thread = threading.Thread(target=_async_worker, name="event-log-async", daemon=True)
+            _async_thread.start()
+
+
+def emit_async(case_id: Optional[str], typ: str, payload: Payload = None) -> None:
+    """
+    Encola un evento no crítico; un hilo de fondo los inserta por lotes.
+    Si la cola está llena, el evento se descarta (nunca bloquea la petición).
+    """
+    _ensure_async_worker()
+    try:
+        _async_queue.put_nowait((case_id, typ, dumps_payload(payload)))
+    except queue.Full:
+        logger.warning("event_log: cola async llena, evento %s descartado", typ)
+
+
+def flush_async() -> None:
+    """Vacía la cola async de forma síncrona (apagado del proceso)."""
+    while not _async_queue.empty():
+        _write_rows(_drain(block_first=False))
+
+
+atexit.register(flush_async)
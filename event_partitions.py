@@ -0,0 +1,359 @@
+# event_partitions.py — events particionada por mes (created_at) + retención con archivo en B2
+#
+# - convert_events_table(conn): migración. Renombra la tabla events plana, crea events
+#   PARTITION BY RANGE (created_at) con particiones mensuales events_YYYY_MM y una
+#   partición DEFAULT de seguridad, copia los datos y borra la tabla antigua.
+# - ensure_partitions(): crea las particiones de los próximos EVENTS_PARTITIONS_AHEAD
+#   meses. Si la DEFAULT tiene filas de ese mes, las mueve antes de enganchar la nueva.
+# - archive_old_partitions(): las particiones de hace más de EVENTS_RETENTION_MONTHS se
+#   exportan a B2 como JSONL comprimido (archive/events/events_YYYY_MM.jsonl.gz), se
+#   registran en events_archive y se eliminan.
+# - Cron: POST /admin/events/maintenance. Tamaños: GET /admin/events/partitions.
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from sqlalchemy import text
+
+from database import get_engine
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+PARTITIONS_AHEAD = _env_int("EVENTS_PARTITIONS_AHEAD", 3)
+RETENTION_MONTHS = _env_int("EVENTS_RETENTION_MONTHS", 12)
+ARCHIVE_PREFIX = "archive/events"
+EXPORT_BATCH_ROWS = 5000
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, months: int) -> date:
+    idx = d.year * 12 + (d.month - 1) + months
+    return date(idx // 12, idx % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"events_{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned(conn) -> bool:
+    row = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('events')")).fetchone()
+    return bool(row) and row[0] == "p"
+
+
+# =========================================================
+# PARTICIONES
+# =========================================================
+def _create_partition(conn, month: date) -> Optional[str]:
+    name = _partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar():
+        return None
+    start, end = month.isoformat(), _add_months(month, 1).isoformat()
+
+    # Tabla suelta + mover lo que haya caído en DEFAULT + ATTACH: el ATTACH falla si la
+    # DEFAULT contiene filas del rango, y así no hace falta bloquear inserciones.
+    conn.execute(text(f"CREATE TABLE {name} (LIKE events INCLUDING DEFAULTS)"))
+    if conn.execute(text("SELECT to_regclass('events_default')")).scalar():
+        conn.execute(
+            text(
+                f"""
+                WITH moved AS (
+                    DELETE FROM events_default
+                    WHERE created_at >= CAST(:start AS TIMESTAMPTZ) AND created_at < CAST(:end AS TIMESTAMPTZ)
+                    RETURNING id, case_id, type, payload, created_at
+                )
+                INSERT INTO {name} (id, case_id, type, payload, created_at)
+                SELECT id, case_id, type, payload, created_at FROM moved
+                """
+            ),
+            {"start": start, "end": end},
+        )
+    conn.execute(text(f"ALTER TABLE events ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    return name
+
+
+def ensure_partitions(months_ahead: Optional[int] = None) -> List[str]:
+    """Crea las particiones del mes actual y de los siguientes. Idempotente."""
+    ahead = PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    created: List[str] = []
+    with get_engine().begin() as conn:
+        if not is_partitioned(conn):
+            return created
+        this_month = _month_start(date.today())
+        for i in range(ahead + 1):
+            name = _create_partition(conn, _add_months(this_month, i))
+            if name:
+                created.append(name)
+    return created
+
+
+def convert_events_table(conn) -> List[str]:
+    """Migración de events plana a particionada (en la transacción del llamador)."""
+    applied: List[str] = []
+    if is_partitioned(conn):
+        return applied
+
+    conn.execute(text("ALTER TABLE events RENAME TO events_legacy"))
+    conn.execute(text("ALTER TABLE events_legacy RENAME CONSTRAINT events_pkey TO events_legacy_pkey"))
+    conn.execute(text("ALTER INDEX IF EXISTS idx_events_case RENAME TO idx_events_legacy_case"))
+    applied.append("events_legacy_renamed")
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE events (
+              id UUID NOT NULL DEFAULT gen_random_uuid(),
+              case_id UUID REFERENCES cases(id) ON DELETE CASCADE,
+              type TEXT NOT NULL,
+              payload JSONB,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+            """
+        )
+    )
+    # "Últimos N eventos del caso" y "último evento de tipo X" sin ordenar en memoria
+    conn.execute(text("CREATE INDEX idx_events_case_created ON events(case_id, created_at DESC)"))
+    conn.execute(text("CREATE INDEX idx_events_type_created ON events(type, created_at DESC)"))
+    conn.execute(text("CREATE TABLE events_default PARTITION OF events DEFAULT"))
+    applied.append("events_partitioned")
+
+    first = conn.execute(text("SELECT MIN(created_at)::date FROM events_legacy")).scalar()
+    month = _month_start(first or date.today())
+    last = _add_months(_month_start(date.today()), PARTITIONS_AHEAD)
+    while month <= last:
+        _create_partition(conn, month)
+        month = _add_months(month, 1)
+    applied.append("events_monthly_partitions")
+
+    conn.execute(
+        text(
+            "INSERT INTO events (id, case_id, type, payload, created_at) "
+            "SELECT id, case_id, type, payload, created_at FROM events_legacy"
+        )
+    )
+    conn.execute(text("DROP TABLE events_legacy"))
+    applied.append("events_legacy_copied")
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS events_archive (
+              partition_name TEXT PRIMARY KEY,
+              range_start DATE NOT NULL,
+              range_end DATE NOT NULL,
+              b2_bucket TEXT NOT NULL,
+              b2_key TEXT NOT NULL,
+              row_count BIGINT NOT NULL,
+              size_bytes BIGINT NOT NULL,
+              sha256 TEXT NOT NULL,
+              archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+    )
+    applied.append("events_archive_table")
+    return applied
+
+
+# =========================================================
+# ARCHIVO
+# =========================================================
+def _export_partition(conn, name: str, fileobj) -> int:
+    """Vuelca la partición como JSONL gzip en fileobj, por lotes de EXPORT_BATCH_ROWS."""
+    rows = 0
+    result = conn.execution_options(stream_results=True).execute(
+        text(f"SELECT id, case_id, type, payload, created_at FROM {name} ORDER BY created_at")
+    )
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", mtime=0) as gz:
+        while True:
+            batch = result.fetchmany(EXPORT_BATCH_ROWS)
+            if not batch:
+                break
+            for r in batch:
+                line = {
+                    "id": str(r[0]),
+                    "case_id": str(r[1]) if r[1] else None,
+                    "type": r[2],
+                    "payload": r[3],
+                    "created_at": r[4].isoformat() if r[4] else None,
+                }
+                gz.write((json.dumps(line, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                rows += 1
+    return rows
+
+
+def archive_old_partitions(retention_months: Optional[int] = None, dry_run: bool = False) -> List[Dict[str, Any]]:
+    from b2_storage import get_b2_bucket, get_s3_client
+
+    keep = RETENTION_MONTHS if retention_months is None else retention_months
+    cutoff = _add_months(_month_start(date.today()), -keep)
+    out: List[Dict[str, Any]] = []
+
+    for part in partition_sizes():
+        if part["name"] == "events_default" or not part.get("range_end"):
+            continue
+        range_end = date.fromisoformat(part["range_end"])
+        if range_end > cutoff:
+            continue
+        if dry_run:
+            out.append({"partition": part["name"], "would_archive": True})
+            continue
+
+        name = part["name"]
+        key = f"{ARCHIVE_PREFIX}/{name}.jsonl.gz"
+        bucket = get_b2_bucket()
+        with tempfile.TemporaryFile() as tmp, get_engine().begin() as conn:
+            rows = _export_partition(conn, name, tmp)
+            size = tmp.tell()
+            tmp.seek(0)
+            sha256 = hashlib.sha256()
+            for chunk in iter(lambda: tmp.read(1024 * 1024), b""):
+                sha256.update(chunk)
+            tmp.seek(0)
+            get_s3_client().upload_fileobj(tmp, bucket, key, ExtraArgs={"ContentType": "application/gzip"})
+
+            conn.execute(
+                text(
+                    """
+                    INSERT INTO events_archive (partition_name, range_start, range_end, b2_bucket, b2_key, row_count, size_bytes, sha256)
+                    VALUES (:name, :start, :end, :bucket, :key, :rows, :size, :sha)
+                    ON CONFLICT (partition_name) DO UPDATE SET
+                        b2_key = EXCLUDED.b2_key, row_count = EXCLUDED.row_count,
+                        size_bytes = EXCLUDED.size_bytes, sha256 = EXCLUDED.sha256, archived_at = NOW()
+                    """
+                ),
+                {
+                    "name": name,
+                    "start": part["range_start"],
+                    "end": part["range_end"],
+                    "bucket": bucket,
+                    "key": key,
+                    "rows": rows,
+                    "size": size,
+                    "sha": sha256.hexdigest(),
+                },
+            )
+            conn.execute(text(f"ALTER TABLE events DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        out.append({"partition": name, "rows": rows, "size_bytes": size, "bucket": bucket, "key": key})
+    return out
+
+
+# =========================================================
+# INFORME
+# =========================================================
+def partition_sizes() -> List[Dict[str, Any]]:
+    with get_engine().connect() as conn:
+        if not is_partitioned(conn):
+            return []
+        rows = conn.execute(
+            text(
+                """
+                SELECT c.relname,
+                       pg_get_expr(c.relpartbound, c.oid),
+                       pg_total_relation_size(c.oid),
+                       GREATEST(c.reltuples, 0)::bigint
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'events'::regclass
+                ORDER BY c.relname
+                """
+            )
+        ).fetchall()
+    out = []
+    for name, bound, size, est_rows in rows:
+        item: Dict[str, Any] = {"name": name, "bound": bound, "size_bytes": int(size or 0), "estimated_rows": int(est_rows or 0)}
+        if name.startswith("events_") and name != "events_default":
+            y, m = int(name[7:11]), int(name[12:14])
+            item["range_start"] = date(y, m, 1).isoformat()
+            item["range_end"] = _add_months(date(y, m, 1), 1).isoformat()
+        out.append(item)
+    return out
+
+
+def storage_report() -> Dict[str, Any]:
+    with get_engine().connect() as conn:
+        partitioned = is_partitioned(conn)
+        total = conn.execute(
+            text(
+                """
+                SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0)
+                FROM pg_class c
+                WHERE c.oid = 'events'::regclass
+                   OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'events'::regclass)
+                """
+            )
+        ).scalar()
+        archives = []
+        if conn.execute(text("SELECT to_regclass('events_archive')")).scalar():
+            archives = [
+                {
+                    "partition": r[0],
+                    "key": r[1],
+                    "row_count": int(r[2]),
+                    "size_bytes": int(r[3]),
+                    "archived_at": r[4],
+                }
+                for r in conn.execute(
+                    text(
+                        "SELECT partition_name, b2_key, row_count, size_bytes, archived_at "
+                        "FROM events_archive ORDER BY range_start"
+                    )
+                ).fetchall()
+            ]
+    return {
+        "partitioned": partitioned,
+        "total_bytes": int(total or 0),
+        "retention_months": RETENTION_MONTHS,
+        "partitions_ahead": PARTITIONS_AHEAD,
+        "partitions": partition_sizes(),
+        "archives": archives,
+    }
+
+
+# =========================================================
+# ADMIN
+# =========================================================
+router = APIRouter(prefix="/admin/events", tags=["admin-events"])
+
+
+def _require_admin_token(x_admin_token: Optional[str]) -> None:
+    expected = (os.getenv("ADMIN_TOKEN") or "").strip()
+    if not expected:
+        raise HTTPException(status_code=500, detail="ADMIN_TOKEN no está configurado en el backend.")
+    if not x_admin_token or x_admin_token.strip() != expected:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@router.get("/partitions")
+def events_partitions(x_admin_token: Optional[str] = Header(default=None, alias="x-admin-token")):
+    """Tamaño total de events, por partición y archivos exportados a B2."""
+    _require_admin_token(x_admin_token)
+    return {"ok": True, **storage_report()}
+
+
+@router.post("/maintenance")
+def events_maintenance(
+    x_admin_token: Optional[str] = Header(default=None, alias="x-admin-token"),
+    archive: bool = Query(True),
+    dry_run: bool = Query(False),
+):
+    """Crea particiones futuras y archiva/elimina las que superan la retención (cron diario)."""
+    _require_admin_token(x_admin_token)
+    created = ensure_partitions()
+    archived = archive_old_partitions(dry_run=dry_run) if archive else []
+    return {"ok": True, "created": created, "archived": archived}
@@ -3,7 +3,7 @@ import os
 from fastapi import APIRouter, HTTPException, Query
 from sqlalchemy import text
 
-from b2_storage import get_s3_client
+from b2_storage import presign_get_url
 from database import get_engine
 
 router = APIRouter(prefix="/files", tags=["files"])
@@ -48,13 +48,8 @@ def presign(
             if kind.startswith("generated_") and payment_status != "paid":
                 raise HTTPException(status_code=402, detail="Pago requerido para descargar el recurso.")
 
-        # 3) Generar URL firmada
-        s3 = get_s3_client()
-        url = s3.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": bucket, "Key": key},
-            ExpiresIn=int(expires),
-        )
+        # 3) Generar URL firmada (cliente S3 compartido, firma local)
+        url = presign_get_url(bucket, key, expires_seconds=int(expires))
         return {"ok": True, "url": url}
 
     except HTTPException:
@@ -33,7 +33,9 @@ from ai.infractions.velocidad import (
 from b2_storage import upload_bytes
 from docx_builder import build_docx
 from pdf_builder import build_pdf
+from cpu_pool import run_cpu
 from ai.infractions.dispatch import dispatch_deterministic_template
+from profiling import profiled
 
 router = APIRouter(tags=["generate"])
 
@@ -2900,6 +2902,7 @@ EMAIL: {g("email")}
 
     return header.strip() + "\n\n" + body.strip()
 
+@profiled("generate.generate_dgt_for_case")
 def generate_dgt_for_case(conn, case_id: str, interesado: Optional[Dict[str, str]] = None, forced_tipo: Optional[str] = None) -> Dict[str, Any]:
     row = conn.execute(
         text("SELECT extracted_json FROM extractions WHERE case_id=:case_id ORDER BY created_at DESC LIMIT 1"),
@@ -2986,7 +2989,7 @@ def generate_dgt_for_case(conn, case_id: str, interesado: Optional[Dict[str, str
 
     tpl["cuerpo"] = build_v2_dgt_layout(tpl["cuerpo"], core, interesado or {})
 
-    docx_bytes = build_docx("", tpl["cuerpo"])
+    docx_bytes = run_cpu(build_docx, "", tpl["cuerpo"])
     b2_bucket, b2_key_docx = upload_bytes(
         case_id,
         "generated",
@@ -2995,7 +2998,7 @@ def generate_dgt_for_case(conn, case_id: str, interesado: Optional[Dict[str, str
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
     )
 
-    pdf_bytes = build_pdf("", tpl["cuerpo"])
+    pdf_bytes = run_cpu(build_pdf, "", tpl["cuerpo"])
     _, b2_key_pdf = upload_bytes(case_id, "generated", pdf_bytes, ".pdf", "application/pdf")
 
     conn.execute(
@@ -0,0 +1,69 @@
+# http_cache.py — GET condicional (ETag / If-None-Match -> 304) para endpoints que se sondean
+#
+# El ETag sale de una "versión" barata del recurso (updated_at, nº de filas, último id...)
+# que se consulta antes de montar la respuesta completa: si el cliente ya la tiene,
+# se responde 304 sin cuerpo y sin la consulta pesada.
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import text
+
+
+def make_etag(*parts: Any) -> str:
+    """ETag débil a partir de las piezas de versión (str() de cada una)."""
+    raw = "|".join("" if p is None else str(p) for p in parts)
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag.strip().removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        if candidate.strip().removeprefix("W/") == wanted:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 si el cliente ya tiene esta versión; None si hay que responder entera."""
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    # El navegador puede guardar la respuesta pero debe revalidar siempre
+    response.headers["Cache-Control"] = "no-cache"
+
+
+def case_version(conn, case_id: str, with_ai: bool = False) -> Optional[str]:
+    """
+    ETag de un expediente: cases.updated_at + id de la última extracción
+    (+ fecha del último ai_expediente_result si with_ai). None si no existe.
+    Solo lecturas de índice: (extractions.case_id, created_at) y (events.case_id, created_at).
+    """
+    ai_sql = (
+        ", (SELECT MAX(ev.created_at) FROM events ev WHERE ev.case_id = c.id AND ev.type = 'ai_expediente_result')"
+        if with_ai
+        else ""
+    )
+    row = conn.execute(
+        text(
+            f"""
+            SELECT c.updated_at,
+                   (SELECT x.id FROM extractions x WHERE x.case_id = c.id ORDER BY x.created_at DESC LIMIT 1)
+                   {ai_sql}
+            FROM cases c
+            WHERE c.id = :id
+            """
+        ),
+        {"id": case_id},
+    ).fetchone()
+    if not row:
+        return None
+    return make_etag("case", case_id, *row)
@@ -0,0 +1,220 @@
+# image_preprocess.py
+# Preparación de imágenes antes de la llamada de visión (OCR con OpenAI).
+#
+# - PDF: se rasterizan localmente solo las páginas con pinta de boletín/denuncia.
+# - Fotos: rotación EXIF, recorte de márgenes uniformes y reescalado al tamaño que
+#   realmente usa el modelo; se re-codifican a JPEG.
+# - Resultado cacheado por sha256 del original (LRU en memoria del proceso).
+#
+# Pillow y pypdfium2 son opcionales: si no están instalados se envía el original.
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+Image = ImageChops = ImageOps = None
+pdfium = None
+_libs_loaded = False
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+# El modelo reescala internamente a 2048 px de lado largo (detail=high): mandar más
+# resolución solo cuesta subida y latencia. El lado corto se limita para que el OCR
+# siga leyendo la letra pequeña del boletín.
+MAX_LONG_SIDE = _env_int("VISION_MAX_LONG_SIDE", 2048)
+MAX_SHORT_SIDE = _env_int("VISION_MAX_SHORT_SIDE", 1536)
+JPEG_QUALITY = _env_int("VISION_JPEG_QUALITY", 82)
+MAX_PDF_PAGES = _env_int("VISION_MAX_PDF_PAGES", 2)
+PDF_RENDER_DPI = _env_int("VISION_PDF_DPI", 150)
+CACHE_MAX_ENTRIES = _env_int("VISION_PREPROCESS_CACHE", 64)
+
+# Señales de la página del boletín / notificación de denuncia
+_BOLETIN_SIGNALS = [
+    "boletin",
+    "boletín",
+    "denuncia",
+    "hecho denunciado",
+    "hecho imputado",
+    "matricula",
+    "matrícula",
+    "expediente",
+    "importe",
+    "precepto",
+    "infraccion",
+    "infracción",
+    "km/h",
+    "notificacion",
+    "notificación",
+]
+
+Page = Tuple[str, bytes]
+
+_cache: "OrderedDict[str, List[Page]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _load_libs() -> None:
+    """Importa Pillow / pypdfium2 en el primer uso (no al arrancar el proceso)."""
+    global Image, ImageChops, ImageOps, pdfium, _libs_loaded
+    if _libs_loaded:
+        return
+    try:
+        from PIL import Image as _Image, ImageChops as _ImageChops, ImageOps as _ImageOps
+
+        Image, ImageChops, ImageOps = _Image, _ImageChops, _ImageOps
+    except ImportError:
+        pass
+    try:
+        import pypdfium2 as _pdfium
+
+        pdfium = _pdfium
+    except ImportError:
+        pass
+    _libs_loaded = True
+
+
+def _cache_get(key: str) -> Optional[List[Page]]:
+    with _cache_lock:
+        pages = _cache.get(key)
+        if pages is not None:
+            _cache.move_to_end(key)
+        return pages
+
+
+def _cache_put(key: str, pages: List[Page]) -> None:
+    with _cache_lock:
+        _cache[key] = pages
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+# =========================================================
+# IMAGEN
+# =========================================================
+def _autocrop(img):
+    """Recorta márgenes de color uniforme (mesa, fondo del escáner)."""
+    gray = img.convert("L")
+    corner = gray.getpixel((0, 0))
+    bg = Image.new("L", gray.size, corner)
+    diff = ImageChops.difference(gray, bg).point(lambda p: 255 if p > 24 else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    # Solo recortar si se gana algo y el contenido no queda ridículo
+    if (right - left) * (bottom - top) < 0.25 * img.width * img.height:
+        return img
+    pad = 12
+    return img.crop((max(left - pad, 0), max(top - pad, 0), min(right + pad, img.width), min(bottom + pad, img.height)))
+
+
+def _downscale(img):
+    long_side, short_side = max(img.size), min(img.size)
+    scale = min(1.0, MAX_LONG_SIDE / float(long_side), MAX_SHORT_SIDE / float(short_side))
+    if scale >= 1.0:
+        return img
+    return img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+
+
+def _encode_jpeg(img) -> bytes:
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def _prepare_image(img) -> Page:
+    img = ImageOps.exif_transpose(img)
+    img = _autocrop(img)
+    img = _downscale(img)
+    return "image/jpeg", _encode_jpeg(img)
+
+
+# =========================================================
+# PDF
+# =========================================================
+def _pick_pdf_pages(content: bytes) -> List[int]:
+    """Índices de las páginas con más señales de boletín (o las primeras si no hay texto)."""
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        texts = [(p.extract_text() or "").lower() for p in reader.pages]
+    except Exception:
+        return list(range(MAX_PDF_PAGES))
+
+    scored = [(sum(1 for s in _BOLETIN_SIGNALS if s in t), i) for i, t in enumerate(texts)]
+    hits = [i for score, i in sorted(scored, key=lambda x: (-x[0], x[1])) if score > 0]
+    if not hits:
+        # PDF escaneado sin capa de texto: el boletín suele ir al principio
+        return list(range(min(MAX_PDF_PAGES, len(texts) or MAX_PDF_PAGES)))
+    return sorted(hits[:MAX_PDF_PAGES])
+
+
+def _rasterize_pdf(content: bytes) -> List[Page]:
+    pdf = pdfium.PdfDocument(content)
+    try:
+        pages: List[Page] = []
+        for idx in _pick_pdf_pages(content):
+            if idx >= len(pdf):
+                continue
+            bitmap = pdf[idx].render(scale=PDF_RENDER_DPI / 72.0)
+            pages.append(_prepare_image(bitmap.to_pil()))
+        return pages
+    finally:
+        pdf.close()
+
+
+# =========================================================
+# API
+# =========================================================
+def prepare_vision_images(content: bytes, mime: str) -> List[Page]:
+    """
+    Devuelve la lista de imágenes (mime, bytes) a enviar al modelo de visión.
+    Si no se puede preprocesar, devuelve el original tal cual.
+    """
+    original: List[Page] = [(mime, content)]
+    _load_libs()
+    if Image is None:
+        return original
+
+    is_pdf = mime == "application/pdf"
+    if is_pdf and pdfium is None:
+        return original
+    if not is_pdf and not mime.startswith("image/"):
+        return original
+
+    key = hashlib.sha256(content).hexdigest()
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        if is_pdf:
+            pages = _rasterize_pdf(content)
+        else:
+            with Image.open(io.BytesIO(content)) as img:
+                img.load()
+                pages = [_prepare_image(img)]
+    except Exception:
+        return original
+
+    if not pages:
+        return original
+
+    # Si por lo que sea el original ya era más pequeño, no empeorarlo
+    if not is_pdf and len(pages[0][1]) >= len(content):
+        pages = original
+
+    _cache_put(key, pages)
+    return pages
@@ -0,0 +1,168 @@
+# llm_breaker.py
+# Presupuestos de latencia + circuit breaker para las llamadas LLM de extracción.
+#
+# Cada breaker guarda las últimas latencias y fallos de su llamada (texto / visión).
+# Se abre cuando el p95 supera el umbral o hay demasiados fallos seguidos; mientras
+# está abierto /analyze usa la extracción determinista y marca el caso para
+# enriquecimiento LLM posterior. Tras el cooldown deja pasar una llamada de prueba.
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+class LLMUnavailable(RuntimeError):
+    """El LLM no ha respondido dentro del presupuesto o el breaker está abierto."""
+
+    def __init__(self, reason: str, detail: str = "") -> None:
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        budget_seconds: float,
+        p95_threshold_seconds: float,
+        window: int = 40,
+        min_samples: int = 8,
+        max_consecutive_failures: int = 3,
+        cooldown_seconds: float = 120.0,
+    ) -> None:
+        self.name = name
+        self.budget_seconds = budget_seconds
+        self.p95_threshold_seconds = p95_threshold_seconds
+        self.min_samples = min_samples
+        self.max_consecutive_failures = max_consecutive_failures
+        self.cooldown_seconds = cooldown_seconds
+
+        self._latencies: deque = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._open_reason = ""
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    # ---------- estado ----------
+    def _p95_locked(self) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+    def _open_locked(self, reason: str) -> None:
+        self._opened_at = time.monotonic()
+        self._open_reason = reason
+        self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        """True mientras dura el cooldown (no consume la llamada de prueba)."""
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown_seconds
+
+    def allow(self) -> bool:
+        """True si se puede llamar al LLM (cerrado, o half-open con hueco para la prueba)."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                return False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record(self, latency_seconds: float, ok: bool) -> None:
+        with self._lock:
+            # Un fallo cuenta como latencia de presupuesto agotado para el p95
+            self._latencies.append(latency_seconds if ok else max(latency_seconds, self.budget_seconds))
+
+            if ok:
+                self._consecutive_failures = 0
+            else:
+                self._consecutive_failures += 1
+
+            half_open = self._opened_at is not None
+            if half_open:
+                if ok:
+                    # Prueba superada: se cierra y se olvida la ventana degradada
+                    self._opened_at = None
+                    self._open_reason = ""
+                    self._probe_in_flight = False
+                    self._latencies.clear()
+                    self._latencies.append(latency_seconds)
+                else:
+                    self._open_locked("probe_failed")
+                return
+
+            if self._consecutive_failures >= self.max_consecutive_failures:
+                self._open_locked("consecutive_failures")
+                return
+
+            p95 = self._p95_locked()
+            if p95 is not None and p95 > self.p95_threshold_seconds:
+                self._open_locked("p95_over_threshold")
+
+    def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Ejecuta fn respetando el breaker. fn debe aplicar su propio timeout HTTP
+        (budget_seconds). Cualquier fallo se convierte en LLMUnavailable.
+        """
+        if not self.allow():
+            raise LLMUnavailable("circuit_open", self.name)
+
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record(time.monotonic() - started, ok=False)
+            raise LLMUnavailable("llm_error", f"{type(e).__name__}: {e}") from e
+
+        elapsed = time.monotonic() - started
+        self.record(elapsed, ok=True)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            p95 = self._p95_locked()
+            return {
+                "name": self.name,
+                "state": "closed" if self._opened_at is None else "open",
+                "open_reason": self._open_reason or None,
+                "p95_seconds": round(p95, 3) if p95 is not None else None,
+                "p95_threshold_seconds": self.p95_threshold_seconds,
+                "budget_seconds": self.budget_seconds,
+                "samples": len(self._latencies),
+                "consecutive_failures": self._consecutive_failures,
+            }
+
+
+TEXT_BREAKER = CircuitBreaker(
+    "openai_text",
+    budget_seconds=_env_float("LLM_TEXT_BUDGET_SECONDS", 20.0),
+    p95_threshold_seconds=_env_float("LLM_TEXT_P95_SECONDS", 12.0),
+    cooldown_seconds=_env_float("LLM_BREAKER_COOLDOWN_SECONDS", 120.0),
+)
+
+VISION_BREAKER = CircuitBreaker(
+    "openai_vision",
+    budget_seconds=_env_float("LLM_VISION_BUDGET_SECONDS", 45.0),
+    p95_threshold_seconds=_env_float("LLM_VISION_P95_SECONDS", 35.0),
+    cooldown_seconds=_env_float("LLM_BREAKER_COOLDOWN_SECONDS", 120.0),
+)
+
+
+def breakers_snapshot() -> Dict[str, Any]:
+    return {b.name: b.snapshot() for b in (TEXT_BREAKER, VISION_BREAKER)}
@@ -0,0 +1,101 @@
+# llm_client.py — cliente OpenAI compartido + llamadas JSON por stage
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ai.prompts.assembly import build_messages, get_prompt, record_usage, usage_from_response
+from openai_limiter import estimate_tokens, openai_slot, retry_after_seconds
+from telemetry import span
+
+MAX_RATE_LIMIT_RETRIES = 3
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Cliente OpenAI único por proceso (se crea al primer uso, no al importar)."""
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+
+            _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _client
+
+
+def _remaining(deadline: Optional[float], timeout: Optional[float]) -> Optional[float]:
+    """Lo que queda del presupuesto (None sin presupuesto); agotado, TimeoutError."""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError(f"Presupuesto LLM agotado ({timeout:.0f}s)")
+    return left
+
+
+def chat_json(
+    stage: str,
+    dynamic: Any,
+    model: Optional[str] = None,
+    usage_out: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Llamada Chat Completions en modo JSON con el prompt registrado del stage.
+    Si se pasa usage_out, se rellena con tokens, tokens cacheados y versión del prompt.
+    Con timeout se limita todo (espera en cola del limitador, reintentos por 429 y cada
+    llamada) a ese presupuesto y el SDK no reintenta: un reintento se comería el
+    presupuesto. Sin timeout se mantienen los reintentos del SDK (5xx, conexión,
+    timeouts); el limitador común (openai_limiter) reintenta además los 429 que lleguen.
+    """
+    model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    client = get_openai_client()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    from openai import RateLimitError
+
+    with span("llm", stage) as sp:
+        messages = build_messages(stage, dynamic)
+        est = estimate_tokens(*(m["content"] for m in messages))
+        attempt = 0
+        while True:
+            # Tras un 429 el propio limitador mantiene la pausa antes de dar el siguiente turno
+            with openai_slot(model, est, max_wait=_remaining(deadline, timeout)) as slot:
+                call_client = client
+                if deadline is not None:
+                    call_client = client.with_options(timeout=_remaining(deadline, timeout), max_retries=0)
+                try:
+                    raw = call_client.chat.completions.with_raw_response.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0.0,
+                        response_format={"type": "json_object"},
+                    )
+                except RateLimitError as e:
+                    headers = getattr(getattr(e, "response", None), "headers", None)
+                    slot.throttled(headers, retry_after_seconds(headers))
+                    attempt += 1
+                    if attempt > MAX_RATE_LIMIT_RETRIES:
+                        raise
+                else:
+                    resp = raw.parse()
+                    total = getattr(getattr(resp, "usage", None), "total_tokens", None)
+                    slot.success(raw.headers, total)
+                    break
+
+        usage = usage_from_response(getattr(resp, "usage", None))
+        sp.llm_usage(model, usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
+        record_usage(stage, usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
+
+    if usage_out is not None:
+        usage_out.update(usage)
+        usage_out["model"] = model
+        usage_out["prompt_version"] = get_prompt(stage)["version"]
+        usage_out["cost_usd"] = round(sp.cost_usd, 6)
+
+    return json.loads(resp.choices[0].message.content)
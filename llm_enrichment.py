@@ -0,0 +1,144 @@
+# llm_enrichment.py
+# Reproceso con LLM de los casos analizados en modo determinista.
+#
+# /analyze marca el caso con un evento llm_enrichment_pending cuando el LLM no estaba
+# disponible. enrich_pending() (cron vía POST /ops/automation/llm-enrichment/tick)
+# los encola en work_scheduler y enrich_case() vuelve a extraer el documento original
+# cuando los breakers están cerrados y guarda una nueva fila en extractions. No toca los datos del interesado ya sincronizados.
+import json
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from analyze import _extract_document
+from b2_storage import download_bytes
+from database import get_engine
+from event_log import append_event
+from llm_breaker import TEXT_BREAKER, VISION_BREAKER, LLMUnavailable
+from work_scheduler import RetryLater, enqueue_work, run_due
+
+
+def _pending_case_ids(conn, limit: int) -> List[str]:
+    # Un caso por fila aunque tenga varios avisos; los que agotaron reintentos
+    # (work_failed) no se vuelven a encolar hasta que /analyze los marque de nuevo,
+    # salvo que fallaran por LLM caído (fallos antiguos: ahora se reprograma sin gastar intento).
+    rows = conn.execute(
+        text(
+            """
+            SELECT p.case_id
+            FROM events p
+            WHERE p.type = 'llm_enrichment_pending'
+              AND NOT EXISTS (
+                  SELECT 1 FROM events d
+                  WHERE d.case_id = p.case_id
+                    AND d.created_at >= p.created_at
+                    AND (d.type = 'llm_enrichment_done'
+                         OR (d.type = 'work_failed'
+                             AND d.payload->>'kind' = 'llm_enrichment'
+                             AND COALESCE(d.payload->>'error', '') NOT LIKE 'LLMUnavailable%'))
+              )
+            GROUP BY p.case_id
+            ORDER BY MIN(p.created_at) ASC
+            LIMIT :limit
+            """
+        ),
+        {"limit": limit},
+    ).fetchall()
+    return [str(r[0]) for r in rows]
+
+
+def _load_original(conn, case_id: str):
+    return conn.execute(
+        text(
+            """
+            SELECT b2_bucket, b2_key, mime
+            FROM documents
+            WHERE case_id = :case_id AND kind = 'original'
+            ORDER BY created_at DESC
+            LIMIT 1
+            """
+        ),
+        {"case_id": case_id},
+    ).fetchone()
+
+
+def _load_wrapper(conn, case_id: str) -> Dict[str, Any]:
+    row = conn.execute(
+        text(
+            """
+            SELECT extracted_json
+            FROM extractions
+            WHERE case_id = :case_id
+            ORDER BY created_at DESC
+            LIMIT 1
+            """
+        ),
+        {"case_id": case_id},
+    ).fetchone()
+    wrapper = row[0] if row else {}
+    return wrapper if isinstance(wrapper, dict) else {}
+
+
+def _retry_delay() -> float:
+    return max(TEXT_BREAKER.cooldown_seconds, VISION_BREAKER.cooldown_seconds)
+
+
+def enrich_case(case_id: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Reextrae con LLM un caso pendiente. Handler del planificador (kind='llm_enrichment')."""
+    if TEXT_BREAKER.is_open() and VISION_BREAKER.is_open():
+        # LLM caído: se reprograma para después del cooldown sin gastar intento
+        raise RetryLater("circuit_open", _retry_delay())
+
+    engine = get_engine()
+    with engine.connect() as conn:
+        doc = _load_original(conn, case_id)
+        wrapper = _load_wrapper(conn, case_id)
+    if not doc:
+        with engine.begin() as conn:
+            append_event(conn, case_id, "llm_enrichment_done", {"ok": False, "reason": "sin_documento_original"})
+        return {"case_id": case_id, "status": "no_document"}
+
+    bucket, key, mime = doc[0], doc[1], doc[2] or wrapper.get("mime") or "application/octet-stream"
+    content = download_bytes(bucket, key)
+    try:
+        extracted, _text, model_used, confidence = _extract_document(content, mime, wrapper.get("filename"))
+    except LLMUnavailable as e:
+        raise RetryLater(e.reason, _retry_delay())
+
+    if extracted.get("llm_enrichment_pending"):
+        raise RetryLater(",".join(extracted.get("llm_degraded_reasons") or []) or "degraded", _retry_delay())
+
+    new_wrapper = dict(wrapper)
+    new_wrapper["extracted"] = extracted
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO extractions (case_id, extracted_json, confidence, model, created_at) "
+                "VALUES (:case_id, CAST(:json AS JSONB), :confidence, :model, NOW())"
+            ),
+            {
+                "case_id": case_id,
+                "json": json.dumps(new_wrapper, ensure_ascii=False),
+                "confidence": confidence,
+                "model": model_used,
+            },
+        )
+        append_event(
+            conn,
+            case_id,
+            "llm_enrichment_done",
+            {"ok": True, "model": model_used, "confidence": confidence, "tipo_infraccion": extracted.get("tipo_infraccion")},
+        )
+    return {"case_id": case_id, "status": "enriched", "model": model_used}
+
+
+def enrich_pending(limit: int = 10) -> Dict[str, Any]:
+    """Encola los casos pendientes y procesa un lote por prioridad (work_scheduler)."""
+    engine = get_engine()
+    with engine.begin() as conn:
+        for case_id in _pending_case_ids(conn, 500):
+            enqueue_work(conn, case_id, "llm_enrichment")
+
+    out = run_due(limit=limit, kinds=["llm_enrichment"])
+    out["enriched"] = sum(1 for r in out["results"] if r["ok"] and (r.get("result") or {}).get("status") == "enriched")
+    return out
@@ -0,0 +1,378 @@
+# openai_limiter.py
+# Limitador común para todo el tráfico a OpenAI (chat + visión).
+#
+# Por modelo:
+# - concurrencia máxima adaptativa (AIMD: baja a la mitad con un 429, sube de uno en uno
+#   tras llamadas correctas),
+# - token bucket de tokens/minuto y peticiones/minuto,
+# - cola con prioridad: lo pagado (post-pago Stripe) antes que operador, y operador antes
+#   que el análisis anónimo,
+# - ajuste con las cabeceras x-ratelimit-* que devuelve OpenAI.
+#
+# Opcional (OPENAI_LIMITER_PG=true): presupuesto de tokens/minuto compartido entre
+# workers en la tabla openai_rate_usage (POST /admin/migrate/openai_rate_usage).
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_PAID = 0
+PRIORITY_OPERATOR = 1
+PRIORITY_ANONYMOUS = 2
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("openai_priority", default=PRIORITY_ANONYMOUS)
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(_env(name) or default)
+    except ValueError:
+        return default
+
+
+class OpenAIBusy(RuntimeError):
+    """No hay capacidad hacia OpenAI dentro del tiempo máximo de espera."""
+
+    def __init__(self, model: str, retry_after: float) -> None:
+        super().__init__(f"OpenAI saturado ({model}); reintentar en {int(retry_after)}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+@contextmanager
+def openai_priority(priority: int) -> Iterator[None]:
+    """Fija la prioridad de las llamadas OpenAI hechas dentro del bloque (mismo hilo)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(*texts: str, images: int = 0, max_output: int = 1000) -> int:
+    """Estimación barata: ~4 caracteres por token + coste fijo por imagen + salida."""
+    chars = sum(len(t or "") for t in texts)
+    return chars // 4 + images * 1100 + max_output
+
+
+def _parse_reset(value: Optional[str]) -> Optional[float]:
+    """'6m0s', '1.5s', '250ms' → segundos."""
+    if not value:
+        return None
+    total = 0.0
+    num = ""
+    i = 0
+    v = value.strip()
+    try:
+        while i < len(v):
+            c = v[i]
+            if c.isdigit() or c == ".":
+                num += c
+                i += 1
+                continue
+            if v.startswith("ms", i):
+                total += float(num) / 1000.0
+                i += 2
+            elif c == "h":
+                total += float(num) * 3600
+                i += 1
+            elif c == "m":
+                total += float(num) * 60
+                i += 1
+            elif c == "s":
+                total += float(num)
+                i += 1
+            else:
+                return None
+            num = ""
+        if num:
+            total += float(num)
+    except ValueError:
+        return None
+    return total
+
+
+# =========================================================
+# LIMITADOR POR MODELO
+# =========================================================
+class _TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelLimiter:
+    def __init__(self, model: str, *, max_concurrency: int, tpm: float, rpm: float) -> None:
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.tokens = _TokenBucket(tpm)
+        self.requests = _TokenBucket(rpm)
+        self.paused_until = 0.0
+        self._ok_streak = 0
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"calls": 0, "throttled": 0, "busy": 0, "waited_seconds": 0.0}
+
+    # ---------- reserva ----------
+    def _wait_needed(self, est_tokens: int, now: float) -> float:
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= self.concurrency:
+            return 0.25
+        return max(self.tokens.wait_time(est_tokens, now), self.requests.wait_time(1, now))
+
+    def acquire(self, est_tokens: int, priority: int, max_wait: float) -> None:
+        entry = (priority, next(self._seq))
+        started = time.monotonic()
+        deadline = started + max_wait
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_needed(est_tokens, now) if self._queue[0] == entry else 0.25
+                    if self._queue[0] == entry and wait <= 0:
+                        heapq.heappop(self._queue)
+                        self.in_flight += 1
+                        self.tokens.take(est_tokens)
+                        self.requests.take(1)
+                        self.stats["calls"] += 1
+                        self.stats["waited_seconds"] += now - started
+                        self._cond.notify_all()
+                        return
+                    if now >= deadline:
+                        self.stats["busy"] += 1
+                        raise OpenAIBusy(self.model, max(wait, 1.0))
+                    self._cond.wait(timeout=min(wait, deadline - now, 1.0))
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+                raise
+
+    def release(self, est_tokens: int, used_tokens: Optional[int]) -> None:
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if used_tokens is not None and used_tokens < est_tokens:
+                self.tokens.refund(est_tokens - used_tokens)
+            self._cond.notify_all()
+
+    # ---------- adaptación ----------
+    def on_success(self, headers: Optional[Mapping[str, str]]) -> None:
+        with self._cond:
+            self._ok_streak += 1
+            if self._ok_streak >= 10 and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._ok_streak = 0
+            self._apply_headers(headers)
+            self._cond.notify_all()
+
+    def on_throttled(self, headers: Optional[Mapping[str, str]], retry_after: Optional[float]) -> float:
+        """Registra un 429 y devuelve cuántos segundos esperar antes de reintentar."""
+        with self._cond:
+            self.stats["throttled"] += 1
+            self._ok_streak = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            self._apply_headers(headers)
+            delay = retry_after or _parse_reset((headers or {}).get("x-ratelimit-reset-tokens")) or 2.0
+            delay = min(max(delay, 0.5), 60.0)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._cond.notify_all()
+            return delay
+
+    def _apply_headers(self, headers: Optional[Mapping[str, str]]) -> None:
+        if not headers:
+            return
+        try:
+            limit_tokens = headers.get("x-ratelimit-limit-tokens")
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            if limit_tokens:
+                # Nunca por encima de lo que diga OpenAI para la cuenta
+                self.tokens.capacity = min(self.tokens.capacity, float(limit_tokens))
+            if remaining_tokens is not None:
+                self.tokens.tokens = min(self.tokens.tokens, float(remaining_tokens))
+            if remaining_requests is not None:
+                self.requests.tokens = min(self.requests.tokens, float(remaining_requests))
+        except (TypeError, ValueError):
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "model": self.model,
+                "concurrency": self.concurrency,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "tokens_available": int(self.tokens.tokens),
+                "tpm": int(self.tokens.capacity),
+                "paused_for": max(0.0, round(self.paused_until - time.monotonic(), 2)),
+                **{k: (round(v, 2) if isinstance(v, float) else v) for k, v in self.stats.items()},
+            }
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _model_env(model: str, suffix: str, default: float) -> float:
+    key = model.upper().replace("-", "_").replace(".", "_")
+    return _env_float(f"OPENAI_{key}_{suffix}", _env_float(f"OPENAI_{suffix}", default))
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    lim = _limiters.get(model)
+    if lim is not None:
+        return lim
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = ModelLimiter(
+                model,
+                max_concurrency=int(_model_env(model, "MAX_CONCURRENCY", 8)),
+                tpm=_model_env(model, "TPM", 200000),
+                rpm=_model_env(model, "RPM", 500),
+            )
+        return _limiters[model]
+
+
+def limiter_stats() -> Dict[str, Any]:
+    return {m: lim.snapshot() for m, lim in list(_limiters.items())}
+
+
+# =========================================================
+# COORDINACIÓN ENTRE WORKERS (Postgres, opcional)
+# =========================================================
+def _pg_enabled() -> bool:
+    return _env("OPENAI_LIMITER_PG", "false").lower() in ("1", "true", "yes")
+
+
+def _pg_reserve(model: str, est_tokens: int, max_wait: float) -> None:
+    """Suma los tokens al minuto actual del modelo; si se pasa del TPM global espera al siguiente."""
+    from database import get_engine
+
+    global_tpm = _model_env(model, "GLOBAL_TPM", _model_env(model, "TPM", 200000))
+    deadline = time.monotonic() + max_wait
+    while True:
+        with get_engine().begin() as conn:
+            used = conn.execute(
+                text(
+                    """
+                    INSERT INTO openai_rate_usage(model, minute, tokens)
+                    VALUES (:model, date_trunc('minute', NOW()), :tokens)
+                    ON CONFLICT (model, minute) DO UPDATE
+                    SET tokens = openai_rate_usage.tokens + EXCLUDED.tokens
+                    RETURNING tokens
+                    """
+                ),
+                {"model": model, "tokens": est_tokens},
+            ).scalar()
+            if used is None or used <= global_tpm:
+                return
+            # Sin hueco: deshacer la reserva y esperar al siguiente minuto
+            conn.execute(
+                text(
+                    "UPDATE openai_rate_usage SET tokens = tokens - :tokens "
+                    "WHERE model = :model AND minute = date_trunc('minute', NOW())"
+                ),
+                {"model": model, "tokens": est_tokens},
+            )
+        wait = 60.0 - (time.time() % 60.0) + 0.05
+        if time.monotonic() + wait > deadline:
+            raise OpenAIBusy(model, wait)
+        time.sleep(wait)
+
+
+# =========================================================
+# API
+# =========================================================
+class Slot:
+    """Reserva en curso; el llamador informa del resultado con success()/throttled()."""
+
+    def __init__(self, limiter: ModelLimiter, est_tokens: int) -> None:
+        self.limiter = limiter
+        self.est_tokens = est_tokens
+        self.used_tokens: Optional[int] = None
+
+    def success(self, headers: Optional[Mapping[str, str]] = None, used_tokens: Optional[int] = None) -> None:
+        self.used_tokens = used_tokens
+        self.limiter.on_success(headers)
+
+    def throttled(self, headers: Optional[Mapping[str, str]] = None, retry_after: Optional[float] = None) -> float:
+        return self.limiter.on_throttled(headers, retry_after)
+
+
+@contextmanager
+def openai_slot(model: str, est_tokens: int, max_wait: Optional[float] = None) -> Iterator[Slot]:
+    """
+    Espera turno (por prioridad) para una llamada a `model` y la libera al salir.
+    Lanza OpenAIBusy si no hay capacidad en max_wait segundos.
+    """
+    limiter = get_limiter(model)
+    if max_wait is None:
+        max_wait = _env_float("OPENAI_LIMITER_MAX_WAIT_SECONDS", 60.0)
+    limiter.acquire(est_tokens, _priority.get(), max_wait)
+    slot = Slot(limiter, est_tokens)
+    try:
+        if _pg_enabled():
+            try:
+                _pg_reserve(model, est_tokens, max_wait)
+            except OpenAIBusy:
+                raise
+            except Exception as e:
+                # Sin tabla o sin BD: seguimos solo con el límite local
+                logger.warning("openai_limiter: coordinación Postgres no disponible: %s", e)
+        yield slot
+    finally:
+        limiter.release(est_tokens, slot.used_tokens)
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    if not headers:
+        return None
+    raw = headers.get("retry-after-ms")
+    if raw:
+        try:
+            return float(raw) / 1000.0
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    try:
+        return float(raw) if raw else None
+    except ValueError:
+        return None
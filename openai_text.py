@@ -1,11 +1,11 @@
 import json
-import os
 import re
 from typing import Any, Dict, Optional
 
-from openai import OpenAI
+from ai.prompts.assembly import register_prompt
+from llm_client import chat_json
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+STAGE_EXTRACT_TEXT = "extract_text"
 
 
 SYSTEM_PROMPT = """
@@ -44,8 +44,12 @@ Ejemplos inválidos:
 - "CLASIFICACIÓN: GRAVE IMPORTE 200 € PUNTOS 4"
 - "HECHO: ... APARATO 513 VALOR DE LA PRUEBA ..."
 - "CIRCULAR SIN HACER USO DE GUANTE"
+
+Analiza el documento de denuncia administrativa que se envía a continuación y extrae los campos solicitados.
 """
 
+register_prompt(STAGE_EXTRACT_TEXT, SYSTEM_PROMPT)
+
 _ADMIN_TOKENS = [
     "tipificacion",
     "tipificación",
@@ -190,28 +194,11 @@ def _postprocess_data(data: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
-def extract_from_text(text: str) -> Dict[str, Any]:
-    prompt = f"""
-Analiza el siguiente documento de denuncia administrativa y extrae los campos solicitados.
-
-Documento:
-
-{text}
-"""
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-        response_format={"type": "json_object"},
-    )
-
+def extract_from_text(text: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    # Instrucciones estáticas en el system (prefijo cacheable); el mensaje user es solo el documento
     try:
-        data = json.loads(response.choices[0].message.content)
-    except Exception:
+        data = chat_json(STAGE_EXTRACT_TEXT, f"Documento:\n\n{text}", model="gpt-4o-mini", timeout=timeout)
+    except json.JSONDecodeError:
         data = {}
 
     return _postprocess_data(data)
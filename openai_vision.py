@@ -1,10 +1,50 @@
 import base64
 import json
 import os
+import time
 from typing import Any, Dict, Optional
 
 import requests
 
+from image_preprocess import prepare_vision_images
+from openai_limiter import estimate_tokens, openai_slot, retry_after_seconds
+from telemetry import span
+from ai.prompts.assembly import record_usage, register_prompt, usage_from_response
+
+STAGE_VISION = "vision_extract"
+MAX_RATE_LIMIT_RETRIES = 3
+
+# Texto estático (idéntico en cada llamada para aprovechar el prompt caching);
+# la imagen va siempre al final del input.
+SYSTEM_TEXT = (
+    "Eres un asistente experto en sanciones administrativas en España. "
+    "Analizas imágenes de multas y extraes datos clave para preparar recursos administrativos. "
+    "Devuelve siempre JSON válido."
+)
+
+USER_TEXT = (
+    "Analiza la imagen de la sanción administrativa y devuelve EXCLUSIVAMENTE "
+    "un objeto JSON válido con estas claves EXACTAS (incluye también 'vision_raw_text'):\n\n"
+    "{\n"
+    '  "organismo": string|null,\n'
+    '  "expediente_ref": string|null,\n'
+    '  "importe": number|null,\n'
+    '  "fecha_notificacion": string|null,\n'
+    '  "fecha_documento": string|null,\n'
+    '  "tipo_sancion": string|null,\n'
+    '  "pone_fin_via_administrativa": boolean|null,\n'
+    '  "plazo_recurso_sugerido": string|null,\n'
+    '  "observaciones": string,\n'
+    '  "vision_raw_text": string\n'
+    "}\n\n"
+    "Reglas:\n"
+    "- Si algún dato no se ve con claridad, usa null y explica el motivo en observaciones.\n"
+    "- vision_raw_text debe ser una transcripción OCR lo más literal posible del documento (máx. ~4000 caracteres).\n"
+    "- NO inventes texto que no se vea. Si hay zonas ilegibles, usa '[ILEGIBLE]'.\n"
+)
+
+register_prompt(STAGE_VISION, SYSTEM_TEXT + "\n\n" + USER_TEXT)
+
 
 def _env(name: str) -> str:
     v = (os.getenv(name) or "").strip()
@@ -22,74 +62,72 @@ def extract_from_image_bytes(
     content: bytes,
     mime: str,
     filename: Optional[str] = None,
+    timeout: float = 90,
 ) -> Dict[str, Any]:
     """
     Extracción desde IMAGEN usando OpenAI Responses API (visión).
 
     Devuelve un JSON estructurado + un OCR textual completo en 'vision_raw_text',
     para que el motor pueda extraer velocidades (123/90) incluso en PDFs escaneados.
+    timeout es el presupuesto total: espera en el limitador, reintentos por 429 y la
+    propia petición. Agotado, se lanza requests.Timeout.
     """
     api_key = _env("OPENAI_API_KEY")
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
 
-    data_url = _b64_data_url(mime, content)
-
-    system_text = (
-        "Eres un asistente experto en sanciones administrativas en España. "
-        "Analizas imágenes de multas y extraes datos clave para preparar recursos administrativos. "
-        "Devuelve siempre JSON válido."
-    )
-
-    user_text = (
-        "Analiza la imagen de la sanción administrativa y devuelve EXCLUSIVAMENTE "
-        "un objeto JSON válido con estas claves EXACTAS (incluye también 'vision_raw_text'):\n\n"
-        "{\n"
-        '  "organismo": string|null,\n'
-        '  "expediente_ref": string|null,\n'
-        '  "importe": number|null,\n'
-        '  "fecha_notificacion": string|null,\n'
-        '  "fecha_documento": string|null,\n'
-        '  "tipo_sancion": string|null,\n'
-        '  "pone_fin_via_administrativa": boolean|null,\n'
-        '  "plazo_recurso_sugerido": string|null,\n'
-        '  "observaciones": string,\n'
-        '  "vision_raw_text": string\n'
-        "}\n\n"
-        "Reglas:\n"
-        "- Si algún dato no se ve con claridad, usa null y explica el motivo en observaciones.\n"
-        "- vision_raw_text debe ser una transcripción OCR lo más literal posible del documento (máx. ~4000 caracteres).\n"
-        "- NO inventes texto que no se vea. Si hay zonas ilegibles, usa '[ILEGIBLE]'.\n"
-    )
+    # Páginas rasterizadas / fotos reescaladas (cacheadas por sha256)
+    images = prepare_vision_images(content, mime)
 
     payload = {
         "model": model,
         "input": [
             {
                 "role": "system",
-                "content": [{"type": "input_text", "text": system_text}],
+                "content": [{"type": "input_text", "text": SYSTEM_TEXT}],
             },
             {
                 "role": "user",
-                "content": [
-                    {"type": "input_text", "text": user_text},
-                    {"type": "input_image", "image_url": data_url},
-                ],
+                "content": [{"type": "input_text", "text": USER_TEXT}]
+                + [{"type": "input_image", "image_url": _b64_data_url(m, b)} for m, b in images],
             },
         ],
         "text": {"format": {"type": "json_object"}},
     }
 
-    r = requests.post(
-        "https://api.openai.com/v1/responses",
-        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-        json=payload,
-        timeout=90,
-    )
-
-    if not r.ok:
-        raise RuntimeError(f"OpenAI error {r.status_code}: {r.text[:500]}")
-
-    data = r.json()
+    est = estimate_tokens(SYSTEM_TEXT, USER_TEXT, images=len(images), max_output=1500)
+    with span("llm", STAGE_VISION) as sp:
+        sp.bytes = sum(len(b) for _m, b in images)
+        attempt = 0
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout(f"Presupuesto de visión agotado ({timeout:.0f}s)")
+            with openai_slot(model, est, max_wait=remaining) as slot:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise requests.Timeout(f"Presupuesto de visión agotado ({timeout:.0f}s)")
+                r = requests.post(
+                    "https://api.openai.com/v1/responses",
+                    headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+                    json=payload,
+                    timeout=remaining,
+                )
+                if r.status_code == 429 and attempt < MAX_RATE_LIMIT_RETRIES:
+                    slot.throttled(r.headers, retry_after_seconds(r.headers))
+                    attempt += 1
+                    continue
+                data = r.json() if r.ok else {}
+                if r.ok:
+                    slot.success(r.headers, (data.get("usage") or {}).get("total_tokens"))
+                break
+
+        if not r.ok:
+            raise RuntimeError(f"OpenAI error {r.status_code}: {r.text[:500]}")
+
+        usage = usage_from_response(data.get("usage"))
+        sp.llm_usage(model, usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
+        record_usage(STAGE_VISION, usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
 
     output_text = ""
     for item in data.get("output", []):
@@ -4,12 +4,13 @@ import os
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional, List
 
-from fastapi import APIRouter, HTTPException, Header, UploadFile, File, Form, Query
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Header, UploadFile, File, Form, Query, Request
 from sqlalchemy import text
 
 from database import get_engine
-from b2_storage import upload_bytes
+from event_log import append_event
+from b2_storage import upload_bytes, presign_get_url
+from b2_streaming import b2_download_response
 
 router = APIRouter(prefix="/ops", tags=["ops"])
 
@@ -28,20 +29,6 @@ def _require_operator(x_operator_token: Optional[str]):
         raise HTTPException(status_code=401, detail="Unauthorized operator")
 
 
-# =========================================================
-# B2 download helper (NO rompe aunque b2_storage no tenga download_bytes)
-# =========================================================
-def _download_bytes(bucket: str, key: str) -> bytes:
-    import b2_storage
-
-    for fn_name in ("download_bytes", "get_bytes", "b2_download_bytes", "download_file_bytes"):
-        fn = getattr(b2_storage, fn_name, None)
-        if callable(fn):
-            return fn(bucket, key)
-    raise HTTPException(status_code=500, detail="No existe función de descarga en b2_storage (download_bytes/get_bytes/...)")
-
-
-
 @router.post("/login")
 def ops_login(pin: str = Form(...)) -> Dict[str, Any]:
     expected = (os.getenv("OPERATOR_PIN") or "").strip()
@@ -133,7 +120,13 @@ def queue(
 def list_documents(
     case_id: str,
     x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+    presign: bool = Query(False),
+    expires: int = Query(900, ge=60, le=3600),
 ) -> Dict[str, Any]:
+    """
+    Documentos del caso. Con presign=true incluye una URL firmada por documento
+    (la firma es local con el cliente S3 compartido, no hay llamada a B2).
+    """
     _require_operator(x_operator_token)
 
     engine = get_engine()
@@ -164,6 +157,14 @@ def list_documents(
             }
         )
 
+    if presign:
+        for item in items:
+            try:
+                filename = (item["key"] or "documento").split("/")[-1] or "documento"
+                item["url"] = presign_get_url(item["bucket"], item["key"], expires_seconds=expires, filename=filename)
+            except Exception:
+                item["url"] = None
+
     return {"ok": True, "case_id": case_id, "documents": items}
 
 
@@ -171,8 +172,15 @@ def list_documents(
 @router.get("/documents/{doc_id}/download")
 def download_document(
     doc_id: str,
+    request: Request,
     x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+    mode: str = Query("redirect", pattern="^(redirect|stream)$"),
 ):
+    """
+    Descarga de documento para operador.
+    mode=redirect (por defecto) devuelve URL firmada; mode=stream hace
+    stream por trozos con Range/ETag sin cargar el fichero en memoria.
+    """
     _require_operator(x_operator_token)
 
     engine = get_engine()
@@ -186,14 +194,9 @@ def download_document(
         raise HTTPException(status_code=404, detail="Documento no encontrado")
 
     bucket, key, mime = row
-    data = _download_bytes(bucket, key)
     filename = (key or "documento").split("/")[-1] or "documento"
 
-    return StreamingResponse(
-        iter([data]),
-        media_type=(mime or "application/octet-stream"),
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-    )
+    return b2_download_response(request, bucket, key, filename=filename, mime=mime, mode=mode)
 
 
 @router.get("/cases/{case_id}/events")
@@ -247,19 +250,7 @@ def _case_exists(conn, case_id: str) -> str:
 
 
 def _append_event(conn, case_id: str, event_type: str, payload: Optional[Dict[str, Any]] = None):
-    conn.execute(
-        text(
-            """
-            INSERT INTO events(case_id, type, payload, created_at)
-            VALUES (:case_id, :type, CAST(:payload AS JSONB), NOW())
-            """
-        ),
-        {
-            "case_id": case_id,
-            "type": event_type,
-            "payload": json.dumps(payload or {}, ensure_ascii=False),
-        },
-    )
+    append_event(conn, case_id, event_type, payload)
 
 
 def _clean_kind(kind: str) -> str:
@@ -1,27 +1,23 @@
 # ops_automation.py — automatización “sin humanos” (tick/worker)
-import json
 import os
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, Optional
 
 from fastapi import HTTPException
 from sqlalchemy import text
 
 from database import get_engine
+from event_log import append_event
 from b2_storage import download_bytes
 from dgt_client import submit_pdf, DGTNotConfigured
+from email_outbox import send_pending
+from work_scheduler import enqueue_work, run_due
 
 # Reutilizamos el generador existente
 from generate import GenerateRequest, generate_dgt
 
 
 def _event(conn, case_id: str, typ: str, payload: Dict[str, Any]) -> None:
-    conn.execute(
-        text(
-            "INSERT INTO events(case_id, type, payload, created_at) "
-            "VALUES (:c,:t,CAST(:p AS JSONB),NOW())"
-        ),
-        {"c": case_id, "t": typ, "p": json.dumps(payload)},
-    )
+    append_event(conn, case_id, typ, payload)
 
 
 def _latest_generated_pdf(conn, case_id: str) -> Optional[Dict[str, Any]]:
@@ -202,41 +198,45 @@ def submit_case_fully_automatic(case_id: str) -> Dict[str, Any]:
         return {"ok": True, "case_id": case_id, "status": "submitted", "registro": registro, "csv": csv}
 
 
+def run_submit_job(case_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler del planificador (work_scheduler, kind='submit')."""
+    return submit_case_fully_automatic(case_id)
+
+
 def tick(limit: int = 25) -> Dict[str, Any]:
-    """Procesa en lote casos listos para presentar.
+    """Encola los casos listos para presentar, procesa un lote de work_queue (todos los
+    tipos) por prioridad de plazo y envía un lote de email_outbox.
     Diseñado para ser llamado por un cron cada 2-5 minutos.
     """
     engine = get_engine()
-    picked: List[str] = []
 
     with engine.begin() as conn:
         rows = conn.execute(
             text(
                 """
-                SELECT id FROM cases
-                WHERE status='ready_to_submit'
-                  AND payment_status='paid'
-                  AND authorized=TRUE
-                  AND COALESCE(test_mode,FALSE)=FALSE
-                ORDER BY created_at ASC
-                LIMIT :limit
+                SELECT c.id FROM cases c
+                WHERE c.status='ready_to_submit'
+                  AND c.payment_status='paid'
+                  AND c.authorized=TRUE
+                  AND COALESCE(c.test_mode,FALSE)=FALSE
+                  AND NOT EXISTS (
+                      SELECT 1 FROM work_queue w
+                      WHERE w.case_id = c.id AND w.kind = 'submit' AND w.status IN ('queued', 'running')
+                  )
+                LIMIT 500
                 """
-            ),
-            {"limit": limit},
+            )
         ).fetchall()
-        picked = [str(r[0]) for r in rows]
-
-    ok = 0
-    failed = 0
-    results = []
-
-    for cid in picked:
-        try:
-            res = submit_case_fully_automatic(cid)
-            ok += 1
-            results.append({"case_id": cid, "ok": True, "result": res})
-        except Exception as e:
-            failed += 1
-            results.append({"case_id": cid, "ok": False, "error": str(e)})
-
-    return {"ok": True, "picked": len(picked), "processed": ok, "failed": failed, "results": results}
+        for r in rows:
+            enqueue_work(conn, str(r[0]), "submit")
+
+    # Todos los tipos (submit, post_payment, llm_enrichment, analysis): sin worker en el
+    # proceso este tick es lo único que ejecuta la cola y recoge los reintentos
+    result = run_due(limit=limit)
+
+    # El cron también vacía email_outbox: sin worker en el proceso nadie más lo haría
+    try:
+        result["email_outbox"] = send_pending(limit=50)
+    except Exception as e:
+        result["email_outbox"] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    return result
@@ -4,6 +4,10 @@ from typing import Optional
 from fastapi import APIRouter, Header, HTTPException, Query
 
 from ops_automation import tick  # tu archivo actual con tick()
+from email_outbox import send_pending
+from llm_breaker import breakers_snapshot
+from openai_limiter import limiter_stats
+from work_scheduler import queue_stats, run_due
 
 router = APIRouter(prefix="/ops/automation", tags=["ops-automation"])
 
@@ -24,3 +28,63 @@ def automation_tick(
 ):
     _require_operator(x_operator_token)
     return tick(limit=limit)
+
+
+@router.post("/email-outbox/tick")
+def email_outbox_tick(
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Envía un lote de email_outbox (para cron si no hay worker en el proceso)."""
+    _require_operator(x_operator_token)
+    return send_pending(limit=limit)
+
+
+@router.post("/llm-enrichment/tick")
+def llm_enrichment_tick(
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Reprocesa con LLM los casos analizados en modo determinista."""
+    _require_operator(x_operator_token)
+    from llm_enrichment import enrich_pending
+
+    return enrich_pending(limit=limit)
+
+
+@router.get("/llm-breakers")
+def llm_breakers(
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+):
+    """Estado de los circuit breakers del LLM (p95, fallos, abierto/cerrado)."""
+    _require_operator(x_operator_token)
+    return {"ok": True, "breakers": breakers_snapshot()}
+
+
+@router.get("/openai-limiter")
+def openai_limiter_stats(
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+):
+    """Concurrencia, cola y tokens disponibles por modelo en este proceso."""
+    _require_operator(x_operator_token)
+    return {"ok": True, "models": limiter_stats()}
+
+
+@router.post("/scheduler/tick")
+def scheduler_tick(
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+    limit: int = Query(10, ge=1, le=100),
+    kind: Optional[str] = Query(default=None, description="post_payment | submit | llm_enrichment | analysis"),
+):
+    """Ejecuta un lote de work_queue por prioridad (plazo, estado, espera)."""
+    _require_operator(x_operator_token)
+    return run_due(limit=limit, kinds=[kind] if kind else None)
+
+
+@router.get("/scheduler")
+def scheduler_stats(
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+):
+    """Trabajos por tipo, estado y clase de prioridad, con límites de concurrencia."""
+    _require_operator(x_operator_token)
+    return {"ok": True, **queue_stats()}
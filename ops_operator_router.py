@@ -3,7 +3,7 @@ import json
 import os
 from typing import Optional, Any, Dict
 
-from fastapi import APIRouter, Header, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy import text
 
@@ -12,6 +12,9 @@ from generate import GenerateRequest, generate_dgt
 from b2_storage import upload_bytes
 from docx_builder import build_docx
 from pdf_builder import build_pdf
+from cpu_pool import run_cpu
+from ai_runs import load_ai_run
+from http_cache import case_version, not_modified, set_etag
 
 router = APIRouter(prefix="/ops/cases", tags=["ops-operator"])
 
@@ -400,8 +403,8 @@ def finalize_resource(
         created_by = (body.created_by or "operator").strip() or "operator"
 
         txt_bytes = content.encode("utf-8")
-        docx_bytes = build_docx("", content)
-        pdf_bytes = build_pdf("", content)
+        docx_bytes = run_cpu(build_docx, "", content)
+        pdf_bytes = run_cpu(build_pdf, "", content)
 
         b2_bucket, b2_key_txt = upload_bytes(
             case_id,
@@ -550,11 +553,21 @@ def send_complete_case_file(
 @router.get("/{case_id}")
 def get_case_detail(
     case_id: str,
+    request: Request,
+    response: Response,
     x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
 ):
     require_operator_token(x_operator_token)
     engine = get_engine()
     with engine.begin() as conn:
+        # updated_at (también lo tocan los overrides) + extracción + último resultado IA
+        etag = case_version(conn, case_id, with_ai=True)
+        if etag is None:
+            raise HTTPException(status_code=404, detail="Expediente no encontrado")
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+
         case = _case_or_404(conn, case_id)
 
         evs = conn.execute(
@@ -601,7 +614,7 @@ def get_case_detail(
             or payload.get("detected_facts")
         )
 
-        return {
+        detail = {
             "id": case["id"],
             "status": case["status"],
             "familia_detectada": familia,
@@ -611,6 +624,44 @@ def get_case_detail(
             "updated_at": case["updated_at"],
         }
 
+    set_etag(response, etag)
+    return detail
+
+
+@router.get("/{case_id}/ai-run")
+def get_case_ai_run(
+    case_id: str,
+    part: Optional[str] = Query(default=None, description="classify | timeline | phase | admissibility | attack_plan | draft"),
+    x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
+):
+    """Partes pesadas del último resultado IA (ai_runs), bajo demanda."""
+    require_operator_token(x_operator_token)
+    engine = get_engine()
+    with engine.begin() as conn:
+        _case_or_404(conn, case_id)
+        ev = conn.execute(
+            text(
+                '''
+                SELECT payload->>'ai_run_id', payload->'raw_result'
+                FROM events
+                WHERE case_id = :id AND type = 'ai_expediente_result'
+                ORDER BY created_at DESC
+                LIMIT 1
+                '''
+            ),
+            {"id": case_id},
+        ).fetchone()
+        if not ev or not (ev[0] or isinstance(ev[1], dict)):
+            raise HTTPException(status_code=404, detail="Sin resultado IA para este caso")
+
+        if ev[0]:
+            data = load_ai_run(conn, ev[0], part=part)
+        else:
+            # Evento antiguo con el resultado embebido
+            data = ev[1].get(part) if part else ev[1]
+
+    return {"ok": True, "case_id": case_id, "ai_run_id": ev[0], "part": part, "data": data}
+
 
 @router.get("/{case_id}/ai-overrides")
 def get_ai_overrides(
@@ -126,21 +126,25 @@ def _priority_score(
     if not has_generated_docx:
         score += 8
 
-    if days_to_deadline is not None:
-        if days_to_deadline < 0:
-            score += 40
-        elif days_to_deadline <= 1:
-            score += 35
-        elif days_to_deadline <= 3:
-            score += 25
-        elif days_to_deadline <= 7:
-            score += 15
-        elif days_to_deadline <= 15:
-            score += 8
+    score += _deadline_score(days_to_deadline)
 
     return score
 
 
+# Tramos de urgencia por plazo: (días restantes como máximo, puntos). Vencido = -1.
+# work_scheduler.py traduce esta misma tabla a SQL para ordenar los workers.
+DEADLINE_BONUS = [(-1, 40), (1, 35), (3, 25), (7, 15), (15, 8)]
+
+
+def _deadline_score(days_to_deadline: Optional[int]) -> int:
+    if days_to_deadline is None:
+        return 0
+    for max_days, points in DEADLINE_BONUS:
+        if days_to_deadline <= max_days:
+            return points
+    return 0
+
+
 def _extract_ai_payload(events: List[Dict[str, Any]]) -> Dict[str, Any]:
     ai_events = [e for e in events if e.get("type") == "ai_expediente_result"]
     ai_events.sort(key=lambda e: str(e.get("created_at") or ""), reverse=True)
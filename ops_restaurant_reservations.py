@@ -1,12 +1,18 @@
+import asyncio
+import json
 import os
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Header, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy import text
 
 from database import get_engine
+from http_cache import make_etag, not_modified, set_etag
+from auth_cache import cache_get, cache_put, credential_version, forget, issue_session, key_of, verify_session
 
 router = APIRouter(prefix="/ops", tags=["ops-restaurant-reservations"])
 
@@ -14,11 +20,22 @@ router = APIRouter(prefix="/ops", tags=["ops-restaurant-reservations"])
 # ============================================================
 # Seguridad: PIN por restaurante (tabla restaurants)
 # ============================================================
-def _need_pin(restaurant_id: str, x_reservas_pin: Optional[str]) -> str:
-    rid = (restaurant_id or "").strip() or "rest_001"
-    pin = (x_reservas_pin or "").strip()
-    if not pin:
-        raise HTTPException(status_code=401, detail="PIN requerido.")
+# El PIN (bcrypt en Postgres) se comprueba una vez: POST /ops/restaurants/session
+# devuelve una sesión firmada (x-reservas-session) que se valida sin BD ni crypt().
+# El PIN directo (x-reservas-pin) sigue valiendo y sus aciertos se cachean (auth_cache).
+# Cambiar el PIN invalida sesiones y caché (versión = hash del pin_hash).
+def _session_ttl_seconds() -> int:
+    try:
+        return max(60, int(float((os.getenv("RESTAURANT_SESSION_TTL_HOURS") or "12").strip()) * 3600))
+    except ValueError:
+        return 12 * 3600
+
+
+def _restaurant_version(rid: str) -> Optional[str]:
+    """Versión del PIN del restaurante activo (caché TTL); None si no existe o inactivo."""
+    ver = cache_get("restaurant", rid)
+    if ver is not None:
+        return ver
 
     engine = get_engine()
     with engine.begin() as conn:
@@ -26,21 +43,52 @@ def _need_pin(restaurant_id: str, x_reservas_pin: Optional[str]) -> str:
             text("SELECT pin_hash FROM restaurants WHERE id = :rid AND active = true"),
             {"rid": rid},
         ).fetchone()
-
     if not row:
+        return None
+
+    ver = credential_version(row[0])
+    cache_put("restaurant", rid, rid, ver)
+    return ver
+
+
+def _need_pin(
+    restaurant_id: str,
+    x_reservas_pin: Optional[str],
+    x_reservas_session: Optional[str] = None,
+) -> str:
+    rid = (restaurant_id or "").strip() or "rest_001"
+    session = (x_reservas_session or "").strip()
+    pin = (x_reservas_pin or "").strip()
+    if not session and not pin:
+        raise HTTPException(status_code=401, detail="PIN requerido.")
+
+    ver = _restaurant_version(rid)
+    if ver is None:
         raise HTTPException(status_code=401, detail="Restaurante no válido o inactivo.")
 
-    pin_hash = row[0]
+    if session:
+        claims = verify_session(session, "restaurant")
+        if not claims or claims.get("sub") != rid or claims.get("ver") != ver:
+            raise HTTPException(status_code=401, detail="Sesión caducada o no válida.")
+        return rid
+
+    pin_key = key_of(f"{rid}:{pin}")
+    if cache_get("restaurant_pin", pin_key) == ver:
+        return rid
 
+    engine = get_engine()
     with engine.begin() as conn:
-        ok = conn.execute(
-            text("SELECT crypt(:pin, :hash) = :hash"),
-            {"pin": pin, "hash": pin_hash},
-        ).scalar()
+        row = conn.execute(
+            text("SELECT pin_hash, crypt(:pin, pin_hash) = pin_hash FROM restaurants WHERE id = :rid AND active = true"),
+            {"pin": pin, "rid": rid},
+        ).fetchone()
 
-    if not ok:
+    if not row:
+        raise HTTPException(status_code=401, detail="Restaurante no válido o inactivo.")
+    if not row[1]:
         raise HTTPException(status_code=401, detail="PIN incorrecto.")
 
+    cache_put("restaurant_pin", pin_key, rid, credential_version(row[0]))
     return rid
 
 
@@ -182,24 +230,53 @@ def change_restaurant_pin(body: ChangePinBody):
             {"pin": new_pin, "rid": rid},
         )
 
+    # Sesiones y PINs cacheados del PIN anterior: fuera ya en este proceso
+    # (en los demás, al caducar la caché de versión)
+    forget("restaurant", rid)
+    forget("restaurant_pin", rid)
+
     return {"ok": True, "restaurant_id": rid}
 
 
+# ============================================================
+# Sesión: PIN una vez -> token firmado para x-reservas-session
+# ============================================================
+class SessionBody(BaseModel):
+    restaurant_id: str
+    pin: str
+
+
+@router.post("/restaurants/session")
+def create_restaurant_session(body: SessionBody):
+    rid = _need_pin(body.restaurant_id, body.pin)
+    ver = _restaurant_version(rid)
+    session = issue_session("restaurant", rid, ver, _session_ttl_seconds())
+    return {"ok": True, "restaurant_id": rid, "session": session["token"], "expires_at": session["expires_at"]}
+
+
 # ============================================================
 # GET: listar reservas
 # ============================================================
-@router.get("/restaurant-reservations")
-def list_reservations(
-    date: str,
-    shift: str,
-    restaurant_id: str,
-    x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
-):
-    rid = _need_pin(restaurant_id, x_reservas_pin)
+def _day_version(conn, rid: str, date: str, shift: Optional[str]) -> Dict[str, Any]:
+    """Versión barata del día/turno (idx_restaurant_reservations_day, solo índice)."""
+    row = conn.execute(
+        text("""
+            SELECT COUNT(*), MAX(updated_at)
+            FROM restaurant_reservations
+            WHERE restaurant_id = :rid
+              AND reservation_date = CAST(:d AS date)
+              AND (CAST(:s AS text) IS NULL OR shift = :s)
+        """),
+        {"rid": rid, "d": date, "s": shift},
+    ).fetchone()
+    return {
+        "count": int(row[0] or 0),
+        "max_updated_at": row[1],
+        "etag": make_etag("reservas", rid, date, shift or "*", row[0], row[1]),
+    }
 
-    engine = get_engine()
-    sql = text("""
-        SELECT
+
+_LIST_COLUMNS = """
           id::text AS id,
           restaurant_id,
           reservation_date::text AS reservation_date,
@@ -218,6 +295,24 @@ def list_reservations(
           updated_at,
           status_changed_at,
           COALESCE(status_changed_by,'') AS status_changed_by
+"""
+
+
+@router.get("/restaurant-reservations")
+def list_reservations(
+    date: str,
+    shift: str,
+    restaurant_id: str,
+    request: Request,
+    response: Response,
+    x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
+):
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
+
+    engine = get_engine()
+    sql = text(f"""
+        SELECT {_LIST_COLUMNS}
         FROM restaurant_reservations
         WHERE restaurant_id = :rid
           AND reservation_date = CAST(:d AS date)
@@ -226,8 +321,14 @@ def list_reservations(
     """)
 
     with engine.begin() as conn:
+        # If-None-Match: si el turno no ha cambiado, 304 sin leer las filas
+        version = _day_version(conn, rid, date, shift)
+        cached = not_modified(request, version["etag"])
+        if cached is not None:
+            return cached
         rows = conn.execute(sql, {"rid": rid, "d": date, "s": shift}).mappings().all()
 
+    set_etag(response, version["etag"])
     return {"items": [dict(r) for r in rows]}
 
 
@@ -239,8 +340,9 @@ def create_reservation(
     body: ReservationCreate,
     restaurant_id: str,
     x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
 ):
-    rid = _need_pin(restaurant_id, x_reservas_pin)
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
 
     now = _now()
     engine = get_engine()
@@ -314,15 +416,16 @@ def update_reservation(
     body: ReservationUpdate,
     restaurant_id: str,
     x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
 ):
-    _need_pin(restaurant_id, x_reservas_pin)
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
 
     patch = body.model_dump(exclude_unset=True)
     if not patch:
         return {"ok": True}
 
     sets = []
-    params = {"id": reservation_id, "now": _now()}
+    params = {"id": reservation_id, "rid": rid, "now": _now()}
 
     for k, v in patch.items():
         if k == "reservation_time":
@@ -347,6 +450,7 @@ def update_reservation(
         UPDATE restaurant_reservations
         SET {", ".join(sets)}
         WHERE id = CAST(:id AS uuid)
+          AND restaurant_id = :rid
         RETURNING id
     """)
 
@@ -363,7 +467,10 @@ def update_reservation(
 # ============================================================
 # Acciones de estado
 # ============================================================
-def _set_status(res_id: str, status: str, by: str):
+STATUS_VALUES = ("pendiente", "llego", "no_show", "cancelada")
+
+
+def _set_status(rid: str, res_id: str, status: str, by: str):
     now = _now()
     engine = get_engine()
 
@@ -374,11 +481,12 @@ def _set_status(res_id: str, status: str, by: str):
             status_changed_by = :by,
             updated_at = :now
         WHERE id = CAST(:id AS uuid)
+          AND restaurant_id = :rid
         RETURNING id::text
     """)
 
     with engine.begin() as conn:
-        out = conn.execute(sql, {"id": res_id, "status": status, "now": now, "by": by}).scalar_one_or_none()
+        out = conn.execute(sql, {"id": res_id, "rid": rid, "status": status, "now": now, "by": by}).scalar_one_or_none()
 
     if not out:
         raise HTTPException(status_code=404, detail="Reserva no encontrada.")
@@ -390,10 +498,11 @@ def mark_arrived(
     reservation_id: str,
     restaurant_id: str,
     x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
     x_actor: Optional[str] = Header(default=None, alias="x-actor"),
 ):
-    _need_pin(restaurant_id, x_reservas_pin)
-    return _set_status(reservation_id, "llego", (x_actor or "SALA"))
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
+    return _set_status(rid, reservation_id, "llego", (x_actor or "SALA"))
 
 
 @router.post("/restaurant-reservations/{reservation_id}/no-show")
@@ -401,10 +510,11 @@ def mark_no_show(
     reservation_id: str,
     restaurant_id: str,
     x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
     x_actor: Optional[str] = Header(default=None, alias="x-actor"),
 ):
-    _need_pin(restaurant_id, x_reservas_pin)
-    return _set_status(reservation_id, "no_show", (x_actor or "SALA"))
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
+    return _set_status(rid, reservation_id, "no_show", (x_actor or "SALA"))
 
 
 @router.post("/restaurant-reservations/{reservation_id}/cancel")
@@ -412,7 +522,189 @@ def mark_cancel(
     reservation_id: str,
     restaurant_id: str,
     x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
     x_actor: Optional[str] = Header(default=None, alias="x-actor"),
 ):
-    _need_pin(restaurant_id, x_reservas_pin)
-    return _set_status(reservation_id, "cancelada", (x_actor or "SALA"))
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
+    return _set_status(rid, reservation_id, "cancelada", (x_actor or "SALA"))
+
+
+# ============================================================
+# POST: cambio de estado en bloque (una sentencia)
+# ============================================================
+class BulkStatusItem(BaseModel):
+    id: str
+    status: str
+
+
+class BulkStatusBody(BaseModel):
+    items: List[BulkStatusItem] = Field(..., min_length=1, max_length=200)
+
+
+@router.post("/restaurant-reservations/bulk-status")
+def bulk_status(
+    body: BulkStatusBody,
+    restaurant_id: str,
+    x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
+    x_actor: Optional[str] = Header(default=None, alias="x-actor"),
+):
+    rid = _need_pin(restaurant_id, x_reservas_pin, x_reservas_session)
+
+    wanted: Dict[str, str] = {}
+    for it in body.items:
+        if it.status not in STATUS_VALUES:
+            raise HTTPException(status_code=400, detail=f"Estado no válido: {it.status}")
+        wanted[it.id] = it.status
+
+    values = []
+    params: Dict[str, Any] = {"rid": rid, "now": _now(), "by": (x_actor or "SALA")}
+    for i, (res_id, status) in enumerate(wanted.items()):
+        values.append(f"(CAST(:id{i} AS uuid), :st{i})")
+        params[f"id{i}"] = res_id
+        params[f"st{i}"] = status
+
+    sql = text(f"""
+        UPDATE restaurant_reservations r
+        SET status = v.status,
+            status_changed_at = :now,
+            status_changed_by = :by,
+            updated_at = :now
+        FROM (VALUES {", ".join(values)}) AS v(id, status)
+        WHERE r.id = v.id
+          AND r.restaurant_id = :rid
+        RETURNING r.id::text, r.status
+    """)
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    updated = {r[0]: r[1] for r in rows}
+    return {
+        "ok": True,
+        "updated": [{"id": k, "status": v} for k, v in updated.items()],
+        "not_found": [k for k in wanted if k not in updated],
+    }
+
+
+# ============================================================
+# GET: feed de cambios (SSE) por restaurante/día
+# ============================================================
+# EventSource no envía cabeceras: la sesión firmada puede ir en ?session=.
+# Cada RESERVAS_STREAM_POLL_SECONDS se mira la versión del día (consulta de índice);
+# solo si cambia se leen las filas con updated_at posterior y se emite "changes". Si
+# alguna reserva ya enviada ha salido del día se emite otra vez "snapshot" completo.
+# La conexión se cierra a los RESERVAS_STREAM_MAX_SECONDS y el navegador reconecta.
+def _stream_setting(name: str, default: float) -> float:
+    try:
+        return max(0.5, float((os.getenv(name) or str(default)).strip()))
+    except ValueError:
+        return default
+
+
+def _changes_since(
+    rid: str, date: str, shift: Optional[str], since, known_ids: Optional[set] = None
+) -> Dict[str, Any]:
+    """
+    Filas del día con updated_at > since. Si alguna de known_ids ya no está en el día
+    (cambio de fecha/turno o borrado) no hay fila que enviar: se devuelve el día entero
+    con snapshot=True para que el cliente reemplace su lista.
+    """
+    engine = get_engine()
+    with engine.begin() as conn:
+        version = _day_version(conn, rid, date, shift)
+        rows = []
+        snapshot = since is None
+        if not snapshot and known_ids is not None:
+            if version["count"] < len(known_ids):
+                snapshot = True
+            elif version["max_updated_at"] is not None and version["max_updated_at"] > since:
+                current = {
+                    r[0]
+                    for r in conn.execute(
+                        text("""
+                            SELECT id::text
+                            FROM restaurant_reservations
+                            WHERE restaurant_id = :rid
+                              AND reservation_date = CAST(:d AS date)
+                              AND (CAST(:s AS text) IS NULL OR shift = :s)
+                        """),
+                        {"rid": rid, "d": date, "s": shift},
+                    ).fetchall()
+                }
+                snapshot = not known_ids <= current
+        if snapshot or (version["max_updated_at"] is not None and version["max_updated_at"] > since):
+            # since es el MAX(updated_at) leído de la propia tabla: mismo tipo que la columna
+            since_sql = "" if snapshot else "AND updated_at > :since"
+            rows = conn.execute(
+                text(f"""
+                    SELECT {_LIST_COLUMNS}
+                    FROM restaurant_reservations
+                    WHERE restaurant_id = :rid
+                      AND reservation_date = CAST(:d AS date)
+                      AND (CAST(:s AS text) IS NULL OR shift = :s)
+                      {since_sql}
+                    ORDER BY updated_at ASC
+                """),
+                {"rid": rid, "d": date, "s": shift, "since": since},
+            ).mappings().all()
+    return {"version": version, "snapshot": snapshot, "items": [dict(r) for r in rows]}
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+
+@router.get("/restaurant-reservations/stream")
+async def stream_reservations(
+    request: Request,
+    date: str,
+    restaurant_id: str,
+    shift: Optional[str] = None,
+    session: Optional[str] = None,
+    x_reservas_pin: Optional[str] = Header(default=None, alias="x-reservas-pin"),
+    x_reservas_session: Optional[str] = Header(default=None, alias="x-reservas-session"),
+):
+    rid = await asyncio.to_thread(_need_pin, restaurant_id, x_reservas_pin, x_reservas_session or session)
+
+    poll = _stream_setting("RESERVAS_STREAM_POLL_SECONDS", 2.0)
+    heartbeat = _stream_setting("RESERVAS_STREAM_HEARTBEAT_SECONDS", 15.0)
+    max_seconds = _stream_setting("RESERVAS_STREAM_MAX_SECONDS", 300.0)
+
+    async def _events():
+        started = last_sent = time.monotonic()
+        # Primer evento: el día completo; después, solo lo que cambie
+        snap = await asyncio.to_thread(_changes_since, rid, date, shift, None)
+        etag = snap["version"]["etag"]
+        since = snap["version"]["max_updated_at"]
+        ids = {it["id"] for it in snap["items"]}
+        yield "retry: 3000\n\n"
+        yield _sse("snapshot", {"items": snap["items"]}, etag)
+
+        while time.monotonic() - started < max_seconds:
+            await asyncio.sleep(poll)
+            if await request.is_disconnected():
+                return
+            out = await asyncio.to_thread(_changes_since, rid, date, shift, since, ids)
+            if out["version"]["etag"] != etag:
+                etag = out["version"]["etag"]
+                since = out["version"]["max_updated_at"] or since
+                if out["snapshot"]:
+                    # Alguna reserva ha salido del día: lista completa en vez de cambios
+                    ids = {it["id"] for it in out["items"]}
+                    yield _sse("snapshot", {"items": out["items"]}, etag)
+                else:
+                    ids |= {it["id"] for it in out["items"]}
+                    yield _sse("changes", {"items": out["items"]}, etag)
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ": ping\n\n"
+                last_sent = time.monotonic()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
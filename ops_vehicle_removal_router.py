@@ -2,15 +2,22 @@
 # OPS PRO para la línea "Eliminar coche" de RecurreTuMulta.
 # Módulo separado para no tocar el flujo principal de multas.
 
-import json
+import base64
 import os
-from typing import Any, Dict, Optional
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
 from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel
 from sqlalchemy import text
 
 from database import get_engine
+from event_log import append_event
+from vehicle_removal_state import (
+    get_vehicle_removal_state,
+    record_vehicle_removal_event,
+    replay_vehicle_removal_events,
+)
 
 router = APIRouter(prefix="/ops/vehicle-removal", tags=["ops-vehicle-removal"])
 
@@ -30,19 +37,7 @@ def _require_operator(x_operator_token: Optional[str]):
 
 
 def _append_event(conn, case_id: str, event_type: str, payload: Optional[Dict[str, Any]] = None):
-    conn.execute(
-        text(
-            """
-            INSERT INTO events(case_id, type, payload, created_at)
-            VALUES (:case_id, :type, CAST(:payload AS JSONB), NOW())
-            """
-        ),
-        {
-            "case_id": case_id,
-            "type": event_type,
-            "payload": json.dumps(payload or {}, ensure_ascii=False),
-        },
-    )
+    append_event(conn, case_id, event_type, payload)
 
 
 def _case_or_404(conn, case_id: str):
@@ -71,31 +66,25 @@ def _case_or_404(conn, case_id: str):
 
 
 def _latest_vehicle_payload(conn, case_id: str) -> Dict[str, Any]:
-    row = conn.execute(
-        text(
-            """
-            SELECT payload
-            FROM events
-            WHERE case_id = :case_id
-              AND type IN (
-                'vehicle_removal_request_created',
-                'vehicle_removal_request',
-                'vehicle_removal_paid',
-                'vehicle_removal_assigned',
-                'vehicle_removal_completed'
-              )
-            ORDER BY created_at ASC
-            """
-        ),
-        {"case_id": case_id},
-    ).fetchall()
+    state = get_vehicle_removal_state(conn, case_id)
+    if state is not None:
+        return state
+    # Caso anterior a vehicle_removal_requests: reconstruir desde events
+    return replay_vehicle_removal_events(conn, case_id)
 
-    merged: Dict[str, Any] = {}
-    for r in row:
-        payload = r[0] if isinstance(r[0], dict) else {}
-        merged.update(payload)
 
-    return merged
+def _encode_cursor(updated_at, case_id: str) -> str:
+    raw = f"{updated_at.isoformat()}|{case_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        ts, case_id = raw.split("|", 1)
+        return datetime.fromisoformat(ts), case_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor no válido")
 
 
 class AssignBody(BaseModel):
@@ -119,7 +108,13 @@ def list_vehicle_removals(
     x_operator_token: Optional[str] = Header(default=None, alias="X-Operator-Token"),
     status: str = "all",
     limit: int = 200,
+    cursor: Optional[str] = None,
 ):
+    """
+    Listado OPS desde vehicle_removal_requests (una consulta indexada).
+    Paginación keyset por (updated_at, case_id): pasar next_cursor como cursor.
+    summary cuenta todas las solicitudes por estado (no solo la página).
+    """
     _require_operator(x_operator_token)
 
     allowed_statuses = {
@@ -135,73 +130,91 @@ def list_vehicle_removals(
 
     limit = max(1, min(int(limit or 200), 500))
 
-    engine = get_engine()
-    items = []
+    where = ["TRUE"]
+    params: Dict[str, Any] = {"limit": limit + 1}
+    if status != "all":
+        where.append("vr.status = :status")
+        params["status"] = status
+    if cursor:
+        cur_ts, cur_id = _decode_cursor(cursor)
+        where.append("(vr.updated_at, vr.case_id) < (:cur_ts, CAST(:cur_id AS UUID))")
+        params["cur_ts"] = cur_ts
+        params["cur_id"] = cur_id
 
+    engine = get_engine()
     with engine.begin() as conn:
-        if status == "all":
-            rows = conn.execute(
-                text(
-                    """
-                    SELECT id, status, payment_status, contact_email, created_at, updated_at
-                    FROM cases
-                    WHERE category = 'vehicle_removal'
-                       OR status LIKE 'vehicle_removal%'
-                    ORDER BY updated_at DESC
-                    LIMIT :limit
-                    """
-                ),
-                {"limit": limit},
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                text(
-                    """
-                    SELECT id, status, payment_status, contact_email, created_at, updated_at
-                    FROM cases
-                    WHERE (category = 'vehicle_removal' OR status LIKE 'vehicle_removal%')
-                      AND status = :status
-                    ORDER BY updated_at DESC
-                    LIMIT :limit
-                    """
-                ),
-                {"status": status, "limit": limit},
-            ).fetchall()
-
-        for row in rows:
-            case_id = str(row[0])
-            payload = _latest_vehicle_payload(conn, case_id)
-
-            items.append(
-                {
-                    "case_id": case_id,
-                    "status": row[1],
-                    "payment_status": row[2],
-                    "contact_email": row[3],
-                    "created_at": row[4],
-                    "updated_at": row[5],
-                    "name": payload.get("name"),
-                    "phone": payload.get("phone"),
-                    "email": payload.get("email") or row[3],
-                    "plate": payload.get("plate"),
-                    "city": payload.get("city"),
-                    "notes": payload.get("notes"),
-                    "desguace_name": payload.get("desguace_name"),
-                    "desguace_phone": payload.get("desguace_phone"),
-                    "desguace_email": payload.get("desguace_email"),
-                    "certificate_ref": payload.get("certificate_ref"),
-                }
+        rows = conn.execute(
+            text(
+                f"""
+                SELECT vr.case_id, vr.status, vr.payment_status, vr.contact_email,
+                       vr.created_at, vr.updated_at, vr.data
+                FROM vehicle_removal_requests vr
+                WHERE {" AND ".join(where)}
+                ORDER BY vr.updated_at DESC, vr.case_id DESC
+                LIMIT :limit
+                """
+            ),
+            params,
+        ).fetchall()
+
+        counts = conn.execute(
+            text(
+                """
+                SELECT status, COUNT(*)
+                FROM vehicle_removal_requests
+                GROUP BY status
+                """
             )
+        ).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for row in rows:
+        payload = row[6] if isinstance(row[6], dict) else {}
+        items.append(
+            {
+                "case_id": str(row[0]),
+                "status": row[1],
+                "payment_status": row[2],
+                "contact_email": row[3],
+                "created_at": row[4],
+                "updated_at": row[5],
+                "name": payload.get("name"),
+                "phone": payload.get("phone"),
+                "email": payload.get("email") or row[3],
+                "plate": payload.get("plate"),
+                "city": payload.get("city"),
+                "notes": payload.get("notes"),
+                "desguace_name": payload.get("desguace_name"),
+                "desguace_phone": payload.get("desguace_phone"),
+                "desguace_email": payload.get("desguace_email"),
+                "certificate_ref": payload.get("certificate_ref"),
+            }
+        )
 
+    by_status = {r[0]: int(r[1]) for r in counts}
     summary = {
-        "total": len(items),
-        "pending_payment": sum(1 for x in items if x.get("status") == "vehicle_removal_pending_payment"),
-        "paid": sum(1 for x in items if x.get("status") == "vehicle_removal_paid"),
-        "assigned": sum(1 for x in items if x.get("status") == "vehicle_removal_assigned"),
-        "completed": sum(1 for x in items if x.get("status") == "vehicle_removal_completed"),
+        "total": sum(by_status.values()),
+        "pending_payment": by_status.get("vehicle_removal_pending_payment", 0),
+        "paid": by_status.get("vehicle_removal_paid", 0),
+        "assigned": by_status.get("vehicle_removal_assigned", 0),
+        "completed": by_status.get("vehicle_removal_completed", 0),
     }
 
-    return {"ok": True, "status": status, "count": len(items), "summary": summary, "items": items}
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = _encode_cursor(rows[-1][5], str(rows[-1][0]))
+
+    return {
+        "ok": True,
+        "status": status,
+        "count": len(items),
+        "summary": summary,
+        "items": items,
+        "next_cursor": next_cursor,
+    }
 
 
 @router.get("/{case_id}")
@@ -262,11 +275,13 @@ def mark_vehicle_paid(
             {"case_id": case_id},
         )
 
-        _append_event(
+        record_vehicle_removal_event(
             conn,
             case_id,
             "vehicle_removal_paid",
-            {
+            status="vehicle_removal_paid",
+            payment_status="paid",
+            payload={
                 **payload,
                 "from": case.get("status"),
                 "to": "vehicle_removal_paid",
@@ -302,11 +317,12 @@ def assign_vehicle_removal(
             {"case_id": case_id},
         )
 
-        _append_event(
+        record_vehicle_removal_event(
             conn,
             case_id,
             "vehicle_removal_assigned",
-            {
+            status="vehicle_removal_assigned",
+            payload={
                 **payload,
                 "from": case.get("status"),
                 "to": "vehicle_removal_assigned",
@@ -345,11 +361,12 @@ def complete_vehicle_removal(
             {"case_id": case_id},
         )
 
-        _append_event(
+        record_vehicle_removal_event(
             conn,
             case_id,
             "vehicle_removal_completed",
-            {
+            status="vehicle_removal_completed",
+            payload={
                 **payload,
                 "from": case.get("status"),
                 "to": "vehicle_removal_completed",
@@ -1,20 +1,28 @@
+import asyncio
+import base64
 import os
 import json
 import secrets
-import hashlib
 from datetime import datetime
-from typing import Any, Dict, Optional, List
+from typing import Any, Dict, Optional, List, Tuple
 
-from fastapi import APIRouter, HTTPException, Header, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Header, UploadFile, File, Form, Query, Request
 from pydantic import BaseModel, EmailStr
 from sqlalchemy import text
 
 from database import get_engine
-from b2_storage import upload_bytes
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
+from auth_cache import forget, partner_by_token
+from passwords import (
+    check_login_allowed,
+    clear_login_failures,
+    hash_password_async,
+    record_login_failure,
+    verify_password_async,
+)
+from event_log import append_event
+from email_outbox import enqueue_email_tx
+from document_ingest import ingest_uploads, insert_documents
+from request_ip import client_ip
 from fastapi import Response
 import io
 
@@ -54,11 +62,6 @@ def _require_admin(x_admin_token: Optional[str]) -> None:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
-def _hash_password(password: str, salt: str) -> str:
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), 120_000)
-    return dk.hex()
-
-
 def _make_token() -> str:
     return secrets.token_urlsafe(32)
 
@@ -73,28 +76,79 @@ def _require_partner_token(authorization: Optional[str]) -> str:
 
 
 def _get_partner_by_token(conn, token: str) -> Dict[str, Any]:
-    row = conn.execute(
-        text("SELECT id, name, email, active FROM partners WHERE api_token=:t"),
-        {"t": token},
-    ).fetchone()
-    if not row:
-        raise HTTPException(status_code=401, detail="Token partner inválido")
-    if not bool(row[3]):
-        raise HTTPException(status_code=403, detail="Partner desactivado")
-    return {"id": str(row[0]), "name": row[1], "email": row[2]}
+    # Caché positiva en proceso (auth_cache); conn solo se usa si no está
+    return partner_by_token(conn, token)
 
 
 def _event(conn, case_id: str, typ: str, payload: Dict[str, Any]) -> None:
-    conn.execute(
+    append_event(conn, case_id, typ, payload)
+
+
+def insert_partner_case(
+    conn,
+    partner: Dict[str, Any],
+    client_email: Optional[str],
+    client_name: Optional[str],
+    interesado: Optional[Dict[str, Any]],
+    partner_note: Optional[str],
+    case_id: Optional[str] = None,
+) -> str:
+    """
+    Alta del case de asesoría (channel='partner', facturación mensual) + evento.
+    case_id permite fijar el id de antemano (lotes: se sube a B2 antes de insertar).
+    """
+    email = client_email.strip().lower() if client_email else None
+    row = conn.execute(
         text(
-            "INSERT INTO events(case_id, type, payload, created_at) "
-            "VALUES (:case_id, :type, CAST(:payload AS JSONB), NOW())"
+            """
+            INSERT INTO cases (
+                id,
+                contact_email, contact_name,
+                channel, partner_id, partner_name,
+                payment_status, status,
+                interested_data,
+                created_at, updated_at
+            )
+            VALUES (
+                COALESCE(CAST(:id AS UUID), gen_random_uuid()),
+                :ce, :cn,
+                'partner', :pid, :pname,
+                'monthly', 'uploaded',
+                :idata,
+                NOW(), NOW()
+            )
+            RETURNING id
+            """
         ),
-        {"case_id": case_id, "type": typ, "payload": json.dumps(payload)},
-    )
+        {
+            "id": case_id,
+            "ce": email,
+            "cn": (client_name or "").strip() or None,
+            "pid": partner["id"],
+            "pname": partner["name"],
+            "idata": json.dumps(interesado or {}),
+        },
+    ).fetchone()
+
+    case_id = str(row[0])
+
+    _event(conn, case_id, "partner_case_created", {
+        "partner_id": partner["id"],
+        "partner_name": partner["name"],
+        "client_email": email,
+        "client_name": (client_name or "").strip() if client_name else None,
+        "partner_note": (partner_note or "").strip()[:1000] if partner_note else None,
+    })
+    return case_id
 
 
 def _build_partner_authorization_template_pdf() -> bytes:
+    # reportlab se importa al generar (no al arrancar): acelera el cold start
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
+
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -191,53 +245,115 @@ def partner_authorization_template_pdf() -> Response:
     return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
 
 
+# Texto de búsqueda del listado: la misma expresión que el índice trigram
+# idx_cases_partner_search_trgm (/admin/migrate/partner_cases_listing)
+def partner_case_search_sql(prefix: str = "c.") -> str:
+    return (
+        f"lower(COALESCE({prefix}contact_name, '') || ' ' || COALESCE({prefix}contact_email, '') "
+        f"|| ' ' || CAST({prefix}id AS TEXT))"
+    )
+
+
+def _encode_cursor(updated_at, case_id: str) -> str:
+    raw = f"{updated_at.isoformat()}|{case_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        ts, case_id = raw.split("|", 1)
+        return datetime.fromisoformat(ts), case_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+
+
 @router.get("/cases")
 def list_partner_cases(
     authorization: Optional[str] = Header(default=None),
     q: Optional[str] = None,
     status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
 ) -> Dict[str, Any]:
+    """
+    Listado de casos de la asesoría.
+    - Paginación keyset por (updated_at, id): pasar next_cursor como cursor.
+    - q busca en nombre, email e id (índice trigram; mínimo útil 3 caracteres).
+    - total y facets (por estado) cuentan todos los casos que cumplen q, no solo la página.
+    """
     token = _require_partner_token(authorization)
     engine = get_engine()
 
+    search_where = ""
+    params: Dict[str, Any] = {"limit": limit + 1}
+    if (q or "").strip():
+        search_where = f" AND {partner_case_search_sql()} LIKE :q"
+        params["q"] = "%" + q.strip().lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    page_where = search_where
+    if (status or "").strip():
+        page_where += " AND c.status = :status"
+        params["status"] = status.strip()
+    if cursor:
+        cur_ts, cur_id = _decode_cursor(cursor)
+        page_where += " AND (c.updated_at, c.id) < (:cur_ts, CAST(:cur_id AS UUID))"
+        params["cur_ts"] = cur_ts
+        params["cur_id"] = cur_id
+
     with engine.begin() as conn:
         partner = _get_partner_by_token(conn, token)
+        params["pid"] = partner["id"]
 
-        sql = """
-            SELECT
-                c.id,
-                c.contact_name,
-                c.contact_email,
-                c.status,
-                COALESCE(c.payment_status, 'monthly') AS payment_status,
-                c.updated_at,
-                (
-                    SELECT COUNT(*)
+        # Página + documentos agregados en una sola pasada sobre los ids de la página
+        rows = conn.execute(
+            text(
+                f"""
+                WITH page AS (
+                    SELECT
+                        c.id,
+                        c.contact_name,
+                        c.contact_email,
+                        c.status,
+                        COALESCE(c.payment_status, 'monthly') AS payment_status,
+                        c.updated_at
+                    FROM cases c
+                    WHERE c.partner_id = :pid{page_where}
+                    ORDER BY c.updated_at DESC, c.id DESC
+                    LIMIT :limit
+                ),
+                docs AS (
+                    SELECT d.case_id,
+                           COUNT(*) AS docs_total,
+                           BOOL_OR(d.kind = 'authorization_signed') AS authorization_document_uploaded
                     FROM documents d
-                    WHERE d.case_id = c.id
-                ) AS docs_total,
-                EXISTS(
-                    SELECT 1
-                    FROM documents d2
-                    WHERE d2.case_id = c.id
-                      AND d2.kind = 'authorization_signed'
-                ) AS authorization_document_uploaded
-            FROM cases c
-            WHERE c.partner_id = :pid
-        """
-        params = {"pid": partner["id"]}
-
-        if (status or "").strip():
-            sql += " AND c.status = :status"
-            params["status"] = status.strip()
-
-        if (q or "").strip():
-            sql += " AND (COALESCE(c.contact_name,'') ILIKE :q OR COALESCE(c.contact_email,'') ILIKE :q OR CAST(c.id AS TEXT) ILIKE :q)"
-            params["q"] = f"%{q.strip()}%"
+                    WHERE d.case_id IN (SELECT id FROM page)
+                    GROUP BY d.case_id
+                )
+                SELECT page.id, page.contact_name, page.contact_email, page.status, page.payment_status,
+                       page.updated_at, COALESCE(docs.docs_total, 0), COALESCE(docs.authorization_document_uploaded, FALSE)
+                FROM page
+                LEFT JOIN docs ON docs.case_id = page.id
+                ORDER BY page.updated_at DESC, page.id DESC
+                """
+            ),
+            params,
+        ).fetchall()
 
-        sql += " ORDER BY c.updated_at DESC"
+        facet_rows = conn.execute(
+            text(
+                f"""
+                SELECT COALESCE(c.status, 'uploaded'), COUNT(*)
+                FROM cases c
+                WHERE c.partner_id = :pid{search_where}
+                GROUP BY 1
+                """
+            ),
+            {k: v for k, v in params.items() if k in ("pid", "q")},
+        ).fetchall()
 
-        rows = conn.execute(text(sql), params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
     items = []
     for row in rows:
@@ -254,10 +370,21 @@ def list_partner_cases(
             "docs_total": int(row[6] or 0),
         })
 
+    facets = {r[0]: int(r[1]) for r in facet_rows}
+    total = facets.get(status.strip(), 0) if (status or "").strip() else sum(facets.values())
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = _encode_cursor(rows[-1][5], str(rows[-1][0]))
+
     return {
         "ok": True,
         "partner_name": partner["name"],
+        "count": len(items),
+        "total": total,
+        "facets": {"status": facets},
         "items": items,
+        "next_cursor": next_cursor,
     }
 
 
@@ -273,7 +400,7 @@ class PartnerLoginIn(BaseModel):
 
 
 @router.post("/admin-create")
-def admin_create_partner(
+async def admin_create_partner(
     payload: PartnerCreateIn,
     x_admin_token: Optional[str] = Header(default=None, alias="x-admin-token"),
 ) -> Dict[str, Any]:
@@ -284,41 +411,71 @@ def admin_create_partner(
     if len(password) < 8:
         raise HTTPException(status_code=400, detail="Password mínimo 8 caracteres")
 
-    salt = secrets.token_hex(16)
-    pwd_hash = _hash_password(password, salt)
+    # Hash en el pool de procesos (passwords.py), no en el threadpool de la petición
+    pwd_hash, salt = await hash_password_async(password)
     token = _make_token()
 
     engine = get_engine()
-    with engine.begin() as conn:
-        exists = conn.execute(text("SELECT 1 FROM partners WHERE email=:e"), {"e": email}).fetchone()
-        if exists:
-            raise HTTPException(status_code=409, detail="Ya existe un partner con ese email")
-        row = conn.execute(
-            text("INSERT INTO partners(name, email, password_salt, password_hash, api_token, active, created_at, updated_at) VALUES (:n,:e,:s,:h,:t,TRUE,NOW(),NOW()) RETURNING id"),
-            {"n": name, "e": email, "s": salt, "h": pwd_hash, "t": token},
-        ).fetchone()
-    return {"ok": True, "partner_id": str(row[0]), "token": token}
+
+    def _insert() -> str:
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM partners WHERE email=:e"), {"e": email}).fetchone()
+            if exists:
+                raise HTTPException(status_code=409, detail="Ya existe un partner con ese email")
+            row = conn.execute(
+                text("INSERT INTO partners(name, email, password_salt, password_hash, api_token, active, created_at, updated_at) VALUES (:n,:e,:s,:h,:t,TRUE,NOW(),NOW()) RETURNING id"),
+                {"n": name, "e": email, "s": salt, "h": pwd_hash, "t": token},
+            ).fetchone()
+            return str(row[0])
+
+    partner_id = await asyncio.to_thread(_insert)
+    return {"ok": True, "partner_id": partner_id, "token": token}
 
 
 @router.post("/login")
-def partner_login(payload: PartnerLoginIn) -> Dict[str, Any]:
+async def partner_login(payload: PartnerLoginIn, request: Request) -> Dict[str, Any]:
     email = str(payload.email).strip().lower()
     password = payload.password.strip()
+
+    # Límite por IP y por email antes de gastar CPU en el hash
+    check_login_allowed(client_ip(request), email)
+
     engine = get_engine()
-    with engine.begin() as conn:
-        row = conn.execute(
-            text("SELECT id, name, email, password_salt, password_hash, active FROM partners WHERE email=:e"),
-            {"e": email},
-        ).fetchone()
-        if not row or not bool(row[5]):
-            raise HTTPException(status_code=401, detail="Credenciales incorrectas")
-        salt = row[3] or ""
-        expected = row[4] or ""
-        got = _hash_password(password, salt)
-        if got != expected:
-            raise HTTPException(status_code=401, detail="Credenciales incorrectas")
-        token = _make_token()
-        conn.execute(text("UPDATE partners SET api_token=:t, updated_at=NOW() WHERE id=:id"), {"t": token, "id": row[0]})
+
+    def _load():
+        with engine.begin() as conn:
+            return conn.execute(
+                text("SELECT id, name, email, password_salt, password_hash, active FROM partners WHERE email=:e"),
+                {"e": email},
+            ).fetchone()
+
+    row = await asyncio.to_thread(_load)
+    if not row or not bool(row[5]):
+        record_login_failure(email)
+        raise HTTPException(status_code=401, detail="Credenciales incorrectas")
+
+    ok, rehash = await verify_password_async(password, row[4] or "", row[3] or "")
+    if not ok:
+        record_login_failure(email)
+        raise HTTPException(status_code=401, detail="Credenciales incorrectas")
+    clear_login_failures(email)
+
+    # Hash antiguo (PBKDF2) -> esquema actual, aprovechando que tenemos la contraseña
+    new_hash = await hash_password_async(password) if rehash else None
+    token = _make_token()
+
+    def _rotate() -> None:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE partners SET api_token=:t, updated_at=NOW() WHERE id=:id"), {"t": token, "id": row[0]})
+            if new_hash:
+                conn.execute(
+                    text("UPDATE partners SET password_hash=:h, password_salt=:s WHERE id=:id"),
+                    {"h": new_hash[0], "s": new_hash[1], "id": row[0]},
+                )
+
+    await asyncio.to_thread(_rotate)
+    # El token anterior deja de valer: fuera de la caché de este proceso
+    forget("partner", str(row[0]))
     return {"ok": True, "token": token, "partner_name": row[1]}
 
 
@@ -360,140 +517,55 @@ async def create_partner_case(
 
     engine = get_engine()
 
-    with engine.begin() as conn:
-        partner = _get_partner_by_token(conn, token)
-
-        row = conn.execute(
-            text(
-                """
-                INSERT INTO cases (
-                    contact_email, contact_name,
-                    channel, partner_id, partner_name,
-                    payment_status, status,
-                    interested_data,
-                    created_at, updated_at
-                )
-                VALUES (
-                    :ce, :cn,
-                    'partner', :pid, :pname,
-                    'monthly', 'uploaded',
-                    :idata,
-                    NOW(), NOW()
-                )
-                RETURNING id
-                """
-            ),
-            {
-                "ce": str(client_email).strip().lower() if client_email else None,
-                "cn": (client_name or "").strip() or None,
-                "pid": partner["id"],
-                "pname": partner["name"],
-                "idata": json.dumps(interesado or {}),
-            },
-        ).fetchone()
-
-        case_id = str(row[0])
-
-        _event(conn, case_id, "partner_case_created", {
-            "partner_id": partner["id"],
-            "partner_name": partner["name"],
-            "client_email": str(client_email).strip().lower() if client_email else None,
-            "client_name": (client_name or "").strip() if client_name else None,
-            "partner_note": (partner_note or "").strip()[:1000] if partner_note else None,
-        })
+    # BD síncrona en un hilo: el handler es async y no debe bloquear el event loop
+    def _create_case() -> str:
+        with engine.begin() as conn:
+            partner = _get_partner_by_token(conn, token)
+            return insert_partner_case(
+                conn,
+                partner,
+                client_email=str(client_email) if client_email else None,
+                client_name=client_name,
+                interesado=interesado,
+                partner_note=partner_note,
+            )
 
-    auth_data = await authorization_file.read()
-    if not auth_data:
-        raise HTTPException(status_code=400, detail="La autorización firmada está vacía.")
+    case_id = await asyncio.to_thread(_create_case)
 
-    auth_filename = (authorization_file.filename or "authorization_signed").replace("/", "_").replace("\\", "_")[:120]
-    auth_ext = ".bin"
-    if "." in auth_filename:
-        auth_ext = "." + auth_filename.split(".")[-1].lower()
-        if len(auth_ext) > 8:
-            auth_ext = ".bin"
-
-    auth_bucket, auth_key = upload_bytes(
-        case_id,
-        "authorization_signed",
-        auth_data,
-        ext=auth_ext,
-        content_type=(authorization_file.content_type or "application/octet-stream"),
+    # Autorización firmada + documentos: subida concurrente en streaming (sha256 incremental)
+    auth_docs, uploaded = await asyncio.gather(
+        ingest_uploads(case_id, [authorization_file], kind_folder="authorization_signed", default_name="authorization_signed"),
+        ingest_uploads(case_id, files, kind_folder="original", default_name="doc"),
     )
+    if not auth_docs:
+        raise HTTPException(status_code=400, detail="La autorización firmada está vacía.")
+    auth_doc = auth_docs[0]
 
-    with engine.begin() as conn:
-        conn.execute(
-            text(
-                """
-                INSERT INTO documents(case_id, kind, b2_bucket, b2_key, mime, size_bytes, created_at)
-                VALUES (:case_id, 'authorization_signed', :b, :k, :m, :s, NOW())
-                """
-            ),
-            {
-                "case_id": case_id,
-                "b": auth_bucket,
-                "k": auth_key,
-                "m": authorization_file.content_type or "application/octet-stream",
-                "s": len(auth_data),
-            },
-        )
-        _event(conn, case_id, "authorization_uploaded", {
-            "source": "partner",
-            "filename": auth_filename,
-        })
-
-    uploaded = []
-    for idx, uf in enumerate(files, start=1):
-        data = await uf.read()
-        if not data:
-            continue
-
-        filename = (uf.filename or f"doc_{idx}").replace("/", "_").replace("\\", "_")[:120]
-        ext = ".bin"
-        if "." in filename:
-            ext = "." + filename.split(".")[-1].lower()
-            if len(ext) > 8:
-                ext = ".bin"
-
-        b2_bucket, b2_key = upload_bytes(
-            case_id,
-            "original",
-            data,
-            ext=ext,
-            content_type=(uf.content_type or "application/octet-stream"),
-        )
-        uploaded.append({
-            "filename": filename,
-            "bucket": b2_bucket,
-            "key": b2_key,
-            "mime": uf.content_type or "application/octet-stream",
-            "size_bytes": len(data),
-        })
-
+    def _register() -> None:
         with engine.begin() as conn:
-            conn.execute(
-                text(
-                    """
-                    INSERT INTO documents(case_id, kind, b2_bucket, b2_key, mime, size_bytes, created_at)
-                    VALUES (:case_id, 'original', :b, :k, :m, :s, NOW())
-                    """
-                ),
-                {"case_id": case_id, "b": b2_bucket, "k": b2_key, "m": uf.content_type or "application/octet-stream", "s": len(data)},
-            )
+            insert_documents(conn, case_id, "authorization_signed", auth_docs)
+            insert_documents(conn, case_id, "original", uploaded)
+            _event(conn, case_id, "authorization_uploaded", {
+                "source": "partner",
+                "filename": auth_doc["filename"],
+            })
+            _event(conn, case_id, "partner_documents_uploaded", {"count": len(uploaded)})
 
-    with engine.begin() as conn:
-        _event(conn, case_id, "partner_documents_uploaded", {"count": len(uploaded)})
+    await asyncio.to_thread(_register)
 
     return {
         "ok": True,
         "case_id": case_id,
-        "uploaded": uploaded,
+        "uploaded": [
+            {k: d[k] for k in ("filename", "bucket", "key", "mime", "size_bytes", "sha256")}
+            for d in uploaded
+        ],
         "authorization_signed": {
-            "filename": auth_filename,
-            "bucket": auth_bucket,
-            "key": auth_key,
-            "mime": authorization_file.content_type or "application/octet-stream",
-            "size_bytes": len(auth_data),
+            "filename": auth_doc["filename"],
+            "bucket": auth_doc["bucket"],
+            "key": auth_doc["key"],
+            "mime": auth_doc["mime"],
+            "size_bytes": auth_doc["size_bytes"],
         },
     }
 
@@ -510,16 +582,7 @@ class PartnerSignupRequest(BaseModel):
 
 @router.post("/signup")
 def partner_signup(payload: PartnerSignupRequest):
-    try:
-        import smtplib
-        from email.message import EmailMessage
-
-        msg = EmailMessage()
-        msg["Subject"] = "Nueva solicitud de alta asesoría"
-        msg["From"] = os.getenv("SMTP_FROM")
-        msg["To"] = "soporte@recurretumulta.eu"
-
-        body = f"""
+    body = f"""
 Nueva solicitud de asesoría:
 
 Empresa: {payload.empresa}
@@ -533,13 +596,14 @@ Mensaje:
 {payload.mensaje}
         """
 
-        msg.set_content(body)
-
-        with smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", "587"))) as server:
-            server.starttls()
-            server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
-            server.send_message(msg)
-
+    try:
+        enqueue_email_tx(
+            to_email="soporte@recurretumulta.eu",
+            subject="Nueva solicitud de alta asesoría",
+            body=body,
+            reply_to=str(payload.email),
+            kind="partner_signup",
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error enviando email: {e}")
 
@@ -0,0 +1,604 @@
+# partner_batch.py — alta masiva de expedientes de asesoría (lotes)
+#
+# POST /partner/batches recibe un manifest JSON con N casos y los ficheros en un zip
+# (archive) o como partes multipart (files). Cada caso del manifest referencia sus
+# ficheros por nombre (ruta dentro del zip o filename de la parte):
+#
+#   {
+#     "confirm_client_informed": true,
+#     "cases": [
+#       {"ref": "cliente-001", "client_email": "...", "client_name": "...",
+#        "interesado": {...}, "partner_note": "...",
+#        "authorization_file": "auth_001.pdf", "files": ["multa_001.pdf", "foto.jpg"]}
+#     ]
+#   }
+#
+# - Paralelismo acotado por PARTNER_BATCH_CONCURRENCY (casos a la vez).
+# - Deduplicación por sha256 de los documentos: contra los casos ya existentes del
+#   partner y dentro del propio lote. El caso repetido queda como 'duplicate'.
+# - Cada caso se sube a B2 con un id fijado de antemano y se da de alta en una sola
+#   transacción (case + documents + eventos + cola); si falla, no deja filas a medias.
+# - El análisis IA no se espera: se encola en work_queue (kind='analysis') y lo
+#   ejecuta el planificador (hilo de fondo con SCHEDULER_WORKER, o un primer lote al
+#   terminar la subida y el resto el cron de POST /ops/automation/tick).
+# - GET /partner/batches/{batch_id} devuelve el estado por caso, incluido el análisis.
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+import zipfile
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, File, Form, Header, HTTPException, UploadFile
+from sqlalchemy import text
+
+from database import get_engine
+from document_ingest import ext_from_filename, insert_documents, safe_filename
+from b2_storage import upload_fileobj
+from event_log import append_event
+from partner import MAX_FILES, _get_partner_by_token, _require_partner_token, insert_partner_case
+from work_scheduler import class_limits, enqueue_work, run_due, wake_scheduler, worker_enabled
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/partner/batches", tags=["partner"])
+
+_HASH_CHUNK = 1024 * 1024
+
+_MIME_BY_EXT = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or str(default)).strip())
+    except ValueError:
+        return default
+
+
+def _max_cases() -> int:
+    return max(1, _env_int("PARTNER_BATCH_MAX_CASES", 100))
+
+
+def _concurrency() -> int:
+    return max(1, _env_int("PARTNER_BATCH_CONCURRENCY", 4))
+
+
+def _max_file_bytes() -> int:
+    return max(1, _env_int("PARTNER_BATCH_MAX_FILE_MB", 20)) * 1024 * 1024
+
+
+def _max_total_bytes() -> int:
+    return max(1, _env_int("PARTNER_BATCH_MAX_TOTAL_MB", 500)) * 1024 * 1024
+
+
+# =========================================================
+# FICHEROS DEL LOTE (zip o multipart)
+# =========================================================
+# nombre -> {"open": callable que devuelve un context manager con el fichero binario,
+#            "size", "mime", "lock"}. Las entradas del zip se cierran al salir; el
+#            fichero de un UploadFile no (se vuelve a leer para subirlo).
+# El lock serializa lecturas del mismo fichero (p. ej. una autorización compartida
+# por varios casos): un UploadFile no admite dos lectores a la vez.
+Source = Dict[str, Any]
+
+
+def _zip_sources(archive: UploadFile) -> Dict[str, Source]:
+    archive.file.seek(0)
+    try:
+        zf = zipfile.ZipFile(archive.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="archive no es un zip válido")
+
+    sources: Dict[str, Source] = {}
+    total = 0
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        # Tamaños declarados en el zip: cortar antes de descomprimir (zip bomb)
+        if info.file_size > _max_file_bytes():
+            raise HTTPException(status_code=413, detail=f"Fichero demasiado grande en el zip: {info.filename}")
+        total += info.file_size
+        if total > _max_total_bytes():
+            raise HTTPException(status_code=413, detail="El zip supera el tamaño máximo del lote")
+
+        ext = ext_from_filename(info.filename)
+        sources[info.filename] = {
+            "open": (lambda name=info.filename: zf.open(name)),
+            "size": info.file_size,
+            "mime": _MIME_BY_EXT.get(ext, "application/octet-stream"),
+            "lock": threading.Lock(),
+        }
+    return sources
+
+
+def _upload_size(uf: UploadFile) -> int:
+    f = uf.file
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+
+def _multipart_sources(files: List[UploadFile]) -> Dict[str, Source]:
+    sources: Dict[str, Source] = {}
+    total = 0
+    for uf in files:
+        name = uf.filename or ""
+        if not name:
+            continue
+        if name in sources:
+            raise HTTPException(status_code=400, detail=f"Nombre de fichero repetido: {name}")
+        size = _upload_size(uf)
+        if size > _max_file_bytes():
+            raise HTTPException(status_code=413, detail=f"Fichero demasiado grande: {name}")
+        total += size
+        if total > _max_total_bytes():
+            raise HTTPException(status_code=413, detail="Los ficheros superan el tamaño máximo del lote")
+
+        def _open(f=uf.file):
+            f.seek(0)
+            return nullcontext(f)
+
+        sources[name] = {
+            "open": _open,
+            "size": size,
+            "mime": uf.content_type or _MIME_BY_EXT.get(ext_from_filename(name), "application/octet-stream"),
+            "lock": threading.Lock(),
+        }
+    return sources
+
+
+def _resolve(sources: Dict[str, Source], name: str) -> Optional[str]:
+    """Nombre exacto o, si no, nombre base único (zips con carpeta raíz)."""
+    if name in sources:
+        return name
+    base = name.rsplit("/", 1)[-1]
+    matches = [k for k in sources if k.rsplit("/", 1)[-1] == base]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _hash_sources(sources: Dict[str, Source], names: List[str]) -> None:
+    for name in names:
+        src = sources[name]
+        h = hashlib.sha256()
+        with src["lock"], src["open"]() as f:
+            while True:
+                chunk = f.read(_HASH_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+        src["sha256"] = h.hexdigest()
+
+
+# =========================================================
+# MANIFEST
+# =========================================================
+def _parse_manifest(manifest: str) -> List[Dict[str, Any]]:
+    try:
+        data = json.loads(manifest)
+    except Exception:
+        raise HTTPException(status_code=400, detail="manifest no es JSON válido")
+    if not isinstance(data, dict) or not isinstance(data.get("cases"), list):
+        raise HTTPException(status_code=400, detail="manifest debe ser un objeto con la lista cases")
+    if str(data.get("confirm_client_informed", "")).strip().lower() not in ("true", "1", "yes", "si", "sí"):
+        raise HTTPException(status_code=400, detail="Debe confirmarse cliente informado (confirm_client_informed=true).")
+
+    cases = data["cases"]
+    if not cases:
+        raise HTTPException(status_code=400, detail="El lote no tiene casos.")
+    if len(cases) > _max_cases():
+        raise HTTPException(status_code=400, detail=f"Máximo {_max_cases()} casos por lote.")
+    return cases
+
+
+def _plan_item(idx: int, spec: Any, sources: Dict[str, Source]) -> Dict[str, Any]:
+    """Valida un caso del manifest. Los errores no tumban el lote: el caso queda 'failed'."""
+    item: Dict[str, Any] = {"idx": idx, "ref": None, "status": "pending", "error": None}
+    if not isinstance(spec, dict):
+        item.update(status="failed", error="El caso debe ser un objeto")
+        return item
+
+    item["ref"] = str(spec.get("ref") or idx)[:200]
+    item["spec"] = spec
+
+    names = spec.get("files") or []
+    if not isinstance(names, list) or not names:
+        item.update(status="failed", error="Sin ficheros (files)")
+        return item
+    if len(names) > MAX_FILES:
+        item.update(status="failed", error=f"Máximo {MAX_FILES} documentos por expediente.")
+        return item
+    if not spec.get("authorization_file"):
+        item.update(status="failed", error="Falta la autorización firmada del cliente (authorization_file).")
+        return item
+    if spec.get("interesado") is not None and not isinstance(spec.get("interesado"), dict):
+        item.update(status="failed", error="interesado debe ser un objeto")
+        return item
+
+    resolved = []
+    for name in [spec["authorization_file"]] + names:
+        real = _resolve(sources, str(name))
+        if real is None:
+            item.update(status="failed", error=f"Fichero no encontrado en el lote: {name}")
+            return item
+        if sources[real]["size"] == 0:
+            item.update(status="failed", error=f"Fichero vacío: {name}")
+            return item
+        resolved.append(real)
+
+    item["auth_source"] = resolved[0]
+    item["doc_sources"] = resolved[1:]
+    return item
+
+
+def _dedupe_docs(item: Dict[str, Any], sources: Dict[str, Source]) -> None:
+    """Quita documentos repetidos dentro del caso (mismo sha256)."""
+    seen = set()
+    unique = []
+    for name in item["doc_sources"]:
+        sha = sources[name]["sha256"]
+        if sha not in seen:
+            seen.add(sha)
+            unique.append(name)
+    item["doc_sources"] = unique
+    item["doc_sha256"] = [sources[n]["sha256"] for n in unique]
+
+
+# =========================================================
+# BD
+# =========================================================
+def _existing_by_sha(conn, partner_id: str, shas: List[str]) -> Dict[str, str]:
+    """sha256 -> case_id de documentos originales ya subidos por el partner."""
+    if not shas:
+        return {}
+    rows = conn.execute(
+        text(
+            """
+            SELECT DISTINCT ON (d.sha256) d.sha256, d.case_id
+            FROM documents d
+            JOIN cases c ON c.id = d.case_id
+            WHERE d.sha256 = ANY(:shas)
+              AND d.kind = 'original'
+              AND c.partner_id = :pid
+            ORDER BY d.sha256, d.created_at
+            """
+        ),
+        {"shas": shas, "pid": partner_id},
+    ).fetchall()
+    return {r[0]: str(r[1]) for r in rows}
+
+
+def _create_batch(conn, partner_id: str, items: List[Dict[str, Any]]) -> str:
+    batch_id = str(
+        conn.execute(
+            text(
+                "INSERT INTO partner_batches (partner_id, status, total) "
+                "VALUES (:pid, 'processing', :total) RETURNING id"
+            ),
+            {"pid": partner_id, "total": len(items)},
+        ).fetchone()[0]
+    )
+
+    values = []
+    params: Dict[str, Any] = {"bid": batch_id}
+    for i, it in enumerate(items):
+        values.append(f"(:bid, :idx{i}, :ref{i}, :st{i}, CAST(:dup{i} AS UUID), :err{i})")
+        params[f"idx{i}"] = it["idx"]
+        params[f"ref{i}"] = it["ref"]
+        params[f"st{i}"] = it["status"]
+        params[f"dup{i}"] = it.get("duplicate_of_case_id")
+        params[f"err{i}"] = it.get("error")
+    conn.execute(
+        text(
+            "INSERT INTO partner_batch_items (batch_id, idx, ref, status, duplicate_of_case_id, error) "
+            "VALUES " + ", ".join(values)
+        ),
+        params,
+    )
+    return batch_id
+
+
+def _set_item(conn, batch_id: str, item: Dict[str, Any]) -> None:
+    conn.execute(
+        text(
+            """
+            UPDATE partner_batch_items
+            SET status = :st, case_id = CAST(:cid AS UUID), error = :err,
+                documents = CAST(:docs AS JSONB), updated_at = NOW()
+            WHERE batch_id = :bid AND idx = :idx
+            """
+        ),
+        {
+            "bid": batch_id,
+            "idx": item["idx"],
+            "st": item["status"],
+            "cid": item.get("case_id"),
+            "err": item.get("error"),
+            "docs": json.dumps(item.get("documents") or []),
+        },
+    )
+
+
+# =========================================================
+# INGESTA DE UN CASO (en un hilo)
+# =========================================================
+def _upload_source(case_id: str, kind_folder: str, src_name: str, src: Source) -> Dict[str, Any]:
+    with src["lock"], src["open"]() as f:
+        stored = upload_fileobj(case_id, kind_folder, f, ext_from_filename(src_name), src["mime"])
+    return {
+        "filename": safe_filename(src_name.rsplit("/", 1)[-1]),
+        "bucket": stored["bucket"],
+        "key": stored["key"],
+        "mime": src["mime"],
+        "size_bytes": stored["size_bytes"],
+        "sha256": stored["sha256"],
+    }
+
+
+def _ingest_item(batch_id: str, partner: Dict[str, Any], item: Dict[str, Any], sources: Dict[str, Source]) -> None:
+    spec = item["spec"]
+    case_id = str(uuid.uuid4())
+    engine = get_engine()
+    try:
+        auth_doc = _upload_source(case_id, "authorization_signed", item["auth_source"], sources[item["auth_source"]])
+        docs = [_upload_source(case_id, "original", n, sources[n]) for n in item["doc_sources"]]
+
+        with engine.begin() as conn:
+            insert_partner_case(
+                conn,
+                partner,
+                client_email=str(spec.get("client_email") or "") or None,
+                client_name=spec.get("client_name"),
+                interesado=spec.get("interesado") or {},
+                partner_note=spec.get("partner_note"),
+                case_id=case_id,
+            )
+            insert_documents(conn, case_id, "authorization_signed", [auth_doc])
+            insert_documents(conn, case_id, "original", docs)
+            append_event(conn, case_id, "authorization_uploaded", {
+                "source": "partner_batch",
+                "filename": auth_doc["filename"],
+            })
+            append_event(conn, case_id, "partner_documents_uploaded", {
+                "count": len(docs),
+                "batch_id": batch_id,
+                "ref": item["ref"],
+            })
+            enqueue_work(conn, case_id, "analysis", {"batch_id": batch_id})
+
+            item.update(
+                status="created",
+                case_id=case_id,
+                documents=[{k: d[k] for k in ("filename", "key", "size_bytes", "sha256")} for d in docs],
+            )
+            _set_item(conn, batch_id, item)
+    except Exception as e:
+        # Los objetos ya subidos a B2 quedan huérfanos; no hay filas del caso
+        item.update(status="failed", case_id=None, error=f"{type(e).__name__}: {getattr(e, 'detail', None) or e}"[:500])
+        with engine.begin() as conn:
+            _set_item(conn, batch_id, item)
+
+
+def _finish_batch(batch_id: str) -> None:
+    with get_engine().begin() as conn:
+        conn.execute(
+            text(
+                """
+                UPDATE partner_batches b
+                SET status = 'done',
+                    created = s.created,
+                    duplicates = s.duplicates,
+                    failed = s.failed,
+                    finished_at = NOW()
+                FROM (
+                    SELECT COUNT(*) FILTER (WHERE status = 'created') AS created,
+                           COUNT(*) FILTER (WHERE status = 'duplicate') AS duplicates,
+                           COUNT(*) FILTER (WHERE status = 'failed') AS failed
+                    FROM partner_batch_items WHERE batch_id = :bid
+                ) s
+                WHERE b.id = :bid
+                """
+            ),
+            {"bid": batch_id},
+        )
+
+
+def run_analysis_job(case_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler del planificador (work_scheduler, kind='analysis')."""
+    from ai.expediente_engine import run_expediente_ai
+
+    result = run_expediente_ai(case_id)
+    return {
+        "ok": True,
+        "case_id": case_id,
+        "admissibility": (result.get("admissibility") or {}).get("admissibility"),
+    }
+
+
+def _created_count(items: List[Dict[str, Any]]) -> int:
+    return sum(1 for it in items if it["status"] == "created")
+
+
+def _kick_analysis() -> None:
+    try:
+        run_due(limit=sum(class_limits().values()), kinds=["analysis"])
+    except Exception as e:
+        logger.warning("partner_batch: no se pudo lanzar el análisis: %s", e)
+
+
+def _item_out(item: Dict[str, Any]) -> Dict[str, Any]:
+    out = {"idx": item["idx"], "ref": item["ref"], "status": item["status"]}
+    for k in ("case_id", "duplicate_of_case_id", "duplicate_of_ref", "error", "documents"):
+        if item.get(k):
+            out[k] = item[k]
+    return out
+
+
+# =========================================================
+# ENDPOINTS
+# =========================================================
+@router.post("")
+async def create_partner_batch(
+    authorization: Optional[str] = Header(default=None),
+    manifest: str = Form(...),
+    archive: Optional[UploadFile] = File(default=None),
+    files: Optional[List[UploadFile]] = File(default=None),
+) -> Dict[str, Any]:
+    """
+    Alta de N expedientes en una llamada (Bearer <partner_api_token>).
+    Ficheros en un zip (archive) o como partes multipart (files), referenciados por
+    nombre desde el manifest. Devuelve batch_id y el estado de cada caso; el análisis
+    IA se encola y se consulta con GET /partner/batches/{batch_id}.
+    """
+    token = _require_partner_token(authorization)
+    specs = _parse_manifest(manifest)
+    engine = get_engine()
+
+    # Token contra BD antes de leer y hashear los ficheros: un token inventado no gasta CPU
+    def _partner() -> Dict[str, Any]:
+        with engine.begin() as conn:
+            return _get_partner_by_token(conn, token)
+
+    partner = await asyncio.to_thread(_partner)
+
+    if archive is not None and archive.filename:
+        sources = _zip_sources(archive)
+    elif files:
+        sources = _multipart_sources(files)
+    else:
+        raise HTTPException(status_code=400, detail="Faltan los ficheros del lote (archive o files).")
+
+    items = [_plan_item(idx, spec, sources) for idx, spec in enumerate(specs, start=1)]
+    pending = [it for it in items if it["status"] == "pending"]
+
+    # sha256 de todo lo referenciado, una vez por fichero
+    names = sorted({n for it in pending for n in [it["auth_source"]] + it["doc_sources"]})
+    await asyncio.to_thread(_hash_sources, sources, names)
+    for it in pending:
+        _dedupe_docs(it, sources)
+
+    def _prepare() -> str:
+        with engine.begin() as conn:
+            existing = _existing_by_sha(conn, partner["id"], sorted({s for it in pending for s in it["doc_sha256"]}))
+
+            first_ref: Dict[str, str] = {}
+            for it in pending:
+                hit = next((existing[s] for s in it["doc_sha256"] if s in existing), None)
+                prev = next((first_ref[s] for s in it["doc_sha256"] if s in first_ref), None)
+                if hit:
+                    it.update(status="duplicate", duplicate_of_case_id=hit)
+                elif prev:
+                    it.update(status="duplicate", duplicate_of_ref=prev, error=f"Documento repetido en el lote (ref {prev})")
+                else:
+                    for s in it["doc_sha256"]:
+                        first_ref[s] = it["ref"]
+
+            return _create_batch(conn, partner["id"], items)
+
+    batch_id = await asyncio.to_thread(_prepare)
+
+    sem = asyncio.Semaphore(_concurrency())
+
+    async def _run(it: Dict[str, Any]) -> None:
+        async with sem:
+            await asyncio.to_thread(_ingest_item, batch_id, partner, it, sources)
+
+    await asyncio.gather(*[_run(it) for it in items if it["status"] == "pending"])
+    await asyncio.to_thread(_finish_batch, batch_id)
+
+    if worker_enabled():
+        wake_scheduler()
+    elif _created_count(items):
+        # Sin hilo de fondo: se arranca ya un lote (respetando los límites por clase) y
+        # el resto lo recoge el cron en POST /ops/automation/tick
+        threading.Thread(target=_kick_analysis, name="partner-batch-analysis", daemon=True).start()
+
+    counts = {s: sum(1 for it in items if it["status"] == s) for s in ("created", "duplicate", "failed")}
+    return {
+        "ok": True,
+        "batch_id": batch_id,
+        "total": len(items),
+        **counts,
+        "items": [_item_out(it) for it in items],
+    }
+
+
+@router.get("/{batch_id}")
+def get_partner_batch(
+    batch_id: str,
+    authorization: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    token = _require_partner_token(authorization)
+    engine = get_engine()
+    with engine.begin() as conn:
+        partner = _get_partner_by_token(conn, token)
+        batch = conn.execute(
+            text(
+                """
+                SELECT id, status, total, created, duplicates, failed, created_at, finished_at
+                FROM partner_batches
+                WHERE id = :bid AND partner_id = :pid
+                """
+            ),
+            {"bid": batch_id, "pid": partner["id"]},
+        ).fetchone()
+        if not batch:
+            raise HTTPException(status_code=404, detail="Lote no encontrado")
+
+        rows = conn.execute(
+            text(
+                """
+                SELECT i.idx, i.ref, i.status, i.case_id, i.duplicate_of_case_id, i.error, i.documents,
+                       w.status AS analysis_status, w.last_error
+                FROM partner_batch_items i
+                LEFT JOIN LATERAL (
+                    SELECT status, last_error FROM work_queue
+                    WHERE case_id = i.case_id AND kind = 'analysis'
+                    ORDER BY enqueued_at DESC
+                    LIMIT 1
+                ) w ON TRUE
+                WHERE i.batch_id = :bid
+                ORDER BY i.idx
+                """
+            ),
+            {"bid": batch_id},
+        ).fetchall()
+
+    items = []
+    for r in rows:
+        item = {
+            "idx": int(r[0]),
+            "ref": r[1],
+            "status": r[2],
+            "case_id": str(r[3]) if r[3] else None,
+            "duplicate_of_case_id": str(r[4]) if r[4] else None,
+            "error": r[5],
+            "documents": r[6] or [],
+        }
+        if r[3]:
+            item["analysis"] = {"status": r[7] or "unknown", "error": r[8]}
+        items.append(item)
+
+    return {
+        "ok": True,
+        "batch_id": str(batch[0]),
+        "status": batch[1],
+        "total": int(batch[2] or 0),
+        "created": int(batch[3] or 0),
+        "duplicates": int(batch[4] or 0),
+        "failed": int(batch[5] or 0),
+        "created_at": str(batch[6]),
+        "finished_at": str(batch[7]) if batch[7] else None,
+        "items": items,
+    }
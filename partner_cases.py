@@ -7,6 +7,7 @@ from pydantic import EmailStr
 from sqlalchemy import text
 
 from database import get_engine
+from auth_cache import partner_by_token
 from b2_storage import upload_bytes
 
 router = APIRouter(prefix="/partner", tags=["partner"])
@@ -25,15 +26,8 @@ def _require_partner_token(authorization: Optional[str]) -> str:
     return parts[1].strip()
 
 def _get_partner_by_token(conn, token: str) -> Dict[str, Any]:
-    row = conn.execute(
-        text("SELECT id, name, email, active FROM partners WHERE api_token=:t"),
-        {"t": token},
-    ).fetchone()
-    if not row:
-        raise HTTPException(status_code=401, detail="Token partner inválido")
-    if not bool(row[3]):
-        raise HTTPException(status_code=403, detail="Partner desactivado")
-    return {"id": str(row[0]), "name": row[1], "email": row[2]}
+    # Caché positiva en proceso (auth_cache); conn solo se usa si no está
+    return partner_by_token(conn, token)
 
 def _event(conn, case_id: str, typ: str, payload: Dict[str, Any]) -> None:
     conn.execute(
@@ -0,0 +1,181 @@
+# passwords.py — hash de contraseñas fuera del threadpool y límite de intentos de login
+#
+# - Formato autodescriptivo en password_hash: "<esquema>$<parámetros>$<salt>$<digest>".
+#   Esquema actual: scrypt (memory-hard, stdlib). Los hashes antiguos (hex PBKDF2-SHA256
+#   de 120.000 iteraciones con la sal en password_salt) se siguen verificando y se
+#   re-hashean al esquema actual en el primer login correcto.
+# - El cálculo va al pool de procesos (cpu_pool) y como mucho PASSWORD_HASH_CONCURRENCY
+#   a la vez; si no hay hueco en PASSWORD_QUEUE_TIMEOUT_SECONDS se responde 503.
+# - Antes de hashear se aplica el límite de intentos: por IP (LOGIN_MAX_PER_IP_PER_MINUTE)
+#   y fallos por email (LOGIN_MAX_FAILS_PER_EMAIL en LOGIN_EMAIL_WINDOW_MINUTES). Un
+#   intento rechazado no gasta CPU. Contadores en proceso (por worker). La IP sale de
+#   request_ip.client_ip (hop del proxy, no lo que mande el cliente en X-Forwarded-For).
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from fastapi import HTTPException
+
+from cpu_pool import run_cpu
+
+LEGACY_PBKDF2_ITERATIONS = 120_000
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+SCRYPT_N = _env_int("PASSWORD_SCRYPT_N", 2 ** 14)
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+_slots = threading.BoundedSemaphore(max(1, _env_int("PASSWORD_HASH_CONCURRENCY", 2)))
+QUEUE_TIMEOUT_SECONDS = _env_int("PASSWORD_QUEUE_TIMEOUT_SECONDS", 5)
+
+
+# =========================================================
+# HASH / VERIFICACIÓN
+# =========================================================
+def _derive(scheme: str, password: str, salt: str, params: Dict[str, int]) -> str:
+    """Se ejecuta en el pool de procesos: solo tipos serializables."""
+    if scheme == "scrypt":
+        return hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=salt.encode("utf-8"),
+            n=params["n"],
+            r=params["r"],
+            p=params["p"],
+            # scrypt usa 128 * n * r bytes (16 MB con los valores por defecto)
+            maxmem=128 * params["n"] * params["r"] * 2,
+            dklen=32,
+        ).hex()
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), params["i"]).hex()
+    raise ValueError(f"Esquema de contraseña desconocido: {scheme}")
+
+
+def _current() -> Tuple[str, Dict[str, int]]:
+    return "scrypt", {"n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P}
+
+
+def _encode(scheme: str, params: Dict[str, int], salt: str, digest: str) -> str:
+    p = ",".join(f"{k}={v}" for k, v in params.items())
+    return f"{scheme}${p}${salt}${digest}"
+
+
+def _parse(stored: str, legacy_salt: str) -> Tuple[str, Dict[str, int], str, str]:
+    parts = (stored or "").split("$")
+    if len(parts) == 4:
+        scheme, p, salt, digest = parts
+        params = {k: int(v) for k, v in (kv.split("=", 1) for kv in p.split(",") if kv)}
+        return scheme, params, salt, digest
+    # Formato antiguo: hex PBKDF2 con la sal en password_salt
+    return "pbkdf2_sha256", {"i": LEGACY_PBKDF2_ITERATIONS}, legacy_salt or "", stored or ""
+
+
+def _limited(scheme: str, password: str, salt: str, params: Dict[str, int]) -> str:
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT_SECONDS):
+        raise HTTPException(status_code=503, detail="Servidor ocupado, inténtalo de nuevo en unos segundos.")
+    try:
+        return run_cpu(_derive, scheme, password, salt, params)
+    finally:
+        _slots.release()
+
+
+def needs_rehash(stored: str) -> bool:
+    scheme, params, _, _ = _parse(stored, "")
+    return (scheme, params) != _current()
+
+
+def hash_password(password: str) -> Tuple[str, str]:
+    """(password_hash, password_salt) con el esquema actual."""
+    scheme, params = _current()
+    salt = secrets.token_hex(16)
+    return _encode(scheme, params, salt, _limited(scheme, password, salt, params)), salt
+
+
+def verify_password(password: str, stored: str, legacy_salt: str) -> Tuple[bool, bool]:
+    """(ok, hay_que_rehashear)."""
+    scheme, params, salt, digest = _parse(stored, legacy_salt)
+    if not digest:
+        return False, False
+    ok = hmac.compare_digest(_limited(scheme, password, salt, params), digest)
+    return ok, ok and needs_rehash(stored)
+
+
+async def hash_password_async(password: str) -> Tuple[str, str]:
+    return await asyncio.to_thread(hash_password, password)
+
+
+async def verify_password_async(password: str, stored: str, legacy_salt: str) -> Tuple[bool, bool]:
+    return await asyncio.to_thread(verify_password, password, stored, legacy_salt)
+
+
+# =========================================================
+# LÍMITE DE INTENTOS
+# =========================================================
+_windows: Dict[str, Deque[float]] = {}
+_windows_lock = threading.Lock()
+_MAX_KEYS = 20_000
+
+
+def _count(key: str, window_seconds: float, now: float) -> int:
+    q = _windows.get(key)
+    if not q:
+        return 0
+    while q and q[0] <= now - window_seconds:
+        q.popleft()
+    if not q:
+        del _windows[key]
+        return 0
+    return len(q)
+
+
+def _push(key: str, now: float) -> None:
+    if len(_windows) >= _MAX_KEYS:
+        # Barrido de claves sin actividad reciente (ventana más larga: la de email)
+        horizon = now - _env_int("LOGIN_EMAIL_WINDOW_MINUTES", 15) * 60
+        for k in [k for k, q in _windows.items() if not q or q[-1] <= horizon]:
+            del _windows[k]
+    _windows.setdefault(key, deque()).append(now)
+
+
+def _too_many(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Demasiados intentos. Espera un poco antes de volver a intentarlo.",
+        headers={"Retry-After": str(max(1, retry_after))},
+    )
+
+
+def check_login_allowed(ip: str, email: str) -> None:
+    """Registra el intento de la IP y corta (429) antes de gastar CPU en el hash."""
+    now = time.monotonic()
+    email_window = _env_int("LOGIN_EMAIL_WINDOW_MINUTES", 15) * 60
+    with _windows_lock:
+        if _count(f"fail:{email}", email_window, now) >= _env_int("LOGIN_MAX_FAILS_PER_EMAIL", 5):
+            raise _too_many(int(_windows[f"fail:{email}"][0] + email_window - now))
+        if ip:
+            if _count(f"ip:{ip}", 60, now) >= _env_int("LOGIN_MAX_PER_IP_PER_MINUTE", 20):
+                raise _too_many(int(_windows[f"ip:{ip}"][0] + 60 - now))
+            _push(f"ip:{ip}", now)
+
+
+def record_login_failure(email: str) -> None:
+    with _windows_lock:
+        _push(f"fail:{email}", time.monotonic())
+
+
+def clear_login_failures(email: str) -> None:
+    with _windows_lock:
+        _windows.pop(f"fail:{email}", None)
+
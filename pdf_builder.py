@@ -1,11 +1,6 @@
 import io
 import html
 import re
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.enums import TA_LEFT, TA_CENTER
 
 SECTION_TITLES = {
     "ANTECEDENTES",
@@ -41,6 +36,13 @@ def _is_section_heading(line: str) -> bool:
     return False
 
 def build_pdf(title: str, body: str) -> bytes:
+    # reportlab se importa al generar (no al arrancar): acelera el cold start
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.enums import TA_LEFT, TA_CENTER
+
     buffer = io.BytesIO()
 
     doc = SimpleDocTemplate(
@@ -0,0 +1,280 @@
+# profiling.py
+# Perfilado por petición de las funciones calientes (triage de /analyze, generación).
+#
+# - Opt-in: cabecera X-Profile: 1 (con X-Operator-Token válido) o muestreo aleatorio
+#   con PROFILE_SAMPLE_RATE (p. ej. 0.01 = 1 %). Sin perfil activo, @profiled solo
+#   cuesta leer una contextvar.
+# - Es un profiler por muestreo: un hilo auxiliar lee la pila del hilo que ejecuta la
+#   función cada PROFILE_INTERVAL_MS y acumula pilas "plegadas" (a;b;c N), el formato
+#   que aceptan flamegraph.pl, speedscope o inferno.
+# - Los perfiles se guardan en un buffer circular en memoria (PROFILE_RING_SIZE) y se
+#   consultan en GET /admin/profiles (x-admin-token).
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(_env(name) or default)
+    except ValueError:
+        return default
+
+
+SAMPLE_RATE = _env_float("PROFILE_SAMPLE_RATE", 0.0)
+INTERVAL_SECONDS = _env_float("PROFILE_INTERVAL_MS", 5.0) / 1000.0
+RING_SIZE = int(_env_float("PROFILE_RING_SIZE", 50))
+MAX_STACK_DEPTH = 64
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, reason: str) -> None:
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.created_at = time.time()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.cpu_seconds: Dict[str, float] = {}
+        self.wall_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def merge(self, name: str, stacks: Counter, samples: int, cpu: float, wall: float) -> None:
+        with self._lock:
+            self.stacks.update(stacks)
+            self.samples += samples
+            self.cpu_seconds[name] = self.cpu_seconds.get(name, 0.0) + cpu
+            self.wall_seconds[name] = self.wall_seconds.get(name, 0.0) + wall
+
+    def folded(self) -> str:
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "id": self.id,
+                "method": self.method,
+                "path": self.path,
+                "reason": self.reason,
+                "created_at": self.created_at,
+                "samples": self.samples,
+                "interval_ms": round(INTERVAL_SECONDS * 1000, 2),
+                "cpu_seconds": {k: round(v, 4) for k, v in self.cpu_seconds.items()},
+                "wall_seconds": {k: round(v, 4) for k, v in self.wall_seconds.items()},
+            }
+
+    def top_functions(self, limit: int = 30) -> List[Dict[str, Any]]:
+        """Muestras propias (self) e inclusivas por función, a partir de las pilas."""
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        with self._lock:
+            items = list(self.stacks.items())
+        for stack, count in items:
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = max(self.samples, 1)
+        return [
+            {
+                "function": fn,
+                "self_samples": own.get(fn, 0),
+                "inclusive_samples": inclusive[fn],
+                "inclusive_pct": round(100.0 * inclusive[fn] / total, 1),
+            }
+            for fn, _ in inclusive.most_common(limit)
+        ]
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("rtm_profile", default=None)
+_ring: deque = deque(maxlen=max(RING_SIZE, 1))
+_ring_lock = threading.Lock()
+_active_threads: set = set()
+
+
+# =========================================================
+# MUESTREO
+# =========================================================
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{code.co_name}:{frame.f_lineno}" if module == "__main__" else f"{module}.{code.co_name}"
+
+
+def _fold(frame, stop_frame, root_label: str) -> str:
+    parts: List[str] = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        if frame is stop_frame:
+            parts.append(root_label)
+            break
+        parts.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, target_thread_id: int, root_frame, root_label: str) -> None:
+        super().__init__(name="rtm-profiler", daemon=True)
+        self.target = target_thread_id
+        self.root = root_frame
+        self.root_label = root_label
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(INTERVAL_SECONDS):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            self.stacks[_fold(frame, self.root, self.root_label)] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=1.0)
+
+
+def profile_active() -> bool:
+    """True si la petición actual se está perfilando (ver cpu_pool.run_cpu)."""
+    return _current.get() is not None
+
+
+def profiled(name: str) -> Callable:
+    """
+    Perfila la función si la petición actual tiene un perfil activo.
+    Llamadas anidadas a funciones @profiled en el mismo hilo comparten muestreador.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            tid = threading.get_ident()
+            if profile is None or tid in _active_threads:
+                return fn(*args, **kwargs)
+
+            _active_threads.add(tid)
+            sampler = _Sampler(tid, sys._getframe(), name)
+            cpu0, wall0 = time.thread_time(), time.perf_counter()
+            sampler.start()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                cpu, wall = time.thread_time() - cpu0, time.perf_counter() - wall0
+                sampler.stop()
+                _active_threads.discard(tid)
+                profile.merge(name, sampler.stacks, sampler.samples, cpu, wall)
+
+        return wrapper
+
+    return decorator
+
+
+# =========================================================
+# MIDDLEWARE
+# =========================================================
+def _header(scope, name: bytes) -> str:
+    for k, v in scope.get("headers") or []:
+        if k.lower() == name:
+            return v.decode("latin-1")
+    return ""
+
+
+def _profile_reason(scope) -> Optional[str]:
+    if _header(scope, b"x-profile") in ("1", "true"):
+        expected = _env("OPERATOR_TOKEN")
+        if expected and _header(scope, b"x-operator-token").strip() == expected:
+            return "header"
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    """ASGI: activa el perfil de la petición (cabecera o muestreo) y lo guarda al acabar."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        reason = _profile_reason(scope) if scope.get("type") == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get("method", ""), scope.get("path", ""), reason)
+        token = _current.set(profile)
+
+        async def _send(message):
+            if message.get("type") == "http.response.start":
+                message = {**message, "headers": list(message.get("headers") or []) + [(b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _current.reset(token)
+            if profile.samples:
+                with _ring_lock:
+                    _ring.append(profile)
+
+
+# =========================================================
+# ADMIN
+# =========================================================
+router = APIRouter(prefix="/admin/profiles", tags=["admin-profiles"])
+
+
+def _require_admin_token(x_admin_token: Optional[str]) -> None:
+    expected = _env("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=500, detail="ADMIN_TOKEN no está configurado en el backend.")
+    if not x_admin_token or x_admin_token.strip() != expected:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+def _find(profile_id: str) -> RequestProfile:
+    with _ring_lock:
+        for p in _ring:
+            if p.id == profile_id:
+                return p
+    raise HTTPException(status_code=404, detail="Perfil no encontrado")
+
+
+@router.get("")
+def list_profiles(x_admin_token: Optional[str] = Header(default=None, alias="x-admin-token")):
+    _require_admin_token(x_admin_token)
+    with _ring_lock:
+        profiles = list(_ring)
+    return {"ok": True, "sample_rate": SAMPLE_RATE, "profiles": [p.summary() for p in reversed(profiles)]}
+
+
+@router.get("/{profile_id}")
+def get_profile(
+    profile_id: str,
+    format: str = Query("json", pattern="^(json|folded)$"),
+    x_admin_token: Optional[str] = Header(default=None, alias="x-admin-token"),
+):
+    """format=folded devuelve pilas plegadas (flamegraph.pl / speedscope)."""
+    _require_admin_token(x_admin_token)
+    profile = _find(profile_id)
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return {"ok": True, **profile.summary(), "top_functions": profile.top_functions()}
@@ -0,0 +1,26 @@
+# request_ip.py — IP del cliente detrás del proxy de Render
+#
+# X-Forwarded-For lo puede mandar el propio cliente: solo valen las entradas que añaden
+# nuestros proxies, que van al final. Con TRUSTED_PROXY_HOPS=1 (Render) la IP real es la
+# última; si hay otro proxy delante (p. ej. Cloudflare) se sube a 2. X-Real-IP no se
+# mira por el mismo motivo. Sin cabecera, la IP de la conexión.
+import os
+
+from fastapi import Request
+
+
+def _trusted_hops() -> int:
+    try:
+        return max(0, int((os.getenv("TRUSTED_PROXY_HOPS") or "1").strip()))
+    except ValueError:
+        return 1
+
+
+def client_ip(request: Request) -> str:
+    hops = _trusted_hops()
+    forwarded = [p.strip() for p in (request.headers.get("x-forwarded-for") or "").split(",") if p.strip()]
+    if hops and forwarded:
+        return forwarded[-min(hops, len(forwarded))]
+    if request.client:
+        return request.client.host or ""
+    return ""
@@ -0,0 +1,154 @@
+# startup.py
+# Medición del arranque (cold start en Render) y warm-up en segundo plano.
+#
+# - import_router() importa cada router midiendo cuánto tarda (incluye las dependencias
+#   que ese módulo arrastra por primera vez) y cuántos módulos nuevos carga.
+# - mark_ready() compara el total con STARTUP_BUDGET_SECONDS y avisa en el log con los
+#   imports más lentos. El informe se consulta en GET /health/startup.
+# - start_warmup() lanza un hilo que, ya con el puerto abierto, crea el engine y el
+#   pool de BD, el cliente S3 y el de OpenAI, asegura las particiones de events e
+#   importa las librerías pesadas que se cargan de forma perezosa (reportlab,
+#   python-docx, pypdf, stripe).
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STARTED = time.monotonic()
+_imports: List[Dict[str, Any]] = []
+_skipped: List[str] = []
+_warmup: List[Dict[str, Any]] = []
+_ready_seconds: Optional[float] = None
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    raw = _env(name)
+    if not raw:
+        return default
+    return raw.lower() in ("1", "true", "yes", "si", "sí")
+
+
+def router_enabled(group: str) -> bool:
+    """Grupos opcionales: debug (ENABLE_DEBUG_ROUTERS) y lab (ENABLE_LAB_ROUTERS)."""
+    if group == "debug":
+        return _env_bool("ENABLE_DEBUG_ROUTERS", True)
+    if group == "lab":
+        return _env_bool("ENABLE_LAB_ROUTERS", True)
+    return True
+
+
+def import_router(module_name: str, group: str = "core", attr: str = "router"):
+    """Importa module_name.router midiendo el tiempo; None si el grupo está desactivado."""
+    if not router_enabled(group):
+        _skipped.append(module_name)
+        return None
+    before = len(sys.modules)
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _imports.append(
+        {
+            "module": module_name,
+            "group": group,
+            "seconds": round(time.perf_counter() - started, 4),
+            "new_modules": len(sys.modules) - before,
+        }
+    )
+    return getattr(module, attr)
+
+
+def mark_ready() -> None:
+    global _ready_seconds
+    _ready_seconds = time.monotonic() - _STARTED
+    budget = float(_env("STARTUP_BUDGET_SECONDS", "8") or 8)
+    if _ready_seconds > budget:
+        slowest = sorted(_imports, key=lambda x: -x["seconds"])[:5]
+        logger.warning(
+            "Arranque en %.2fs (presupuesto %.2fs). Imports más lentos: %s",
+            _ready_seconds,
+            budget,
+            ", ".join(f'{i["module"]}={i["seconds"]}s' for i in slowest),
+        )
+
+
+def report() -> Dict[str, Any]:
+    return {
+        "ready_seconds": round(_ready_seconds, 3) if _ready_seconds is not None else None,
+        "budget_seconds": float(_env("STARTUP_BUDGET_SECONDS", "8") or 8),
+        "imports_seconds": round(sum(i["seconds"] for i in _imports), 3),
+        "imports": sorted(_imports, key=lambda x: -x["seconds"]),
+        "skipped_routers": list(_skipped),
+        "warmup": list(_warmup),
+        "modules_loaded": len(sys.modules),
+    }
+
+
+# =========================================================
+# WARM-UP
+# =========================================================
+def _step(name: str, fn: Callable[[], Any]) -> None:
+    started = time.perf_counter()
+    try:
+        fn()
+        ok, error = True, None
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+    _warmup.append({"step": name, "ok": ok, "seconds": round(time.perf_counter() - started, 4), "error": error})
+
+
+def _warm_db() -> None:
+    from database import get_engine, ping_db
+
+    ping_db(get_engine())
+
+
+def _warm_s3() -> None:
+    from b2_storage import get_s3_client
+
+    get_s3_client()
+
+
+def _warm_openai() -> None:
+    if not _env("OPENAI_API_KEY"):
+        return
+    from llm_client import get_openai_client
+
+    get_openai_client()
+
+
+def _warm_event_partitions() -> None:
+    # Particiones mensuales de events por adelantado (no-op si no está particionada)
+    from event_partitions import ensure_partitions
+
+    ensure_partitions()
+
+
+def _warm_libs() -> None:
+    for name in ("reportlab.platypus", "docx", "pypdf", "stripe"):
+        importlib.import_module(name)
+
+
+def _warmup_loop() -> None:
+    # Margen para que uvicorn abra el puerto antes de cargar nada
+    time.sleep(float(_env("WARMUP_DELAY_SECONDS", "1") or 1))
+    _step("db_pool", _warm_db)
+    _step("s3_client", _warm_s3)
+    _step("openai_client", _warm_openai)
+    _step("event_partitions", _warm_event_partitions)
+    _step("heavy_libs", _warm_libs)
+
+
+def start_warmup() -> bool:
+    """Lanza el warm-up en segundo plano (WARMUP_ENABLED=false para desactivarlo)."""
+    if not _env_bool("WARMUP_ENABLED", True):
+        return False
+    threading.Thread(target=_warmup_loop, name="startup-warmup", daemon=True).start()
+    return True
@@ -4,6 +4,7 @@ from typing import Any, Dict
 
 from sqlalchemy import text
 
+from ai_runs import expand_raw_result
 from destination_resolver import resolve_destination
 from .registro import RegistroSubmitter
 from .dgt import DGTSubmitter
@@ -15,7 +16,7 @@ def _build_case_data(engine, case_id: str) -> Dict[str, Any]:
     Mezcla:
       - cases.interested_data
       - cases.organismo / expediente_ref / contact_email
-      - último ai_expediente_result.payload.raw_result (si existe)
+      - resultado IA completo del último ai_expediente_result (raw_result o ai_runs)
     """
     case_data: Dict[str, Any] = {}
 
@@ -61,7 +62,8 @@ def _build_case_data(engine, case_id: str) -> Dict[str, Any]:
 
         if ev and isinstance(ev[0], dict):
             payload = ev[0]
-            raw_result = payload.get("raw_result") if isinstance(payload.get("raw_result"), dict) else {}
+            # raw_result embebido (eventos antiguos) o el de ai_runs (carga bajo demanda)
+            raw_result = expand_raw_result(conn, payload)
             delivery = payload.get("delivery") if isinstance(payload.get("delivery"), dict) else {}
 
             case_data.update(raw_result or {})
@@ -0,0 +1,354 @@
+# telemetry.py
+# Telemetría de latencia y coste: LLM, B2 y SQL, por petición, por caso y por stage.
+#
+# - TelemetryMiddleware abre una traza por petición (contextvar) y mide el endpoint.
+# - span(kind, name, ...) mide un tramo y lo suma a la traza actual y a las métricas
+#   del proceso (duración, bytes, tokens y coste estimado).
+# - Al cerrar la petición, si la traza tiene case_id, se escribe un evento
+#   request_telemetry con el resumen (vía event_log.emit_async, sin bloquear).
+# - prometheus_text() expone p50/p95/p99 por stage en formato Prometheus (GET /metrics).
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# =========================================================
+# PRECIOS (USD por millón de tokens: entrada, entrada cacheada, salida)
+# =========================================================
+_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+
+def estimate_cost_usd(model: str, prompt_tokens: int, cached_tokens: int = 0, completion_tokens: int = 0) -> float:
+    price = _PRICES.get(model)
+    if price is None:
+        # Modelos con sufijo de fecha (gpt-4o-2024-08-06) → precio del modelo base
+        price = next((p for m, p in sorted(_PRICES.items(), key=lambda x: -len(x[0])) if model.startswith(m)), None)
+    if price is None:
+        return 0.0
+    p_in, p_cached, p_out = price
+    uncached = max(int(prompt_tokens or 0) - int(cached_tokens or 0), 0)
+    return (uncached * p_in + int(cached_tokens or 0) * p_cached + int(completion_tokens or 0) * p_out) / 1_000_000
+
+
+# =========================================================
+# MÉTRICAS DEL PROCESO
+# =========================================================
+_RESERVOIR_SIZE = 2048
+_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Metric:
+    __slots__ = ("samples", "count", "total", "bytes", "tokens", "cost_usd", "errors")
+
+    def __init__(self) -> None:
+        self.samples: deque = deque(maxlen=_RESERVOIR_SIZE)
+        self.count = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.tokens = 0
+        self.cost_usd = 0.0
+        self.errors = 0
+
+
+_metrics: Dict[Tuple[str, str], _Metric] = {}
+_metrics_lock = threading.Lock()
+
+
+def _observe(kind: str, name: str, seconds: float, nbytes: int, tokens: int, cost: float, error: bool) -> None:
+    with _metrics_lock:
+        m = _metrics.get((kind, name))
+        if m is None:
+            m = _metrics[(kind, name)] = _Metric()
+        m.samples.append(seconds)
+        m.count += 1
+        m.total += seconds
+        m.bytes += nbytes
+        m.tokens += tokens
+        m.cost_usd += cost
+        if error:
+            m.errors += 1
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    with _metrics_lock:
+        items = [(k, list(m.samples), m.count, m.total, m.bytes, m.tokens, m.cost_usd, m.errors) for k, m in _metrics.items()]
+
+    lines = [
+        "# HELP rtm_stage_duration_seconds Duración por stage (ventana de las últimas muestras).",
+        "# TYPE rtm_stage_duration_seconds summary",
+    ]
+    for (kind, name), samples, count, total, *_ in sorted(items):
+        labels = f'kind="{_label(kind)}",name="{_label(name)}"'
+        ordered = sorted(samples)
+        for q in _QUANTILES:
+            lines.append(f'rtm_stage_duration_seconds{{{labels},quantile="{q}"}} {_quantile(ordered, q):.6f}')
+        lines.append(f"rtm_stage_duration_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"rtm_stage_duration_seconds_count{{{labels}}} {count}")
+
+    for metric, idx, help_text in (
+        ("rtm_stage_bytes_total", 4, "Bytes transferidos por stage."),
+        ("rtm_stage_tokens_total", 5, "Tokens LLM por stage."),
+        ("rtm_stage_cost_usd_total", 6, "Coste LLM estimado (USD) por stage."),
+        ("rtm_stage_errors_total", 7, "Errores por stage."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for row in sorted(items):
+            (kind, name), value = row[0], row[idx]
+            if value:
+                lines.append(f'{metric}{{kind="{_label(kind)}",name="{_label(name)}"}} {value}')
+
+    return "\n".join(lines) + "\n"
+
+
+# =========================================================
+# TRAZA POR PETICIÓN
+# =========================================================
+class Trace:
+    def __init__(self, endpoint: str) -> None:
+        self.request_id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.case_id: Optional[str] = None
+        self.started = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, span: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self.spans) < 500:
+                self.spans.append(span)
+
+    def add_sql(self, seconds: float) -> None:
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        by_kind: Dict[str, Dict[str, Any]] = {}
+        for s in spans:
+            agg = by_kind.setdefault(s["kind"], {"count": 0, "ms": 0.0, "bytes": 0, "tokens": 0, "cost_usd": 0.0})
+            agg["count"] += 1
+            agg["ms"] += s["ms"]
+            agg["bytes"] += s.get("bytes") or 0
+            agg["tokens"] += s.get("tokens") or 0
+            agg["cost_usd"] += s.get("cost_usd") or 0.0
+        for agg in by_kind.values():
+            agg["ms"] = round(agg["ms"], 1)
+            agg["cost_usd"] = round(agg["cost_usd"], 6)
+        by_kind["sql"] = {"count": self.sql_count, "ms": round(self.sql_seconds * 1000, 1)}
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "total_ms": round((time.monotonic() - self.started) * 1000, 1),
+            "by_kind": by_kind,
+            "spans": [
+                {k: v for k, v in s.items() if v not in (None, 0, 0.0)}
+                for s in spans
+                if s["kind"] != "b2" or s["ms"] >= 50
+            ][:100],
+        }
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("rtm_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def set_trace_case(case_id: Any) -> None:
+    """Asocia la petición en curso a un caso (para el evento de resumen)."""
+    trace = _current.get()
+    if trace is not None and case_id and not trace.case_id:
+        trace.case_id = str(case_id)
+
+
+class Span:
+    __slots__ = ("bytes", "tokens", "cost_usd", "model", "error")
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.tokens = 0
+        self.cost_usd = 0.0
+        self.model: Optional[str] = None
+        self.error = False
+
+    def llm_usage(self, model: str, prompt_tokens: int, cached_tokens: int = 0, completion_tokens: int = 0) -> None:
+        self.model = model
+        self.tokens = int(prompt_tokens or 0) + int(completion_tokens or 0)
+        self.cost_usd = estimate_cost_usd(model, prompt_tokens, cached_tokens, completion_tokens)
+
+
+def record(kind: str, name: str, seconds: float, *, nbytes: int = 0, tokens: int = 0,
+           cost_usd: float = 0.0, model: Optional[str] = None, error: bool = False) -> None:
+    _observe(kind, name, seconds, nbytes, tokens, cost_usd, error)
+    trace = _current.get()
+    if trace is not None:
+        trace.add(
+            {
+                "kind": kind,
+                "name": name,
+                "ms": round(seconds * 1000, 1),
+                "bytes": nbytes,
+                "tokens": tokens,
+                "cost_usd": round(cost_usd, 6),
+                "model": model,
+                "error": error,
+            }
+        )
+
+
+@contextmanager
+def span(kind: str, name: str) -> Iterator[Span]:
+    """Mide un tramo (kind: llm | b2 | stage | ...) y lo registra al salir."""
+    s = Span()
+    started = time.monotonic()
+    try:
+        yield s
+    except BaseException:
+        s.error = True
+        raise
+    finally:
+        record(
+            kind,
+            name,
+            time.monotonic() - started,
+            nbytes=s.bytes,
+            tokens=s.tokens,
+            cost_usd=s.cost_usd,
+            model=s.model,
+            error=s.error,
+        )
+
+
+# =========================================================
+# SQL (listeners de SQLAlchemy)
+# =========================================================
+def instrument_engine(engine) -> None:
+    """Mide cada sentencia SQL (agregado por verbo) y la suma a la traza actual."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("rtm_sql_started", []).append(time.monotonic())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("rtm_sql_started")
+        if not stack:
+            return
+        seconds = time.monotonic() - stack.pop()
+        verb = (statement.lstrip().split(None, 1) or ["?"])[0].upper()
+        _observe("sql", verb, seconds, 0, 0, 0.0, False)
+        trace = _current.get()
+        if trace is not None:
+            trace.add_sql(seconds)
+
+
+# =========================================================
+# B2 (hooks de botocore)
+# =========================================================
+def instrument_s3_client(client) -> None:
+    """Mide cada operación S3/B2 (PutObject, GetObject, ...) con los bytes transferidos."""
+
+    def _before(params=None, context=None, **kwargs):
+        if context is not None:
+            context["rtm_started"] = time.monotonic()
+            body = (params or {}).get("body")
+            context["rtm_bytes"] = len(body) if isinstance(body, (bytes, bytearray)) else 0
+
+    def _after(http_response=None, parsed=None, model=None, context=None, **kwargs):
+        if context is None or "rtm_started" not in context:
+            return
+        seconds = time.monotonic() - context["rtm_started"]
+        nbytes = context.get("rtm_bytes") or 0
+        if not nbytes and isinstance(parsed, dict):
+            nbytes = int(parsed.get("ContentLength") or 0)
+        status = getattr(http_response, "status_code", 200) or 200
+        record("b2", getattr(model, "name", "s3"), seconds, nbytes=nbytes, error=status >= 400)
+
+    client.meta.events.register("before-call.s3", _before)
+    client.meta.events.register("after-call.s3", _after)
+
+
+# =========================================================
+# MIDDLEWARE
+# =========================================================
+def _emit_case_summary(trace: Trace) -> None:
+    if not trace.case_id:
+        return
+    try:
+        from event_log import emit_async
+
+        emit_async(trace.case_id, "request_telemetry", trace.summary())
+    except Exception:
+        pass
+
+
+class TelemetryMiddleware:
+    """ASGI: traza por petición + métrica por endpoint (plantilla de ruta, no la URL)."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope.get("path") or "")
+        token = _current.set(trace)
+        status = {"code": 500}
+
+        async def _send(message):
+            if message.get("type") == "http.response.start":
+                status["code"] = message.get("status", 500)
+                headers = list(message.get("headers") or [])
+                headers.append((b"x-request-id", trace.request_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            # Plantilla de ruta (/cases/{case_id}) para no disparar la cardinalidad
+            trace.endpoint = f'{scope.get("method", "")} {getattr(route, "path", None) or "unmatched"}'
+            _observe(
+                "endpoint",
+                trace.endpoint,
+                time.monotonic() - trace.started,
+                0,
+                0,
+                0.0,
+                status["code"] >= 500,
+            )
+            _current.reset(token)
+            _emit_case_summary(trace)
+
+
+def metrics_authorized(token: Optional[str]) -> bool:
+    """GET /metrics siempre con token: METRICS_TOKEN o, si no hay, OPERATOR_TOKEN."""
+    expected = (os.getenv("METRICS_TOKEN") or os.getenv("OPERATOR_TOKEN") or "").strip()
+    return bool(expected) and (token or "").strip() == expected
@@ -2,8 +2,6 @@ import io
 import re
 from typing import Optional
 
-from pypdf import PdfReader
-from docx import Document
 
 
 _ADMIN_LINE_STARTS = [
@@ -99,6 +97,8 @@ def _normalize_text(t: str) -> str:
 
 
 def extract_text_from_pdf_bytes(content: bytes) -> str:
+    from pypdf import PdfReader
+
     reader = PdfReader(io.BytesIO(content))
     parts = []
     for page in reader.pages:
@@ -112,6 +112,8 @@ def extract_text_from_pdf_bytes(content: bytes) -> str:
 
 
 def extract_text_from_docx_bytes(content: bytes) -> str:
+    from docx import Document
+
     doc = Document(io.BytesIO(content))
     raw = "\n".join(p.text for p in doc.paragraphs)
     raw = normalize_ocr_text(raw)
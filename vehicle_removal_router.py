@@ -2,13 +2,17 @@ from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request
 from pydantic import BaseModel, EmailStr
 from sqlalchemy import text
 from database import get_engine
+from vehicle_removal_state import record_vehicle_removal_event
 from openai_vision import extract_from_image_bytes
+from openai_limiter import OpenAIBusy
 from text_extractors import extract_text_from_pdf_bytes, has_enough_text
+from cpu_pool import run_cpu_async
+from request_ip import client_ip
+import asyncio
 import os
 import json
 import re
 import hashlib
-import stripe
 
 router = APIRouter(prefix="/vehicle-removal", tags=["vehicle-removal"])
 
@@ -20,16 +24,12 @@ def _env(name: str) -> str:
     return value
 
 
-def _client_ip(request: Request) -> str:
-    forwarded = request.headers.get("x-forwarded-for") or ""
-    if forwarded:
-        return forwarded.split(",")[0].strip()
-    real_ip = request.headers.get("x-real-ip") or ""
-    if real_ip:
-        return real_ip.strip()
-    if request.client:
-        return request.client.host or ""
-    return ""
+def _stripe():
+    # stripe se importa en el primer pago (no al arrancar): acelera el cold start
+    import stripe
+
+    stripe.api_key = _env("STRIPE_SECRET_KEY")
+    return stripe
 
 
 def _sha256_bytes(data: bytes) -> str:
@@ -163,7 +163,7 @@ async def verify_registration(
 
         if mime == "application/pdf":
             try:
-                pdf_text = extract_text_from_pdf_bytes(content) or ""
+                pdf_text = await run_cpu_async(extract_text_from_pdf_bytes, content) or ""
             except Exception:
                 pdf_text = ""
 
@@ -171,11 +171,12 @@ async def verify_registration(
                 raw_text = pdf_text
                 extracted_payload = {"raw_text_pdf": pdf_text}
             else:
-                extracted_payload = extract_from_image_bytes(content, mime, filename) or {}
+                extracted_payload = await asyncio.to_thread(extract_from_image_bytes, content, mime, filename) or {}
                 raw_text = _extract_text_from_payload(extracted_payload)
 
         elif mime.startswith("image/"):
-            extracted_payload = extract_from_image_bytes(content, mime, filename) or {}
+            # OpenAI (bloqueante) en un hilo: el handler es async
+            extracted_payload = await asyncio.to_thread(extract_from_image_bytes, content, mime, filename) or {}
             raw_text = _extract_text_from_payload(extracted_payload)
         else:
             raise HTTPException(status_code=400, detail="Formato no soportado. Sube imagen o PDF.")
@@ -230,6 +231,8 @@ async def verify_registration(
 
     except HTTPException:
         raise
+    except OpenAIBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error verificando permiso de circulación: {e}")
 
@@ -240,7 +243,7 @@ def create_checkout_session(data: VehicleRemovalRequest, request: Request):
         if not data.authorization_accepted:
             raise HTTPException(status_code=400, detail="Debes aceptar la autorización para continuar.")
 
-        stripe.api_key = _env("STRIPE_SECRET_KEY")
+        stripe = _stripe()
         price_id = _env("STRIPE_PRICE_ID_ELIMINAR_COCHE")
 
         engine = get_engine()
@@ -250,7 +253,7 @@ def create_checkout_session(data: VehicleRemovalRequest, request: Request):
         phone_clean = data.phone.strip()
         plate_clean = _normalize_plate(data.plate)
         email_clean = str(data.email).strip()
-        ip = _client_ip(request)
+        ip = client_ip(request)
         user_agent = request.headers.get("user-agent", "")
 
         if not full_name:
@@ -375,17 +378,14 @@ def create_checkout_session(data: VehicleRemovalRequest, request: Request):
                 "authorization": authorization_snapshot,
             }
 
-            conn.execute(
-                text(
-                    """
-                    INSERT INTO events (case_id, type, payload, created_at)
-                    VALUES (:case_id, 'vehicle_removal_request_created', CAST(:payload AS JSONB), NOW())
-                    """
-                ),
-                {
-                    "case_id": case_id,
-                    "payload": json.dumps(payload, ensure_ascii=False),
-                },
+            record_vehicle_removal_event(
+                conn,
+                case_id,
+                "vehicle_removal_request_created",
+                payload,
+                status="vehicle_removal_pending_payment",
+                payment_status="pending",
+                contact_email=email_clean,
             )
 
             conn.execute(
@@ -0,0 +1,157 @@
+# vehicle_removal_state.py
+# Estado consolidado de las solicitudes "Eliminar coche".
+#
+# Cada evento vehicle_removal_* se sigue guardando en events (auditoría), pero además
+# se fusiona en una fila de vehicle_removal_requests. Así el listado OPS sale de una
+# sola consulta indexada en vez de re-leer y fusionar los eventos de cada caso.
+
+import json
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from event_log import append_event
+
+VEHICLE_REMOVAL_STATE_EVENTS = (
+    "vehicle_removal_request_created",
+    "vehicle_removal_request",
+    "vehicle_removal_paid",
+    "vehicle_removal_assigned",
+    "vehicle_removal_completed",
+)
+
+
+def upsert_vehicle_removal_state(
+    conn,
+    case_id: str,
+    payload: Optional[Dict[str, Any]] = None,
+    status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    contact_email: Optional[str] = None,
+) -> None:
+    """
+    Fusiona payload en vehicle_removal_requests.data (el último valor gana)
+    y actualiza status/payment_status si se indican.
+    """
+    conn.execute(
+        text(
+            """
+            INSERT INTO vehicle_removal_requests(
+                case_id, status, payment_status, contact_email, data, created_at, updated_at
+            )
+            VALUES (
+                :case_id, :status, :payment_status, :contact_email, CAST(:data AS JSONB), NOW(), NOW()
+            )
+            ON CONFLICT (case_id) DO UPDATE SET
+                status = COALESCE(EXCLUDED.status, vehicle_removal_requests.status),
+                payment_status = COALESCE(EXCLUDED.payment_status, vehicle_removal_requests.payment_status),
+                contact_email = COALESCE(EXCLUDED.contact_email, vehicle_removal_requests.contact_email),
+                data = vehicle_removal_requests.data || EXCLUDED.data,
+                updated_at = NOW()
+            """
+        ),
+        {
+            "case_id": case_id,
+            "status": status,
+            "payment_status": payment_status,
+            "contact_email": contact_email,
+            "data": json.dumps(payload or {}, ensure_ascii=False, default=str),
+        },
+    )
+
+
+def record_vehicle_removal_event(
+    conn,
+    case_id: str,
+    event_type: str,
+    payload: Optional[Dict[str, Any]] = None,
+    status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    contact_email: Optional[str] = None,
+) -> None:
+    """
+    Guarda el evento de ciclo de vida y actualiza el estado consolidado
+    en la misma transacción.
+    """
+    append_event(conn, case_id, event_type, payload or {})
+    state_payload = payload if event_type in VEHICLE_REMOVAL_STATE_EVENTS else {}
+    upsert_vehicle_removal_state(
+        conn,
+        case_id,
+        state_payload,
+        status=status,
+        payment_status=payment_status,
+        contact_email=contact_email,
+    )
+
+
+def get_vehicle_removal_state(conn, case_id: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(
+        text("SELECT data FROM vehicle_removal_requests WHERE case_id = :case_id"),
+        {"case_id": case_id},
+    ).fetchone()
+    if not row:
+        return None
+    return row[0] if isinstance(row[0], dict) else {}
+
+
+def replay_vehicle_removal_events(conn, case_id: str) -> Dict[str, Any]:
+    """Reconstruye el estado desde events (backfill / casos sin fila consolidada)."""
+    rows = conn.execute(
+        text(
+            """
+            SELECT payload
+            FROM events
+            WHERE case_id = :case_id
+              AND type = ANY(:types)
+            ORDER BY created_at ASC
+            """
+        ),
+        {"case_id": case_id, "types": list(VEHICLE_REMOVAL_STATE_EVENTS)},
+    ).fetchall()
+
+    merged: Dict[str, Any] = {}
+    for r in rows:
+        payload = r[0] if isinstance(r[0], dict) else {}
+        merged.update(payload)
+    return merged
+
+
+def backfill_vehicle_removal_state(conn) -> int:
+    """Crea/actualiza la fila consolidada de todos los casos vehicle_removal existentes."""
+    rows = conn.execute(
+        text(
+            """
+            SELECT id, status, payment_status, contact_email
+            FROM cases
+            WHERE category = 'vehicle_removal'
+               OR status LIKE 'vehicle_removal%'
+            """
+        )
+    ).fetchall()
+
+    for r in rows:
+        case_id = str(r[0])
+        upsert_vehicle_removal_state(
+            conn,
+            case_id,
+            replay_vehicle_removal_events(conn, case_id),
+            status=r[1],
+            payment_status=r[2],
+            contact_email=r[3],
+        )
+    return len(rows)
+
+
+def sync_vehicle_removal_payment(conn, case_id: str, payment_status: str = "paid") -> None:
+    """Refleja un cambio de pago (webhook Stripe). No hace nada si no es un caso vehicle_removal."""
+    conn.execute(
+        text(
+            """
+            UPDATE vehicle_removal_requests
+            SET payment_status = :ps, updated_at = NOW()
+            WHERE case_id = :case_id
+            """
+        ),
+        {"case_id": case_id, "ps": payment_status},
+    )
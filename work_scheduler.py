@@ -0,0 +1,491 @@
+# work_scheduler.py
+# Planificador por prioridad para el trabajo en segundo plano (tabla work_queue).
+#
+# - enqueue_work(conn, case_id, kind) encola en la misma transacción que el cambio de
+#   negocio. Es idempotente: un caso solo tiene un trabajo vivo por tipo; re-encolar
+#   refresca su prioridad.
+# - La prioridad usa el mismo modelo que la cola del operador (ops_queue_smart):
+#   la parte fija (estado, confianza, errores) se guarda al encolar y el plazo se
+#   calcula en SQL al reclamar, así un caso sube solo según se acerca el vencimiento.
+# - Anti-inanición: cada SCHED_AGING_MINUTES de espera suma un punto.
+# - Clases con concurrencia propia (entre todos los procesos, contando en BD bajo un
+#   advisory lock): urgent (plazo <= SCHED_URGENT_DAYS), paid y standard.
+# - Lo ejecuta un hilo de fondo (SCHEDULER_WORKER=true) y, siempre, el cron: el tick de
+#   POST /ops/automation/tick procesa todos los tipos (también /ops/automation/scheduler/tick).
+# - Un handler que lanza RetryLater (dependencia caída, no fallo del trabajo) se
+#   reprograma sin gastar intento: no acaba en failed por una caída larga.
+# - run_job(case_id, kind) ejecuta ya un trabajo concreto sin mirar el límite de su clase
+#   (el webhook de pago lo usa cuando no hay worker en el proceso).
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from database import get_engine
+from event_log import append_event
+from ops_queue_smart import DEADLINE_BONUS, _priority_score, _safe_confidence, _to_dt
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 120
+BACKOFF_MAX_SECONDS = 3 * 3600
+STALE_RUNNING_MINUTES = 30
+CLAIM_LOCK_KEY = 0x776F726B  # "work": pg_advisory_xact_lock de _claim
+
+# Tipo de trabajo -> "modulo:funcion(case_id, payload)". Se importan al ejecutar para
+# no crear ciclos (billing y ops_automation encolan y a la vez son handlers).
+HANDLERS: Dict[str, str] = {
+    "post_payment": "billing:run_post_payment",
+    "submit": "ops_automation:run_submit_job",
+    "llm_enrichment": "llm_enrichment:enrich_case",
+    "analysis": "partner_batch:run_analysis_job",
+}
+
+CLASSES = ("urgent", "paid", "standard")
+
+
+class RetryLater(Exception):
+    """El trabajo no ha fallado: hay que volver a intentarlo pasado delay_seconds."""
+
+    def __init__(self, reason: str, delay_seconds: float = 120.0) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.delay_seconds = delay_seconds
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(_env(name) or default)
+    except ValueError:
+        return default
+
+
+URGENT_DAYS = _env_int("SCHED_URGENT_DAYS", 3)
+AGING_MINUTES = max(_env_int("SCHED_AGING_MINUTES", 10), 1)
+
+
+def class_limits() -> Dict[str, int]:
+    return {
+        "urgent": _env_int("SCHED_LIMIT_URGENT", 4),
+        "paid": _env_int("SCHED_LIMIT_PAID", 3),
+        "standard": _env_int("SCHED_LIMIT_STANDARD", 2),
+    }
+
+
+def _backoff_seconds(attempts: int) -> int:
+    return min(BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), BACKOFF_MAX_SECONDS)
+
+
+def _deadline_sql() -> str:
+    """DEADLINE_BONUS de ops_queue_smart como CASE sobre (deadline - CURRENT_DATE)."""
+    parts = [f"WHEN deadline - CURRENT_DATE <= {int(days)} THEN {int(points)}" for days, points in DEADLINE_BONUS]
+    return "CASE WHEN deadline IS NULL THEN 0 " + " ".join(parts) + " ELSE 0 END"
+
+
+# =========================================================
+# ENCOLAR
+# =========================================================
+def _case_priority(conn, case_id: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(
+        text(
+            """
+            SELECT
+                COALESCE(c.status, 'uploaded'),
+                COALESCE(c.payment_status, ''),
+                c.deadline_main,
+                (SELECT e.payload->'deadlines'->>'before_resource_deadline'
+                   FROM events e
+                  WHERE e.case_id = c.id AND e.type = 'ai_expediente_result'
+                  ORDER BY e.created_at DESC LIMIT 1),
+                (SELECT x.confidence FROM extractions x
+                  WHERE x.case_id = c.id ORDER BY x.created_at DESC LIMIT 1),
+                EXISTS (SELECT 1 FROM events e
+                         WHERE e.case_id = c.id AND e.type = 'resource_generation_failed')
+            FROM cases c
+            WHERE c.id = :id
+            """
+        ),
+        {"id": case_id},
+    ).fetchone()
+    if not row:
+        return None
+
+    deadline = _to_dt(row[3] or row[2])
+    base_score = _priority_score(
+        status=row[0],
+        confidence=_safe_confidence(row[4]),
+        has_generation_error=bool(row[5]),
+        has_generated_pdf=True,
+        has_generated_docx=True,
+        days_to_deadline=None,
+    )
+    return {
+        "base_score": base_score,
+        "base_class": "paid" if row[1] == "paid" else "standard",
+        "deadline": deadline.date() if deadline else None,
+    }
+
+
+def enqueue_work(conn, case_id: str, kind: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+    """Encola (o refresca) el trabajo kind del caso. False si el caso no existe."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+    prio = _case_priority(conn, case_id)
+    if prio is None:
+        return False
+    conn.execute(
+        text(
+            """
+            INSERT INTO work_queue (case_id, kind, payload, base_class, base_score, deadline)
+            VALUES (:case_id, :kind, CAST(:payload AS JSONB), :base_class, :base_score, :deadline)
+            ON CONFLICT (case_id, kind) WHERE status IN ('queued', 'running')
+            DO UPDATE SET base_class = EXCLUDED.base_class,
+                          base_score = EXCLUDED.base_score,
+                          deadline = EXCLUDED.deadline
+            """
+        ),
+        {
+            "case_id": case_id,
+            "kind": kind,
+            "payload": json.dumps(payload or {}, ensure_ascii=False),
+            **prio,
+        },
+    )
+    return True
+
+
+# =========================================================
+# RECLAMAR
+# =========================================================
+def _claim(limit: int, kinds: Optional[List[str]]) -> List[Dict[str, Any]]:
+    limits = class_limits()
+    with get_engine().begin() as conn:
+        # Un reclamo a la vez entre procesos (cron, worker, webhook): si no, dos leen el
+        # mismo recuento de 'running' y cada uno llena la clase hasta su límite
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": CLAIM_LOCK_KEY})
+        running = {
+            r[0]: int(r[1])
+            for r in conn.execute(
+                text(
+                    """
+                    SELECT claimed_class, COUNT(*) FROM work_queue
+                    WHERE status = 'running' AND started_at >= NOW() - make_interval(mins => :stale)
+                    GROUP BY claimed_class
+                    """
+                ),
+                {"stale": STALE_RUNNING_MINUTES},
+            ).fetchall()
+        }
+
+        rows = conn.execute(
+            text(
+                f"""
+                SELECT id, case_id, kind, payload, attempts,
+                       CASE WHEN deadline IS NOT NULL AND deadline - CURRENT_DATE <= :urgent_days
+                            THEN 'urgent' ELSE base_class END AS klass,
+                       base_score + {_deadline_sql()}
+                         + FLOOR(EXTRACT(EPOCH FROM (NOW() - enqueued_at)) / 60 / :aging)::int AS score
+                FROM work_queue
+                WHERE ((status = 'queued' AND not_before <= NOW())
+                    OR (status = 'running' AND started_at < NOW() - make_interval(mins => :stale)))
+                  AND (:all_kinds OR kind = ANY(:kinds))
+                ORDER BY score DESC, enqueued_at ASC
+                LIMIT :scan
+                FOR UPDATE SKIP LOCKED
+                """
+            ),
+            {
+                "urgent_days": URGENT_DAYS,
+                "aging": AGING_MINUTES,
+                "stale": STALE_RUNNING_MINUTES,
+                "all_kinds": not kinds,
+                "kinds": list(kinds or []),
+                "scan": limit * 4,
+            },
+        ).fetchall()
+
+        picked: List[Dict[str, Any]] = []
+        for r in rows:
+            klass = r[5]
+            if running.get(klass, 0) >= limits.get(klass, 1):
+                continue
+            running[klass] = running.get(klass, 0) + 1
+            picked.append(
+                {
+                    "id": str(r[0]),
+                    "case_id": str(r[1]),
+                    "kind": r[2],
+                    "payload": r[3] if isinstance(r[3], dict) else {},
+                    "attempts": int(r[4] or 0) + 1,
+                    "class": klass,
+                    "score": int(r[6] or 0),
+                }
+            )
+            if len(picked) >= limit:
+                break
+
+        for job in picked:
+            conn.execute(
+                text(
+                    """
+                    UPDATE work_queue
+                    SET status = 'running', claimed_class = :klass, attempts = :attempts, started_at = NOW()
+                    WHERE id = :id
+                    """
+                ),
+                {"id": job["id"], "klass": job["class"], "attempts": job["attempts"]},
+            )
+    return picked
+
+
+def _claim_job(case_id: str, kind: str) -> Optional[Dict[str, Any]]:
+    """Reclama el trabajo vivo (case_id, kind) aunque su clase esté llena."""
+    with get_engine().begin() as conn:
+        r = conn.execute(
+            text(
+                """
+                SELECT id, case_id, kind, payload, attempts,
+                       CASE WHEN deadline IS NOT NULL AND deadline - CURRENT_DATE <= :urgent_days
+                            THEN 'urgent' ELSE base_class END AS klass,
+                       base_score
+                FROM work_queue
+                WHERE case_id = :case_id AND kind = :kind AND status = 'queued'
+                FOR UPDATE SKIP LOCKED
+                """
+            ),
+            {"case_id": case_id, "kind": kind, "urgent_days": URGENT_DAYS},
+        ).fetchone()
+        if not r:
+            return None
+        job = {
+            "id": str(r[0]),
+            "case_id": str(r[1]),
+            "kind": r[2],
+            "payload": r[3] if isinstance(r[3], dict) else {},
+            "attempts": int(r[4] or 0) + 1,
+            "class": r[5],
+            "score": int(r[6] or 0),
+        }
+        conn.execute(
+            text(
+                """
+                UPDATE work_queue
+                SET status = 'running', claimed_class = :klass, attempts = :attempts, started_at = NOW()
+                WHERE id = :id
+                """
+            ),
+            {"id": job["id"], "klass": job["class"], "attempts": job["attempts"]},
+        )
+    return job
+
+
+# =========================================================
+# EJECUTAR
+# =========================================================
+def _handler(kind: str) -> Callable[[str, Dict[str, Any]], Any]:
+    module_name, fn_name = HANDLERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), fn_name)
+
+
+def _finish(job: Dict[str, Any], error: Optional[str]) -> None:
+    with get_engine().begin() as conn:
+        if error is None:
+            conn.execute(
+                text("UPDATE work_queue SET status='done', finished_at=NOW(), last_error=NULL WHERE id=:id"),
+                {"id": job["id"]},
+            )
+            return
+
+        final = job["attempts"] >= MAX_ATTEMPTS
+        conn.execute(
+            text(
+                """
+                UPDATE work_queue
+                SET status = :status,
+                    last_error = :error,
+                    finished_at = CASE WHEN :final THEN NOW() ELSE NULL END,
+                    not_before = NOW() + make_interval(secs => :delay)
+                WHERE id = :id
+                """
+            ),
+            {
+                "id": job["id"],
+                "status": "failed" if final else "queued",
+                "final": final,
+                "error": error[:1000],
+                "delay": _backoff_seconds(job["attempts"]),
+            },
+        )
+        if final:
+            append_event(
+                conn,
+                job["case_id"],
+                "work_failed",
+                {"kind": job["kind"], "attempts": job["attempts"], "error": error[:300]},
+            )
+
+
+def _defer(job: Dict[str, Any], reason: str, delay_seconds: float) -> None:
+    """Vuelve a la cola sin contar el intento reclamado."""
+    with get_engine().begin() as conn:
+        conn.execute(
+            text(
+                """
+                UPDATE work_queue
+                SET status = 'queued',
+                    attempts = GREATEST(attempts - 1, 0),
+                    last_error = :error,
+                    not_before = NOW() + make_interval(secs => :delay)
+                WHERE id = :id
+                """
+            ),
+            {"id": job["id"], "error": f"deferred: {reason}"[:1000], "delay": max(float(delay_seconds), 1.0)},
+        )
+
+
+def _execute(job: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.monotonic()
+    deferred = False
+    try:
+        result = _handler(job["kind"])(job["case_id"], job["payload"])
+        error = None
+    except RetryLater as e:
+        result = None
+        deferred = True
+        error = f"deferred: {e.reason}"
+        _defer(job, e.reason, e.delay_seconds)
+    except Exception as e:
+        result = None
+        error = f"{type(e).__name__}: {getattr(e, 'detail', None) or e}"
+    if not deferred:
+        _finish(job, error)
+
+    out = {
+        "case_id": job["case_id"],
+        "kind": job["kind"],
+        "class": job["class"],
+        "score": job["score"],
+        "ok": error is None,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    if error is None:
+        out["result"] = result
+    else:
+        out["error"] = error
+    if deferred:
+        out["deferred"] = True
+    return out
+
+
+def run_due(limit: int = 10, kinds: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Reclama hasta limit trabajos por prioridad y los ejecuta en paralelo."""
+    jobs = _claim(limit, kinds)
+    if not jobs:
+        return {"ok": True, "picked": 0, "processed": 0, "failed": 0, "results": []}
+
+    with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="work") as pool:
+        results = list(pool.map(_execute, jobs))
+
+    ok = sum(1 for r in results if r["ok"])
+    return {"ok": True, "picked": len(jobs), "processed": ok, "failed": len(results) - ok, "results": results}
+
+
+def run_job(case_id: str, kind: str) -> Dict[str, Any]:
+    """Ejecuta ahora el trabajo encolado (case_id, kind). picked=0 si ya lo tiene otro."""
+    job = _claim_job(case_id, kind)
+    if job is None:
+        return {"ok": True, "picked": 0, "processed": 0, "failed": 0, "results": []}
+    result = _execute(job)
+    return {
+        "ok": True,
+        "picked": 1,
+        "processed": int(result["ok"]),
+        "failed": int(not result["ok"]),
+        "results": [result],
+    }
+
+
+def queue_stats() -> Dict[str, Any]:
+    with get_engine().connect() as conn:
+        rows = conn.execute(
+            text(
+                """
+                SELECT kind, status, COALESCE(claimed_class, base_class), COUNT(*),
+                       EXTRACT(EPOCH FROM (NOW() - MIN(enqueued_at)))
+                FROM work_queue
+                WHERE status IN ('queued', 'running')
+                   OR finished_at >= NOW() - INTERVAL '1 day'
+                GROUP BY 1, 2, 3
+                ORDER BY 1, 2, 3
+                """
+            )
+        ).fetchall()
+    return {
+        "limits": class_limits(),
+        "urgent_days": URGENT_DAYS,
+        "aging_minutes": AGING_MINUTES,
+        "groups": [
+            {
+                "kind": r[0],
+                "status": r[1],
+                "class": r[2],
+                "count": int(r[3]),
+                "oldest_seconds": int(r[4] or 0),
+            }
+            for r in rows
+        ],
+    }
+
+
+# =========================================================
+# WORKER EN SEGUNDO PLANO
+# =========================================================
+_wake = threading.Event()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def worker_enabled() -> bool:
+    return _env("SCHEDULER_WORKER", "false").lower() in ("1", "true", "yes")
+
+
+def wake_scheduler() -> None:
+    _wake.set()
+
+
+def _worker_loop() -> None:
+    interval = float(_env_int("SCHEDULER_POLL_SECONDS", 30))
+    batch = sum(class_limits().values())
+    while True:
+        if _wake.wait(timeout=interval):
+            # Deja que la transacción que encoló el trabajo haga commit
+            time.sleep(0.5)
+        _wake.clear()
+        try:
+            while run_due(limit=batch).get("picked", 0) >= batch:
+                pass
+        except Exception as e:
+            logger.warning("work_scheduler: fallo en el worker: %s", e)
+
+
+def start_scheduler_worker() -> bool:
+    """Arranca el hilo del planificador si SCHEDULER_WORKER=true. Idempotente."""
+    global _worker
+    if not worker_enabled():
+        return False
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="work-scheduler", daemon=True)
+            _worker.start()
+    return True